@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'storage.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -77,6 +78,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# wsgi - синхронные воркеры gunicorn, asgi - воркеры uvicorn,
+# скачивание файлов обслуживают асинхронные view
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+STORAGE_ASYNC_VIEWS = SERVER_MODE == 'asgi'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -137,7 +143,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'storage.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -147,9 +153,137 @@ REST_FRAMEWORK = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Где хранится содержимое файлов:
+# filesystem - каталог MEDIA_ROOT, s3 - S3-совместимое хранилище (AWS S3, MinIO, нужен boto3)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'filesystem')
+STORAGES = {
+    'default': {
+        'BACKEND': (
+            'storage.backends.S3Storage' if STORAGE_BACKEND == 's3'
+            else 'django.core.files.storage.FileSystemStorage'
+        ),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', '')  # пусто - AWS S3
+S3_BUCKET = os.environ.get('S3_BUCKET', 'my-cloud')
+S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY', '')
+S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY', '')
+S3_REGION = os.environ.get('S3_REGION', '')
+S3_PRESIGN_EXPIRATION = int(os.environ.get('S3_PRESIGN_EXPIRATION', 300))  # секунд
+S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024  # 64MB, больше - multipart-загрузка
+S3_MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024  # 16MB
+
 # Ограничение на размер файлов
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
+# Файлов в одном запросе пакетной загрузки /api/files/batch/ (по умолчанию в Django 100)
+DATA_UPLOAD_MAX_NUMBER_FILES = 1000
+# Временные файлы загрузок лежат на том же томе, что и хранилище,
+# чтобы готовый файл перемещался в хранилище без копирования
+STORAGE_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, '.tmp')
+
+# Квота хранилища на пользователя по умолчанию в байтах, пусто - без ограничений.
+# Для отдельных пользователей квоту задает админ
+STORAGE_DEFAULT_QUOTA = int(os.environ['STORAGE_DEFAULT_QUOTA']) if os.environ.get('STORAGE_DEFAULT_QUOTA') else None
+
+# Сжатие сжимаемых файлов (логи, CSV, текст) при записи в хранилище:
+# пусто - выключено, gzip или zstd (нужен пакет zstandard). Квота считается
+# по исходному размеру, см. storage.compression
+STORAGE_COMPRESSION = os.environ.get('STORAGE_COMPRESSION', '')
+
+# Способ отдачи файлов при скачивании:
+# django - байты отдает сам Django через FileResponse (работает без nginx),
+# nginx - Django только проверяет права и возвращает X-Accel-Redirect,
+# redirect - редирект на подписанную ссылку хранилища (STORAGE_BACKEND=s3)
+FILE_DELIVERY = os.environ.get('FILE_DELIVERY', 'django')
+FILE_DELIVERY_ACCEL_PREFIX = '/protected-media/'
+
+# Загрузка файлов по частям (chunked upload). При нескольких узлах бэкенда
+# с STORAGE_BACKEND=s3 каталог частей должен быть общим для всех узлов
+CHUNKED_UPLOAD_ROOT = os.path.join(MEDIA_ROOT, '.chunks')
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB, размер части по умолчанию
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 * 1024  # 32MB, должно быть меньше client_max_body_size в nginx
+CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', 10 * 1024 * 1024 * 1024))  # 10GB
+CHUNKED_UPLOAD_EXPIRATION = timedelta(days=1)
+# Загрузка дельтой /api/files/delta/ (storage.delta): границы размера части
+# при разбиении по содержимому, средний размер - около MIN + AVG. Незавершенные
+# загрузки удаляет cleanup_uploads через CHUNKED_UPLOAD_EXPIRATION
+DELTA_CHUNK_MIN_SIZE = 256 * 1024
+DELTA_CHUNK_AVG_SIZE = 1024 * 1024
+DELTA_CHUNK_MAX_SIZE = 4 * 1024 * 1024  # должно быть меньше client_max_body_size в nginx
+
+# Кэш. По умолчанию память процесса: инвалидация видна только в своем воркере,
+# поэтому TTL короткие. С REDIS_URL (нужен пакет redis) кэш общий для всех воркеров
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'my-cloud',
+        }
+    }
+STORAGE_CACHE_ALIAS = 'default'
+SHARE_LINK_CACHE_TIMEOUT = int(os.environ.get('SHARE_LINK_CACHE_TIMEOUT', 60))
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 60))
+
+# Ограничение частоты запросов к публичным ссылкам (storage.ratelimit): жетонов
+# в секунду и размер корзины на ссылку и на IP клиента, 0 - без ограничения.
+# memory - корзины в памяти каждого воркера, cache - общие, в кэше STORAGE_CACHE_ALIAS
+SHARE_RATE_LIMIT_BACKEND = os.environ.get('SHARE_RATE_LIMIT_BACKEND', 'memory')
+SHARE_LINK_RATE = float(os.environ.get('SHARE_LINK_RATE', 5))
+SHARE_LINK_BURST = int(os.environ.get('SHARE_LINK_BURST', 20))
+SHARE_IP_RATE = float(os.environ.get('SHARE_IP_RATE', 2))
+SHARE_IP_BURST = int(os.environ.get('SHARE_IP_BURST', 30))
+# Заголовок с адресом клиента, который выставляет nginx; пусто - REMOTE_ADDR.
+# Задается только за прокси (docker-compose): если бэкенд доступен напрямую,
+# клиент подделает заголовок и обойдет ограничение по IP
+CLIENT_IP_HEADER = os.environ.get('CLIENT_IP_HEADER', '')
+
+# Максимум файлов в одном архиве при массовом скачивании
+ARCHIVE_MAX_FILES = 1000
+
+# Скачивания копятся в памяти и записываются в БД пачкой раз в столько секунд,
+# 0 - запись при каждом скачивании
+DOWNLOAD_STATS_FLUSH_INTERVAL = float(os.environ.get('DOWNLOAD_STATS_FLUSH_INTERVAL', 5))
+
+# Превью изображений и PDF (storage.previews): число процессов пула
+# (0 - строить в процессе запроса), сторона превью в пикселях, предельный
+# размер исходного файла и через сколько секунд зависшее превью строится заново
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+PREVIEW_SIZE = 320
+PREVIEW_MAX_SOURCE_SIZE = 50 * 1024 * 1024
+PREVIEW_RETRY_AFTER = 300
+
+# Очередь фоновых задач в БД (storage.jobs, воркер - manage.py run_jobs):
+# число попыток, задержка перед первым повтором (дальше удваивается),
+# через сколько секунд задача умершего воркера выдается снова и сколько
+# хранятся выполненные задачи
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_LEASE_TIMEOUT = 600
+JOB_RETENTION = timedelta(days=7)
+
+# Лента изменений файлов /api/changes/ (storage.changes): сколько секунд
+# не больше ждет long-poll запрос (меньше таймаута прокси), как часто он
+# проверяет новые события и сколько хранятся события удаления. Клиенту,
+# не синхронизировавшемуся дольше CHANGES_RETENTION, нужна полная синхронизация
+CHANGES_MAX_WAIT = int(os.environ.get('CHANGES_MAX_WAIT', 25))
+CHANGES_POLL_INTERVAL = 1.0
+CHANGES_RETENTION = timedelta(days=int(os.environ.get('CHANGES_RETENTION_DAYS', 30)))
+
+# Запросы дольше стольких секунд пишутся в лог как медленные (storage.metrics)
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 1.0))
+# Токен для сборщика метрик (заголовок X-Metrics-Token), пусто - /api/metrics только для админов
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 
 # CORS Настройки
 # CORS_ALLOWED_ORIGINS = [
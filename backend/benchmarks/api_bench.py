@@ -0,0 +1,338 @@
+"""
+Бенчмарк API хранилища: пропускная способность и задержки p50/p90/p99.
+
+Запускается против локального стенда (SQLite или PostgreSQL, файловое
+хранилище). Данные сначала создаются командой seed_benchmark:
+
+    python manage.py seed_benchmark --list-sizes 1000,10000,100000 --reset
+    python manage.py runserver --noreload   # или gunicorn
+    python benchmarks/api_bench.py --base-url http://localhost:8000 \\
+        --output results/$(git rev-parse --short HEAD).json
+    python benchmarks/api_bench.py --compare results/old.json results/new.json
+
+Сценарии: загрузка файлов разных размеров, пакетная загрузка мелких
+файлов (/api/files/batch/, в отчете и files_per_s), скачивание, информация о
+шаред-ссылке и скачивание по ней, список файлов у пользователей с 1k/10k/100k
+файлов, /api/auth/me/. Результат - один JSON-документ, по которому
+--compare строит разницу между двумя запусками.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+
+READ_SIZE = 64 * 1024
+DEFAULT_UPLOAD_SIZES = '1024,1048576,16777216'
+SCENARIOS = ('upload', 'batch_upload', 'download', 'share_info', 'share_download', 'list', 'me')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class Client:
+    """HTTP-клиент с keep-alive, по одному соединению на поток."""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.secure = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.secure else 80)
+        self.timeout = timeout
+        self.token = None
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            connection = connection_class(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def request(self, method, path, body=None, headers=None, token=None):
+        """Возвращает (статус, байт в теле, тело или None для больших ответов, секунды)."""
+        headers = dict(headers or {})
+        token = token or self.token
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+
+        started = time.perf_counter()
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Сервер закрыл keep-alive соединение, повторяем на новом
+            connection.close()
+            self._local.connection = None
+            connection = self._connection()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+
+        received = 0
+        chunks = []
+        while block := response.read(READ_SIZE):
+            received += len(block)
+            if received <= READ_SIZE * 16:
+                chunks.append(block)
+        elapsed = time.perf_counter() - started
+        if response.getheader('Connection', '').lower() == 'close':
+            connection.close()
+            self._local.connection = None
+        body = b''.join(chunks) if received <= READ_SIZE * 16 else None
+        return response.status, received, body, elapsed
+
+    def json(self, method, path, payload=None, token=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        status, _, body, _ = self.request(method, path, body, headers, token=token)
+        if status >= 400:
+            raise RuntimeError(f'{method} {path}: HTTP {status} {body[:200] if body else b""}')
+        return json.loads(body) if body else None
+
+    def login(self, username, password):
+        return self.json('POST', '/api/auth/login/', {'username': username, 'password': password})['access']
+
+
+def multipart(name, content):
+    return multipart_many([(name, content)], 'file')
+
+
+def multipart_many(files, field):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, content in files:
+        parts.append((
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def measure(name, client, requests, concurrency, make_request, expected=(200,), params=None):
+    """Выполняет requests вызовов make_request(i) в concurrency потоков."""
+    def call(i):
+        method, path, body, headers, token = make_request(i)
+        return client.request(method, path, body, headers, token=token)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    wall = time.perf_counter() - started
+
+    ok = [r for r in results if r[0] in expected]
+    latencies = [r[3] for r in ok]
+    received = sum(r[1] for r in ok)
+    return {
+        'scenario': name,
+        'params': params or {},
+        'requests': requests,
+        'concurrency': concurrency,
+        'completed': len(ok),
+        'failed': len(results) - len(ok),
+        'statuses': sorted({r[0] for r in results}),
+        'wall_time_s': round(wall, 4),
+        'requests_per_s': round(len(ok) / wall, 2) if wall else None,
+        'received_mb_s': round(received / wall / 1024 / 1024, 3) if wall else None,
+        'latency_p50_ms': _ms(percentile(latencies, 0.5)),
+        'latency_p90_ms': _ms(percentile(latencies, 0.9)),
+        'latency_p99_ms': _ms(percentile(latencies, 0.99)),
+        'latency_mean_ms': _ms(statistics.fmean(latencies) if latencies else None),
+        'latency_max_ms': _ms(max(latencies) if latencies else None),
+    }, results
+
+
+def _ms(value):
+    return round(value * 1000, 3) if value is not None else None
+
+
+def bench_upload(client, args, token, sizes):
+    results = []
+    for size in sizes:
+        content = os.urandom(size)
+        uploaded = []
+
+        def make_request(i, size=size, content=content):
+            body, content_type = multipart(f'bench-upload-{size}-{i}.bin', content)
+            return 'POST', '/api/files/', body, {'Content-Type': content_type}, token
+
+        # Большие файлы загружаются реже, чтобы прогон занимал разумное время
+        requests = max(1, min(args.requests, args.upload_bytes // size))
+        result, raw = measure('upload', client, requests, args.concurrency, make_request,
+                              expected=(201,), params={'size': size})
+        result['sent_mb_s'] = round(size * result['completed'] / result['wall_time_s'] / 1024 / 1024, 3)
+        results.append(result)
+
+        for status, _, body, _ in raw:
+            if status == 201 and body:
+                uploaded.append(json.loads(body)['id'])
+        if uploaded:
+            # Загруженное удаляется, чтобы повторные прогоны шли на тех же данных
+            client.json('POST', '/api/files/bulk_delete/', {'ids': uploaded}, token=token)
+    return results
+
+
+def bench_batch_upload(client, args, token):
+    """Пакеты по --batch-files мелких файлов: сколько файлов в секунду принимает сервер."""
+    content = os.urandom(args.batch_file_size)
+    uploaded = []
+
+    def make_request(i):
+        files = [(f'bench-batch-{i}-{n}.bin', content) for n in range(args.batch_files)]
+        body, content_type = multipart_many(files, 'files')
+        return 'POST', '/api/files/batch/', body, {'Content-Type': content_type}, token
+
+    requests = max(1, args.requests // 10)
+    result, raw = measure('batch_upload', client, requests, args.concurrency, make_request, expected=(201,),
+                          params={'files': args.batch_files, 'size': args.batch_file_size})
+    result['files_per_s'] = round(result['completed'] * args.batch_files / result['wall_time_s'], 2)
+    for status, _, body, _ in raw:
+        if status == 201 and body:
+            uploaded += [item['id'] for item in json.loads(body)['files'] if 'id' in item]
+    for start in range(0, len(uploaded), 1000):
+        client.json('POST', '/api/files/bulk_delete/', {'ids': uploaded[start:start + 1000]}, token=token)
+    return result
+
+
+def run(args):
+    with open(args.manifest) as source:
+        manifest = json.load(source)
+    users = manifest['users']
+    client = Client(args.base_url, args.timeout)
+
+    tokens = {size: client.login(user['username'], user['password']) for size, user in users.items()}
+    smallest = min(users, key=int)
+    token = tokens[smallest]
+    user = users[smallest]
+    scenarios = args.scenarios.split(',') if args.scenarios else SCENARIOS
+    results = []
+
+    def simple(name, path, token=None, params=None):
+        result, _ = measure(name, client, args.requests, args.concurrency,
+                            lambda i: ('GET', path, None, {}, token), params=params)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+
+    if 'upload' in scenarios:
+        for result in bench_upload(client, args, token, [int(size) for size in args.upload_sizes.split(',')]):
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+    if 'batch_upload' in scenarios:
+        result = bench_batch_upload(client, args, token)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+    if 'download' in scenarios:
+        simple('download', f"/api/files/{user['file_id']}/download/", token, {'size': manifest['file_size']})
+    if 'share_info' in scenarios:
+        simple('share_info', f"/api/files/share/{user['share_link']}/info/")
+    if 'share_download' in scenarios:
+        simple('share_download', f"/api/files/share/{user['share_link']}/", params={'size': manifest['file_size']})
+    if 'list' in scenarios:
+        for size in sorted(users, key=int):
+            query = urlencode({'page_size': args.page_size})
+            simple('list', f'/api/files/?{query}', tokens[size], {'files': int(size), 'page_size': args.page_size})
+            query = urlencode({'page_size': args.page_size, 'ordering': '-size', 'name': 'bench_00'})
+            simple('list_search', f'/api/files/?{query}', tokens[size], {'files': int(size), 'page_size': args.page_size})
+    if 'me' in scenarios:
+        simple('me', '/api/auth/me/', token)
+
+    return {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'git_commit': _git_commit(),
+            'base_url': args.base_url,
+            'database': manifest.get('database'),
+            'python': platform.python_version(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'results': results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return result['scenario'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(baseline_path, current_path):
+    """Разница p50/p99 и пропускной способности между двумя прогонами, в процентах."""
+    with open(baseline_path) as source:
+        baseline = {_key(r): r for r in json.load(source)['results']}
+    with open(current_path) as source:
+        current = json.load(source)['results']
+
+    rows = []
+    for result in current:
+        before = baseline.get(_key(result))
+        if before is None:
+            continue
+        row = {'scenario': result['scenario'], 'params': result['params']}
+        for metric in ('latency_p50_ms', 'latency_p99_ms', 'requests_per_s'):
+            old, new = before.get(metric), result.get(metric)
+            row[metric] = {'before': old, 'after': new,
+                           'change_pct': round((new - old) / old * 100, 1) if old and new is not None else None}
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--manifest', default='benchmarks/manifest.json', help='файл от seed_benchmark')
+    parser.add_argument('--scenarios', help=f'через запятую из: {", ".join(SCENARIOS)}; по умолчанию все')
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8, help='одновременных клиентов')
+    parser.add_argument('--upload-sizes', default=DEFAULT_UPLOAD_SIZES, help='размеры загрузок в байтах')
+    parser.add_argument('--upload-bytes', type=int, default=256 * 1024 * 1024,
+                        help='предел объема загрузок на один размер, байт')
+    parser.add_argument('--batch-files', type=int, default=100, help='файлов в одном пакете batch_upload')
+    parser.add_argument('--batch-file-size', type=int, default=1024, help='размер файла в пакете, байт')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='куда записать результат, по умолчанию stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='сравнить два файла результатов и выйти')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), ensure_ascii=False, indent=2))
+        return
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as target:
+            target.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
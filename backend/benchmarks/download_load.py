@@ -0,0 +1,127 @@
+"""
+Нагрузочный тест скачивания: много одновременных медленных клиентов.
+
+Сравнивает синхронный (SERVER_MODE=wsgi) и асинхронный (SERVER_MODE=asgi)
+режимы бэкенда. Оба стенда поднимаются с FILE_DELIVERY=django, чтобы байты
+шли через Django, а не через nginx. Каждый клиент скачивает файл по
+шаред-ссылке и читает тело с ограниченной скоростью, как клиент на плохом канале.
+
+    python benchmarks/download_load.py \\
+        --target wsgi=http://localhost:8000/api/files/share/<uuid>/ \\
+        --target asgi=http://localhost:8001/api/files/share/<uuid>/ \\
+        --clients 500 --rate 262144
+
+Результаты печатаются в stdout в JSON, по одному объекту на стенд.
+"""
+import argparse
+import asyncio
+import json
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+READ_SIZE = 64 * 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+async def fetch(url, rate, timeout):
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None),
+        timeout
+    )
+    try:
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n'.encode()
+        )
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        status = int(status_line.split()[1])
+        first_byte = time.perf_counter() - started
+        while (await asyncio.wait_for(reader.readline(), timeout)) not in (b'\r\n', b''):
+            pass
+
+        received = 0
+        while True:
+            block = await asyncio.wait_for(reader.read(READ_SIZE), timeout)
+            if not block:
+                break
+            received += len(block)
+            if rate:
+                # Медленный клиент: не читаем быстрее rate байт в секунду
+                expected = received / rate
+                elapsed = time.perf_counter() - started - first_byte
+                if expected > elapsed:
+                    await asyncio.sleep(expected - elapsed)
+    finally:
+        writer.close()
+
+    return status, first_byte, time.perf_counter() - started, received
+
+
+async def run_target(name, url, clients, rate, timeout):
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(fetch(url, rate, timeout) for _ in range(clients)),
+        return_exceptions=True
+    )
+    wall = time.perf_counter() - started
+
+    ok = [r for r in results if not isinstance(r, BaseException) and r[0] == 200]
+    failed = len(results) - len(ok)
+    first_bytes = [r[1] for r in ok]
+    durations = [r[2] for r in ok]
+    total_bytes = sum(r[3] for r in ok)
+
+    return {
+        'target': name,
+        'url': url,
+        'clients': clients,
+        'rate_limit_bytes_per_s': rate,
+        'completed': len(ok),
+        'failed': failed,
+        'wall_time_s': round(wall, 3),
+        'throughput_mb_s': round(total_bytes / wall / 1024 / 1024, 3) if wall else None,
+        'ttfb_p50_s': percentile(first_bytes, 0.5),
+        'ttfb_p99_s': percentile(first_bytes, 0.99),
+        'duration_p50_s': percentile(durations, 0.5),
+        'duration_p99_s': percentile(durations, 0.99),
+        'duration_mean_s': statistics.fmean(durations) if durations else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True,
+                        help='имя=URL стенда, можно указать несколько раз')
+    parser.add_argument('--clients', type=int, default=200, help='число одновременных клиентов')
+    parser.add_argument('--rate', type=int, default=256 * 1024,
+                        help='скорость чтения одного клиента в байтах/с, 0 - без ограничения')
+    parser.add_argument('--timeout', type=float, default=600, help='таймаут операции чтения, с')
+    args = parser.parse_args()
+
+    for target in args.target:
+        name, _, url = target.partition('=')
+        if not url:
+            name, url = url or name, name
+        result = asyncio.run(run_target(name, url, args.clients, args.rate, args.timeout))
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
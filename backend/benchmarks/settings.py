@@ -0,0 +1,58 @@
+"""
+Настройки локального стенда для бенчмарков (benchmarks/api_bench.py).
+
+    export DJANGO_SETTINGS_MODULE=benchmarks.settings
+    python manage.py migrate
+    python manage.py seed_benchmark --reset
+    gunicorn backend.wsgi:application --workers 4
+
+По умолчанию SQLite в benchmarks/.data, BENCH_DB=postgres - локальный
+PostgreSQL (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST). В SQLite писать может
+только одно соединение за раз: параллельные загрузки ждут блокировку,
+и это видно в результатах как рост задержки, а не как ошибки.
+"""
+import os
+
+for name, value in (
+    ('SECRET_KEY', 'benchmark'),
+    ('DEBUG', ''),
+    ('ALLOWED_HOSTS', '*'),
+    ('DB_NAME', 'mycloud'),
+    ('DB_USER', 'mycloud'),
+    ('DB_PASSWORD', ''),
+):
+    os.environ.setdefault(name, value)
+
+from backend.settings import *  # noqa: E402,F401,F403
+from backend.settings import BASE_DIR, DATABASES  # noqa: E402
+
+
+BENCH_DATA_DIR = os.path.join(BASE_DIR, 'benchmarks', '.data')
+os.makedirs(BENCH_DATA_DIR, exist_ok=True)
+
+if os.environ.get('BENCH_DB', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BENCH_DATA_DIR, 'db.sqlite3'),
+            'OPTIONS': {
+                # Запись ждет блокировку, а не падает с "database is locked"
+                'timeout': 60,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
+    }
+else:
+    DATABASES['default']['HOST'] = os.environ.get('DB_HOST', 'localhost')
+    DATABASES['default']['PORT'] = os.environ.get('DB_PORT', '5432')
+
+MEDIA_ROOT = os.path.join(BENCH_DATA_DIR, 'media')
+STORAGE_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, '.tmp')
+CHUNKED_UPLOAD_ROOT = os.path.join(MEDIA_ROOT, '.chunks')
+STORAGE_DEFAULT_QUOTA = None
+FILE_DELIVERY = 'django'
+# Бенчмарк сам нагружает одну публичную ссылку с одного адреса,
+# ограничение частоты превратило бы замер в подсчет ответов 429
+SHARE_LINK_RATE = 0
+SHARE_IP_RATE = 0
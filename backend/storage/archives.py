@@ -0,0 +1,122 @@
+"""
+Потоковая упаковка нескольких файлов в zip или tar.
+
+Архив собирается на лету по мере отправки: в памяти держится только
+текущий блок файла, временный файл на диске не создается.
+"""
+import tarfile
+import zipfile
+import zlib
+
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from . import compression
+from .downloads import STREAM_BLOCK_SIZE, streaming_body
+
+
+FORMATS = ('zip', 'tar')
+TAR_RECORD_SIZE = tarfile.RECORDSIZE
+
+
+class _Sink:
+    """Буфер, куда пишет zipfile; содержимое забирается после каждой записи."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _read_blocks(file_obj):
+    with compression.open_file(file_obj) as source:
+        while True:
+            block = source.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def iter_zip(files, compress=True):
+    # Выходной поток не поддерживает seek, поэтому zipfile пишет размеры
+    # и CRC после данных каждого файла (data descriptor)
+    sink = _Sink()
+    method = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, 'w', compression=method, allowZip64=True) as archive:
+        for file_obj in files:
+            info = zipfile.ZipInfo(file_obj.original_name, date_time=file_obj.upload_date.timetuple()[:6])
+            info.compress_type = method
+            info.file_size = file_obj.size
+            with archive.open(info, 'w') as target:
+                for block in _read_blocks(file_obj):
+                    target.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_tar(files, compress=False):
+    # tarfile.addfile копирует файл целиком за один вызов, поэтому заголовки
+    # и выравнивание пишем сами, а содержимое отдаем блоками.
+    # compress=True - tar.gz потоковым zlib
+    encoder = zlib.compressobj(wbits=31) if compress else None
+    written = 0
+
+    def output(data):
+        nonlocal written
+        written += len(data)
+        return encoder.compress(data) if encoder else data
+
+    for file_obj in files:
+        info = tarfile.TarInfo(file_obj.original_name)
+        info.size = file_obj.size
+        info.mtime = int(file_obj.upload_date.timestamp())
+        info.mode = 0o644
+        yield output(info.tobuf(tarfile.PAX_FORMAT, encoding='utf-8'))
+        for block in _read_blocks(file_obj):
+            yield output(block)
+        yield output(b'\0' * (-file_obj.size % tarfile.BLOCKSIZE))
+
+    # Два пустых блока в конце и добивка до размера записи, как у tarfile
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(written + end) % TAR_RECORD_SIZE
+    yield output(b'\0' * end)
+    if encoder:
+        yield encoder.flush()
+
+
+def _skip_empty(chunks):
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+    finally:
+        chunks.close()
+
+
+def archive_response(files, archive_format='zip', compress=True, asynchronous=False):
+    if archive_format == 'zip':
+        chunks, content_type, filename = iter_zip(files, compress), 'application/zip', 'files.zip'
+    elif compress:
+        chunks, content_type, filename = iter_tar(files, True), 'application/gzip', 'files.tar.gz'
+    else:
+        chunks, content_type, filename = iter_tar(files), 'application/x-tar', 'files.tar'
+
+    response = StreamingHttpResponse(
+        streaming_body(_skip_empty(chunks), asynchronous),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
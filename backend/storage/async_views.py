@@ -0,0 +1,160 @@
+"""
+Асинхронные версии эндпоинтов скачивания для запуска под ASGI (SERVER_MODE=asgi).
+
+Повторяют поведение FileViewSet.download, download_shared и share_file_info,
+но не занимают поток воркера на время передачи файла: ORM вызывается через
+асинхронный API, а тело ответа отдается асинхронным итератором. Так же
+change_feed повторяет ChangesView, но ждет событий long-poll без потока.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import changes, download_stats, sharing
+from .authentication import CachedJWTAuthentication
+from .downloads import DELIVERED_STATUSES, counts_as_download, file_response
+from .models import File
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _authenticate(request):
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if not result:
+        return None
+    # Как и DRF, оставляем пользователя в запросе: его видит MetricsMiddleware
+    request.user = result[0]
+    return result[0]
+
+
+def _not_authenticated():
+    response = JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=401)
+    response['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response
+
+
+@sync_to_async
+def _resolve_link(request, share_link, download=False):
+    return sharing.resolve(request, share_link, download=download)
+
+
+def _share_denied(denied):
+    return JsonResponse(denied.data, status=denied.status, headers=denied.headers)
+
+
+async def _send_file(request, file_obj):
+    response = await sync_to_async(file_response)(request, file_obj, asynchronous=True)
+    if counts_as_download(request, response):
+        await sync_to_async(download_stats.record)(file_obj.pk)
+    return response
+
+
+@require_safe
+async def download(request, pk):
+    user = await _authenticate(request)
+    if user is None:
+        return _not_authenticated()
+
+    try:
+        file_obj = await File.objects.select_related('blob').aget(pk=pk)
+
+        if not file_obj.file:
+            logger.error(f"Файл ID:{pk} существует в БД, но отсутствует в хранилище")
+            return JsonResponse({"error": "Файл недоступен для скачивания"}, status=410)
+
+        if not user.is_staff and file_obj.owner_id != user.id:
+            logger.warning(
+                f"Попытка несанкционированного доступа к файлу ID:{pk} пользователем {user}"
+            )
+            return JsonResponse({"detail": "У вас нет прав для скачивания этого файла"}, status=403)
+
+        response = await _send_file(request, file_obj)
+        if response.status_code in DELIVERED_STATUSES:
+            logger.info(f'Скачивание файла {file_obj.original_name}, владельцем или админом')
+        return response
+
+    except File.DoesNotExist:
+        logger.info(f"Попытка доступа к несуществующему файлу ID:{pk}")
+        return JsonResponse({"error": "Файл не найден"}, status=404)
+
+    except Exception:
+        logger.exception(f"Ошибка при скачивании файла ID:{pk}")
+        return JsonResponse({"error": "Внутренняя ошибка сервера"}, status=500)
+
+
+@require_safe
+async def download_shared(request, share_link):
+    try:
+        link = await _resolve_link(request, share_link, download=True)
+    except sharing.ShareDenied as denied:
+        return _share_denied(denied)
+
+    file_obj = link.file
+    try:
+        response = await _send_file(request, file_obj)
+    except Exception:
+        # Как и в FileViewSet.download_shared: неудачный запрос не расходует скачивание
+        await sync_to_async(sharing.refund)(link)
+        raise
+    if response.status_code in DELIVERED_STATUSES:
+        logger.info(f'Скачивание файла {file_obj.original_name}, по шаред-ссылке')
+    else:
+        await sync_to_async(sharing.refund)(link)
+    return response
+
+
+@require_safe
+async def share_file_info(request, share_link):
+    try:
+        link = await _resolve_link(request, share_link)
+    except sharing.ShareDenied as denied:
+        return _share_denied(denied)
+
+    file_obj = link.file
+    return JsonResponse({
+        'original_name': file_obj.original_name,
+        'size': file_obj.size,
+        'upload_date': file_obj.upload_date,
+        'last_download': file_obj.last_download,
+        'comment': file_obj.comment,
+        'expires_at': link.expires_at,
+        'downloads_left': link.max_downloads - link.download_count if link.max_downloads is not None else None,
+    })
+
+
+@require_safe
+async def change_feed(request):
+    user = await _authenticate(request)
+    if user is None:
+        return _not_authenticated()
+
+    try:
+        cursor, limit, wait = changes.parse_params(request.GET)
+    except changes.ChangesError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if cursor is None:
+        return JsonResponse({'events': [], 'cursor': await sync_to_async(changes.latest)(user.id), 'has_more': False})
+
+    deadline = time.monotonic() + wait
+    while wait and not await sync_to_async(changes.has_changes)(user.id, cursor):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(settings.CHANGES_POLL_INTERVAL, remaining))
+
+    try:
+        return JsonResponse(await sync_to_async(changes.read)(user.id, cursor, limit))
+    except changes.CursorExpired as e:
+        return JsonResponse({"error": str(e), "reset": True}, status=410)
@@ -0,0 +1,21 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication, который берет пользователя из кэша вместо запроса
+    к БД на каждый запрос. Запись сбрасывается при сохранении и удалении
+    пользователя (смена прав, блокировка), неактивные пользователи не кэшируются.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Токен не содержит идентификатор пользователя")
+
+        return cache.get_user(user_id, lambda: super(CachedJWTAuthentication, self).get_user(validated_token))
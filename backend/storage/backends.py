@@ -0,0 +1,211 @@
+"""
+Хранилище файлов в S3-совместимом объектном хранилище (AWS S3, MinIO).
+
+Включается STORAGE_BACKEND=s3. Пакет boto3 нужен только в этом режиме
+и импортируется при первом обращении к хранилищу.
+"""
+import io
+import logging
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+
+logger = logging.getLogger(__name__)
+
+
+def _import_boto3():
+    try:
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+    except ImportError:
+        raise ImproperlyConfigured('Для STORAGE_BACKEND=s3 нужен пакет boto3: pip install -r requirements-s3.txt')
+    return boto3, TransferConfig, Config, ClientError
+
+
+def _is_not_found(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+class S3ObjectFile(io.RawIOBase):
+    """
+    Объект S3, открытый на чтение. Тело читается потоком, seek переоткрывает
+    его запросом с Range, поэтому Range-запросы к файлу не качают его целиком.
+    """
+
+    def __init__(self, storage, name):
+        self._storage = storage
+        self.name = name
+        self._position = 0
+        self._body = None
+        self._size = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._storage.size(self.name)
+        return self._size
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self._position:
+            self._close_body()
+            self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        if self._body is None:
+            if self._size is not None and self._position >= self._size:
+                return 0
+            params = {'Bucket': self._storage.bucket_name, 'Key': self.name}
+            if self._position:
+                params['Range'] = f'bytes={self._position}-'
+            try:
+                response = self._storage.client.get_object(**params)
+            except self._storage.client_error as e:
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    return 0
+                raise
+            self._body = response['Body']
+            self._size = self._position + response['ContentLength']
+
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Файлы сохраняются объектами в бакете. Большие файлы загружаются
+    multipart-загрузкой частями по multipart_chunk_size, url() отдает
+    подписанную ссылку для скачивания напрямую из хранилища.
+    """
+
+    def __init__(self, bucket_name=None, endpoint_url=None, access_key=None, secret_key=None,
+                 region_name=None, presign_expiration=None, multipart_threshold=None,
+                 multipart_chunk_size=None):
+        self.bucket_name = bucket_name or settings.S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.S3_ENDPOINT_URL
+        self.access_key = access_key or settings.S3_ACCESS_KEY
+        self.secret_key = secret_key or settings.S3_SECRET_KEY
+        self.region_name = region_name or settings.S3_REGION
+        self.presign_expiration = presign_expiration or settings.S3_PRESIGN_EXPIRATION
+        self.multipart_threshold = multipart_threshold or settings.S3_MULTIPART_THRESHOLD
+        self.multipart_chunk_size = multipart_chunk_size or settings.S3_MULTIPART_CHUNK_SIZE
+
+    @cached_property
+    def _boto3(self):
+        return _import_boto3()
+
+    @cached_property
+    def client(self):
+        boto3, _, Config, _ = self._boto3
+        return boto3.client(
+            's3',
+            endpoint_url=self.endpoint_url or None,
+            aws_access_key_id=self.access_key or None,
+            aws_secret_access_key=self.secret_key or None,
+            region_name=self.region_name or None,
+            config=Config(signature_version='s3v4', s3={'addressing_style': 'path'}),
+        )
+
+    @property
+    def client_error(self):
+        return self._boto3[3]
+
+    @cached_property
+    def transfer_config(self):
+        TransferConfig = self._boto3[1]
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunk_size,
+        )
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('Объекты S3 открываются только на чтение')
+        return DjangoFile(S3ObjectFile(self, name), name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek') and content.seekable():
+            content.seek(0)
+        # upload_fileobj сам переходит на multipart-загрузку после multipart_threshold
+        # и отправляет части параллельно, не читая файл в память целиком
+        self.client.upload_fileobj(
+            content, self.bucket_name, name,
+            ExtraArgs={'ContentType': 'application/octet-stream'},
+            Config=self.transfer_config,
+        )
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket_name, Key=name)
+
+    def _head(self, name):
+        return self.client.head_object(Bucket=self.bucket_name, Key=name)
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except self.client_error as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        return self._head(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        return self._head(name)['LastModified']
+
+    def listdir(self, path):
+        prefix = f"{path.rstrip('/')}/" if path else ''
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            directories.extend(p['Prefix'][len(prefix):].rstrip('/') for p in page.get('CommonPrefixes', []))
+            files.extend(o['Key'][len(prefix):] for o in page.get('Contents', []))
+        return directories, files
+
+    def presigned_url(self, name, filename=None, expires=None):
+        """Подписанная ссылка на скачивание, filename попадает в Content-Disposition ответа."""
+        params = {'Bucket': self.bucket_name, 'Key': name}
+        if filename:
+            params['ResponseContentDisposition'] = f"attachment; filename*=utf-8''{quote(filename)}"
+        return self.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expires or self.presign_expiration
+        )
+
+    def url(self, name):
+        return self.presigned_url(name)
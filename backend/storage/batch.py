@@ -0,0 +1,113 @@
+"""
+Пакетная загрузка: много файлов одним multipart-запросом.
+
+Содержимое каждого файла уже сохранено в блоб обработчиком
+BlobStoringUploadHandler, пока запрос читался. Здесь создаются записи:
+имена подбираются для всего пакета сразу (storage.naming.allocate_names),
+строки вставляются одним bulk_create, а работа сигнала post_save
+(StorageUsage, размеры папок, события ленты изменений), задачи проверки и превью выполняются
+пачкой. На 1000 мелких файлов это десятки запросов к БД вместо тысяч.
+"""
+import logging
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+
+from . import jobs, previews
+from .models import Blob, File, FileEvent, Folder, StorageUsage
+from .naming import NameAllocationFailed, allocate_names, is_name_conflict, new_storage_path, save_with_unique_name
+
+
+logger = logging.getLogger(__name__)
+
+
+# Коды ошибок отдельных файлов пакета и тексты для пользователя: текст
+# исключения БД с именами таблиц и ограничений клиенту не отдается
+NAME_CONFLICT = 'name_conflict'
+SAVE_FAILED = 'save_failed'
+ERRORS = {
+    NAME_CONFLICT: 'Не удалось подобрать свободное имя файла, попробуйте еще раз',
+    SAVE_FAILED: 'Не удалось сохранить файл',
+}
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def _insert(files):
+    """
+    Вставляет files одним запросом и обновляет счетчики. При конфликте имен
+    (имя заняли параллельно) файлы сохраняются по одному с подбором имени,
+    счетчики тогда обновляет сигнал. Возвращает список: File или код ошибки.
+    """
+    try:
+        with transaction.atomic():
+            File.objects.bulk_create(files)
+    except IntegrityError as e:
+        if not is_name_conflict(e):
+            raise
+        logger.info(f'Конфликт имен в пакетной загрузке, файлы сохраняются по одному: {e}')
+        results = []
+        for file_obj in files:
+            try:
+                results.append(save_with_unique_name(file_obj))
+            except NameAllocationFailed:
+                results.append(NAME_CONFLICT)
+            except IntegrityError:
+                logger.exception(f'Не удалось сохранить файл {file_obj.original_name} из пакета')
+                results.append(SAVE_FAILED)
+        return results
+
+    owner_id = files[0].owner_id
+    total = sum(file_obj.size for file_obj in files)
+    StorageUsage.objects.add(owner_id, total, len(files))
+    folder = files[0].folder
+    if folder is not None:
+        Folder.objects.adjust({folder.pk: (total, len(files))})
+    FileEvent.objects.record(owner_id, [
+        (file_obj.pk, FileEvent.CREATED, FileEvent.snapshot(file_obj)) for file_obj in files
+    ])
+    return files
+
+
+def create_files(owner, uploads, folder=None, comment=''):
+    """
+    Создает записи для загруженных StoredUpload в одной транзакции.
+    Возвращает (созданные File, ошибки [(имя, код)], задачи проверки по id файла).
+    Если пакет не помещается в квоту, выбрасывается QuotaExceeded,
+    ссылки на блобы тогда освобождает вызывающий.
+    """
+    with transaction.atomic():
+        total = sum(upload.size for upload in uploads)
+        if not StorageUsage.objects.fits_quota(owner.pk, total, lock=True):
+            raise QuotaExceeded
+
+        names = allocate_names(owner.pk, [upload.name for upload in uploads])
+        files = [
+            File(
+                owner=owner,
+                original_name=name,
+                storage_path=new_storage_path(owner.pk, name),
+                size=upload.size,
+                comment=comment,
+                folder=folder,
+                blob=upload.blob,
+                file=upload.blob.storage_name,
+            )
+            for upload, name in zip(uploads, names)
+        ]
+        results = _insert(files)
+
+        created = [item for item in results if isinstance(item, File)]
+        errors = [(upload.name, item) for upload, item in zip(uploads, results) if not isinstance(item, File)]
+        # Ссылки на блобы несозданных файлов больше не нужны
+        Blob.objects.release_many(Counter(
+            upload.blob.pk for upload, item in zip(uploads, results) if not isinstance(item, File)
+        ))
+
+        for file_obj in created:
+            previews.schedule(file_obj)
+        verify_jobs = {job.file_id: job for job in jobs.enqueue_many(jobs.VERIFY_UPLOAD, created)}
+
+    return created, errors, verify_jobs
@@ -0,0 +1,100 @@
+"""
+Кэш горячих чтений: публичная ссылка с файлом и пользователь по JWT.
+
+Бэкенд задается алиасом STORAGE_CACHE_ALIAS в CACHES: по умолчанию память
+процесса, при заданном REDIS_URL - общий Redis. Записи сбрасываются явно
+при изменении данных, TTL только страхует от пропущенной инвалидации.
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+SHARE_LINKS = 'share_links'
+USERS = 'users'
+NAMESPACES = (SHARE_LINKS, USERS)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.STORAGE_CACHE_ALIAS]
+
+
+def _key(namespace, key):
+    return f'storage:{namespace}:{key}'
+
+
+def _record(namespace, outcome):
+    with _stats_lock:
+        _stats[namespace, outcome] += 1
+
+
+def get_or_load(namespace, key, loader, timeout):
+    """
+    Значение из кэша или результат loader(), который кладется в кэш.
+    None не кэшируется: отсутствующие объекты каждый раз ищутся в БД.
+    """
+    cache_key = _key(namespace, key)
+    value = _cache().get(cache_key)
+    if value is not None:
+        _record(namespace, 'hits')
+        return value
+
+    _record(namespace, 'misses')
+    value = loader()
+    if value is not None:
+        _cache().set(cache_key, value, timeout)
+    return value
+
+
+def invalidate(namespace, key):
+    # Сбрасываем сразу и еще раз после коммита, чтобы параллельный запрос
+    # не успел положить в кэш строку из еще не закоммиченной транзакции
+    cache_key = _key(namespace, key)
+    _cache().delete(cache_key)
+    transaction.on_commit(lambda: _cache().delete(cache_key))
+
+
+def get_share_link(token, loader):
+    return get_or_load(SHARE_LINKS, token, loader, settings.SHARE_LINK_CACHE_TIMEOUT)
+
+
+def invalidate_share_link(token):
+    invalidate(SHARE_LINKS, token)
+
+
+def invalidate_share_links(tokens):
+    keys = [_key(SHARE_LINKS, token) for token in tokens]
+    if keys:
+        _cache().delete_many(keys)
+        transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+def get_user(user_id, loader):
+    return get_or_load(USERS, user_id, loader, settings.USER_CACHE_TIMEOUT)
+
+
+def invalidate_user(user_id):
+    invalidate(USERS, user_id)
+
+
+def stats():
+    """Попадания и промахи по пространствам ключей в текущем процессе."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    result = {}
+    for namespace in NAMESPACES:
+        hits = snapshot.get((namespace, 'hits'), 0)
+        misses = snapshot.get((namespace, 'misses'), 0)
+        total = hits + misses
+        result[namespace] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None,
+        }
+    return result
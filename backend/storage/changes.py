@@ -0,0 +1,134 @@
+"""
+Лента изменений файлов для синхронизации клиентов: GET /api/changes/.
+
+Создание, изменение (комментарий, имя, папка) и удаление файла пишут
+FileEvent с номером seq, который растет на единицу с каждым событием
+пользователя. Клиент хранит курсор - номер последнего примененного события
+- и запрашивает события после него:
+
+    GET /api/changes/                     текущий курсор, без событий: клиент
+                                          берет его перед полным списком файлов
+    GET /api/changes/?cursor=N&limit=500  события с seq > N по порядку
+    ...&wait=25                           long-poll: если событий нет, ответ
+                                          ждет их до wait секунд
+
+Ждет long-poll только асинхронный async_views.change_feed (SERVER_MODE=asgi).
+Синхронный ChangesView под WSGI отвечает сразу и wait не учитывает: иначе
+каждый ждущий клиент занимал бы воркер gunicorn, и несколько клиентов
+забирали бы их все. Клиент в этом случае повторяет запрос сам.
+
+Событие - состояние файла после него (data), поэтому пропущенные
+промежуточные события не нужны: клиент применяет created и updated как
+"создать или заменить". Это позволяет сжимать журнал (compact): от каждого
+файла остается последнее событие, события удаления старше CHANGES_RETENTION
+удаляются совсем. Курсор, после которого удаления уже нет в журнале,
+получает 410 с reset=true - клиенту нужна полная синхронизация.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ChangeFeed, FileEvent
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+
+
+class ChangesError(Exception):
+    """Неверные параметры запроса, текст - для ответа пользователю."""
+
+
+class CursorExpired(Exception):
+    """События после курсора уже удалены из журнала."""
+
+
+def parse_params(params):
+    """(курсор или None, limit, wait) из параметров запроса."""
+    try:
+        cursor = params.get('cursor')
+        cursor = int(cursor) if cursor not in (None, '') else None
+        limit = int(params.get('limit') or DEFAULT_LIMIT)
+        wait = float(params.get('wait') or 0)
+    except ValueError:
+        raise ChangesError('cursor и limit должны быть целыми числами, wait - числом секунд')
+    if cursor is not None and cursor < 0:
+        raise ChangesError('cursor не может быть отрицательным')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ChangesError(f'limit должен быть от 1 до {MAX_LIMIT}')
+    return cursor, limit, min(max(wait, 0), settings.CHANGES_MAX_WAIT)
+
+
+def _feed(owner_id):
+    return ChangeFeed.objects.filter(user_id=owner_id).values_list('last_seq', 'pruned_seq').first() or (0, 0)
+
+
+def latest(owner_id):
+    return _feed(owner_id)[0]
+
+
+def has_changes(owner_id, cursor):
+    return ChangeFeed.objects.filter(user_id=owner_id, last_seq__gt=cursor).exists()
+
+
+def _serialize(event):
+    return {
+        'seq': event.seq,
+        'kind': event.kind,
+        'file_id': event.file_id,
+        'data': event.data,
+        'created_at': event.created_at,
+    }
+
+
+def read(owner_id, cursor, limit=DEFAULT_LIMIT):
+    """Страница ленты после cursor: {"events", "cursor", "has_more"}."""
+    events = list(FileEvent.objects.filter(owner_id=owner_id, seq__gt=cursor).order_by('seq')[:limit + 1])
+    # Границы журнала читаются после событий: если между запросами прошло
+    # сжатие, курсор окажется устаревшим, а не пропустит удаленные события
+    last_seq, pruned_seq = _feed(owner_id)
+    if cursor < pruned_seq or cursor > last_seq:
+        raise CursorExpired('Курсор устарел, нужна полная синхронизация')
+
+    has_more = len(events) > limit
+    events = events[:limit]
+    return {
+        'events': [_serialize(event) for event in events],
+        'cursor': events[-1].seq if events else cursor,
+        'has_more': has_more,
+    }
+
+
+def compact(now=None):
+    """
+    Сжимает журнал: удаляет события, после которых у того же файла есть
+    более новое, и события удаления старше CHANGES_RETENTION. Размер
+    журнала остается порядка числа файлов плюс удаления за срок хранения.
+    Возвращает (вытесненных событий, удалений по сроку).
+    """
+    newer = FileEvent.objects.filter(
+        owner_id=OuterRef('owner_id'), file_id=OuterRef('file_id'), seq__gt=OuterRef('seq')
+    )
+    superseded, _ = FileEvent.objects.filter(Exists(newer)).delete()
+
+    deadline = (now or timezone.now()) - settings.CHANGES_RETENTION
+    expired = FileEvent.objects.filter(kind=FileEvent.DELETED, created_at__lt=deadline)
+    with transaction.atomic():
+        bounds = expired.values('owner_id').annotate(max_seq=Max('seq')).order_by('owner_id')
+        for row in bounds:
+            # Граница и удаление в одной транзакции: читатель видит либо
+            # старый журнал, либо новую границу
+            ChangeFeed.objects.filter(user_id=row['owner_id']).update(
+                pruned_seq=Greatest('pruned_seq', row['max_seq'])
+            )
+        removed, _ = expired.delete()
+
+    if superseded or removed:
+        logger.info(f'Журнал изменений сжат: вытеснено {superseded}, удалено по сроку {removed}')
+    return superseded, removed
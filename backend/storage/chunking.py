@@ -0,0 +1,146 @@
+"""
+Разбиение содержимого на части по содержимому (content-defined chunking)
+и чтение содержимого, склеенного из частей.
+
+Граница части ставится там, где скользящий хэш Gear последних 64 байт
+дает нули в старших битах маски, но не раньше min_size и не позже
+max_size от начала части. Граница зависит только от соседних байт, а не от
+смещения: вставка или удаление в середине файла меняют одну-две части,
+остальные совпадают с частями прошлой версии и не загружаются заново.
+Средний размер части - около min_size + avg_size.
+
+split - эталонная реализация для клиентов и тестов: сервер файлы не режет,
+а только проверяет размеры присланных частей (storage.delta). Цикл по байтам
+на Python медленный, клиенту стоит реализовать тот же алгоритм нативно.
+"""
+import bisect
+import hashlib
+import io
+import itertools
+
+from django.conf import settings
+
+
+WINDOW = 64
+MASK64 = (1 << 64) - 1
+# Таблица Gear: случайное 64-битное число на каждый байт, детерминированно
+# из SHA-256, чтобы любой клиент мог ее воспроизвести
+GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], 'big') for value in range(256))
+
+
+def _boundary_mask(avg_size):
+    bits = max(avg_size.bit_length() - 1, 1)
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def _cut(data, min_size, max_size, mask):
+    """Длина первой части data."""
+    if len(data) <= min_size:
+        return len(data)
+    end = min(len(data), max_size)
+    digest = 0
+    gear = GEAR
+    # Хэш зависит только от последних WINDOW байт, раньше его считать незачем
+    for position in range(max(min_size - WINDOW, 0), end):
+        digest = ((digest << 1) + gear[data[position]]) & MASK64
+        if position >= min_size and not digest & mask:
+            return position + 1
+    return end
+
+
+def split(file, min_size=None, avg_size=None, max_size=None):
+    """Части содержимого file по порядку (bytes). Размеры - из DELTA_CHUNK_*."""
+    min_size = min_size or settings.DELTA_CHUNK_MIN_SIZE
+    avg_size = avg_size or settings.DELTA_CHUNK_AVG_SIZE
+    max_size = max_size or settings.DELTA_CHUNK_MAX_SIZE
+    mask = _boundary_mask(avg_size)
+
+    buffer = b''
+    while True:
+        block = file.read(max_size)
+        buffer += block
+        while buffer and (len(buffer) >= max_size or not block):
+            cut = _cut(buffer, min_size, max_size, mask)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+        if not block:
+            return
+
+
+def manifest(file, **sizes):
+    """Список частей file для загрузки дельтой: [{"sha256", "size"}]."""
+    return [
+        {'sha256': hashlib.sha256(chunk).hexdigest(), 'size': len(chunk)}
+        for chunk in split(file, **sizes)
+    ]
+
+
+class ChunkedFile(io.RawIOBase):
+    """
+    Содержимое, склеенное из частей [(sha256, размер, storage_name, encoding)].
+    Части открываются по одной по мере чтения (open_part(storage_name,
+    encoding, размер)), seek находит нужную часть по смещению, поэтому
+    Range-запрос читает только части, на которые попадает диапазон.
+    """
+
+    def __init__(self, parts, open_part):
+        self.parts = parts
+        self._open_part = open_part
+        self._offsets = list(itertools.accumulate((part[1] for part in parts), initial=0))
+        self.size = self._offsets[-1]
+        self._current = None
+        self._index = 0
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def _open(self):
+        self._index = bisect.bisect_right(self._offsets, self._position) - 1
+        _, size, storage_name, encoding = self.parts[self._index]
+        self._current = self._open_part(storage_name, encoding, size)
+        skip = self._position - self._offsets[self._index]
+        if skip:
+            self._current.seek(skip)
+
+    def readinto(self, buffer):
+        while self._position < self.size:
+            if self._current is None:
+                self._open()
+            data = self._current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self._position += len(data)
+                return len(data)
+
+            self._close_current()
+            if self._position != self._offsets[self._index + 1]:
+                raise IOError(f'Часть {self.parts[self._index][0]} в хранилище короче ожидаемого')
+        return 0
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        offset = max(0, min(offset, self.size))
+        if offset != self._position:
+            # Нужная часть откроется при следующем чтении
+            self._close_current()
+            self._position = offset
+        return self._position
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+    def close(self):
+        self._close_current()
+        super().close()
@@ -0,0 +1,246 @@
+"""
+Сжатие содержимого при записи в хранилище (STORAGE_COMPRESSION=gzip|zstd).
+
+Сжимается только то, что сжимается хорошо: текстовые типы - сразу, уже
+сжатые форматы (изображения, архивы, видео) - никогда, остальное - если
+пробный фрагмент ужимается заметно. Решение принимается один раз при
+создании блоба, кодировка хранится в Blob.encoding, поэтому смена настройки
+не затрагивает уже записанные блобы.
+
+Blob.size и File.size - исходный размер, по нему считается квота:
+пользователь не теряет место от того, что его файлы плохо сжимаются.
+Blob.stored_size - сколько блоб занимает в хранилище.
+"""
+import io
+import os
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+
+from .chunking import ChunkedFile
+from .sniffing import SNIFF_SIZE, sniff_content_type
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+ENCODINGS = (GZIP, ZSTD)
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+BLOCK_SIZE = 1024 * 1024
+# Файлы меньше не сжимаются: выигрыш меньше блока файловой системы
+MIN_SIZE = 4096
+SAMPLE_SIZE = 64 * 1024
+# Сжимать, если пробный фрагмент ужимается хотя бы до этой доли
+SAMPLE_RATIO = 0.9
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/xml', 'application/javascript',
+    'application/x-sh', 'application/sql', 'image/svg+xml',
+)
+COMPRESSIBLE_EXTENSIONS = ('.log', '.csv', '.tsv', '.sql', '.jsonl', '.ndjson', '.yaml', '.yml', '.dump')
+INCOMPRESSIBLE_TYPES = (
+    'image/', 'video/', 'audio/', 'application/zip', 'application/gzip', 'application/zstd',
+    'application/x-bzip2', 'application/x-xz', 'application/x-7z-compressed', 'application/vnd.rar',
+    'application/vnd.openxmlformats-officedocument.', 'application/vnd.oasis.opendocument.',
+    'application/epub+zip', 'application/java-archive',
+)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured('Для STORAGE_COMPRESSION=zstd нужен пакет zstandard')
+    return zstandard
+
+
+def _compressor(encoding):
+    if encoding == ZSTD:
+        return _import_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+class GzipReader:
+    """
+    Распаковка gzip из потока raw, read(size) возвращает не больше size байт:
+    сильно сжатые данные (логи, дампы) не разворачиваются в памяти целиком.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._decoder = zlib.decompressobj(31)
+        self._tail = b''
+
+    def read(self, size):
+        while True:
+            data = self._decoder.decompress(self._tail, size)
+            # Что не поместилось в size, распакуется при следующем чтении
+            self._tail = self._decoder.unconsumed_tail
+            if data or self._decoder.eof:
+                return data
+            self._tail = self._raw.read(BLOCK_SIZE)
+            if not self._tail:
+                # Поток оборвался раньше конца gzip
+                return self._decoder.flush()
+
+    def close(self):
+        self._raw.close()
+
+
+def _decoder(encoding, raw):
+    """Распаковывающий поток над raw, read(size) отдает не больше size байт."""
+    if encoding == ZSTD:
+        return _import_zstandard().ZstdDecompressor().stream_reader(raw, read_size=BLOCK_SIZE)
+    return GzipReader(raw)
+
+
+def choose_encoding(content, name, size):
+    """Кодировка, в которой стоит хранить content, или '' - хранить как есть."""
+    encoding = settings.STORAGE_COMPRESSION
+    if not encoding or size < MIN_SIZE:
+        return ''
+    if encoding not in ENCODINGS:
+        raise ImproperlyConfigured(f'STORAGE_COMPRESSION должно быть одним из: {", ".join(ENCODINGS)}')
+
+    content.seek(0)
+    sample = content.read(SAMPLE_SIZE)
+    content.seek(0)
+
+    content_type = sniff_content_type(sample[:SNIFF_SIZE], name)
+    if content_type.startswith(COMPRESSIBLE_TYPES) or name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+        return encoding
+    if content_type.startswith(INCOMPRESSIBLE_TYPES):
+        return ''
+    # Быстрое сжатие фрагмента показывает, есть ли в данных избыточность
+    return encoding if len(zlib.compress(sample, 1)) <= len(sample) * SAMPLE_RATIO else ''
+
+
+def compress(content, encoding):
+    """
+    Сжимает content потоком во временный файл рядом с хранилищем.
+    Возвращает (файл для default_storage.save, размер сжатых данных).
+    """
+    os.makedirs(settings.STORAGE_UPLOAD_TEMP_DIR, exist_ok=True)
+    target = tempfile.TemporaryFile(dir=settings.STORAGE_UPLOAD_TEMP_DIR)
+    compressor = _compressor(encoding)
+    content.seek(0)
+    while block := content.read(BLOCK_SIZE):
+        target.write(compressor.compress(block))
+    target.write(compressor.flush())
+    stored_size = target.tell()
+    target.seek(0)
+    return DjangoFile(target, name=getattr(content, 'name', None)), stored_size
+
+
+class DecodedFile(io.RawIOBase):
+    """
+    Исходное содержимое сжатого блоба, распаковывается по мере чтения.
+    seek вперед пропускает распакованные данные, назад - открывает блоб заново,
+    поэтому Range-запросы работают без распаковки файла на диск.
+    """
+
+    def __init__(self, storage_name, encoding, size):
+        self.name = storage_name
+        self.encoding = encoding
+        self.size = size
+        self._raw = None
+        self._decoder = None
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def _reopen(self):
+        self._close_raw()
+        self._raw = default_storage.open(self.name, 'rb')
+        self._decoder = _decoder(self.encoding, self._raw)
+        self._position = 0
+
+    def readinto(self, buffer):
+        if self._raw is None:
+            self._reopen()
+        # Распаковывается не больше, чем просили, и не больше блока
+        data = self._decoder.read(min(len(buffer), BLOCK_SIZE))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if self._raw is None or offset < self._position:
+            self._reopen()
+        while self._position < offset:
+            if not self.read(min(BLOCK_SIZE, offset - self._position)):
+                break
+        return self._position
+
+    def _close_raw(self):
+        if self._raw is not None:
+            # Распаковывающий поток закрывает и сам блоб
+            self._decoder.close()
+            self._raw = self._decoder = None
+
+    def close(self):
+        self._close_raw()
+        super().close()
+
+
+def open_stored(storage_name, encoding, size):
+    """Открывает блоб на чтение исходного содержимого."""
+    if encoding:
+        return DecodedFile(storage_name, encoding, size)
+    return default_storage.open(storage_name, 'rb')
+
+
+def file_encoding(file_obj):
+    return file_obj.blob.encoding if file_obj.blob_id else ''
+
+
+def stored_as_is(file_obj):
+    """
+    Лежит ли содержимое файла в хранилище одним несжатым объектом: такой
+    файл могут отдать nginx, объектное хранилище по ссылке или FileResponse.
+    """
+    return not file_obj.blob_id or not (file_obj.blob.encoding or file_obj.blob.chunk_count)
+
+
+def open_file(file_obj):
+    """Исходное содержимое файла: сжатого, собранного из частей или как есть."""
+    if file_obj.blob_id and file_obj.blob.chunk_count:
+        # Части - тоже блобы, каждая может быть сжата
+        return ChunkedFile(file_obj.blob.chunk_parts(), open_stored)
+    encoding = file_encoding(file_obj)
+    if encoding:
+        return DecodedFile(file_obj.blob.storage_name, encoding, file_obj.size)
+    return file_obj.file.open('rb')
+
+
+def accepts_encoding(request, encoding):
+    """Принимает ли клиент ответ в кодировке encoding (заголовок Accept-Encoding)."""
+    names = {encoding, 'x-gzip'} if encoding == GZIP else {encoding}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        token, _, params = item.strip().partition(';')
+        if token.strip().lower() not in names:
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
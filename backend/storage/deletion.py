@@ -0,0 +1,203 @@
+"""
+Массовое удаление файлов и сборка мусора в хранилище.
+
+Запрос на удаление только убирает строки и освобождает ссылки на блобы,
+время ответа не зависит от числа и размера файлов. Содержимое из хранилища
+удаляет collect_garbage: блобы без ссылок и файлы, на которые не ссылается
+ни одна запись (сироты).
+"""
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from . import cache, previews
+from .models import Blob, BlobChunk, File, FileEvent, Folder, Job, ShareLink, StorageUsage
+
+
+logger = logging.getLogger(__name__)
+
+GC_BATCH_SIZE = 500
+# Каталоги хранилища, в которых ищутся сироты
+ORPHAN_PREFIXES = ('user_', 'blobs')
+
+
+def raw_delete(queryset):
+    """
+    Удаляет строки queryset одним DELETE без загрузки объектов, сигналов и
+    каскада. Зависимые строки и работу сигналов берет на себя вызывающий.
+    QuerySet._raw_delete - приватный API Django, поэтому он вызывается
+    только здесь, а поведение закреплено в BulkDeleteTests.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def bulk_delete(queryset, record_changes=True):
+    """
+    Удаляет файлы из queryset одним DELETE (их задачи и публичные ссылки -
+    еще двумя). Счетчики хранилища, размеры папок, ссылки на блобы и события
+    ленты изменений обновляются пачкой, а не сигналом post_delete на каждую
+    строку. record_changes=False - без событий (пользователь удаляется
+    вместе с лентой). Возвращает id удаленных файлов.
+    """
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update().order_by()
+            .values_list('id', 'owner_id', 'size', 'blob_id', 'folder_id', 'original_name')
+        )
+        if not rows:
+            return []
+
+        ids = [row[0] for row in rows]
+        usage = defaultdict(lambda: [0, 0])
+        folders = defaultdict(lambda: [0, 0])
+        blobs = Counter()
+        events = defaultdict(list)
+        for file_id, owner_id, size, blob_id, folder_id, name in rows:
+            usage[owner_id][0] += size
+            usage[owner_id][1] += 1
+            if folder_id:
+                folders[folder_id][0] -= size
+                folders[folder_id][1] -= 1
+            if blob_id:
+                blobs[blob_id] += 1
+            events[owner_id].append((file_id, FileEvent.DELETED, {'original_name': name}))
+
+        # У задач нет сигналов и зависимых строк, их Django удаляет одним
+        # запросом сам. Ссылки и файлы - через raw_delete, работа их
+        # сигналов выполнена ниже
+        Job.objects.filter(file_id__in=ids).delete()
+        links = ShareLink.objects.filter(file_id__in=ids)
+        tokens = list(links.values_list('token', flat=True))
+        raw_delete(links)
+        raw_delete(File.objects.filter(pk__in=ids))
+
+        for owner_id, (size, count) in usage.items():
+            StorageUsage.objects.remove(owner_id, size, count)
+        Folder.objects.adjust(folders)
+        Blob.objects.release_many(blobs)
+        cache.invalidate_share_links(tokens)
+        if record_changes:
+            # Последними, как и в сигнале: ChangeFeed блокируется после StorageUsage
+            for owner_id, owner_events in events.items():
+                FileEvent.objects.record(owner_id, owner_events)
+
+    return ids
+
+
+def _unlink(name):
+    try:
+        default_storage.delete(name)
+    except FileNotFoundError:
+        pass
+    return name
+
+
+def collect_blobs(workers=8, dry_run=False):
+    """
+    Удаляет блобы без ссылок: строки пачками под блокировкой (параллельная
+    загрузка того же содержимого ждет и создает блоб заново), содержимое -
+    пулом потоков после фиксации пачки. Возвращает (число блобов, байт).
+    """
+    collected = freed = 0
+    if dry_run:
+        totals = Blob.objects.filter(ref_count=0).aggregate(
+            count=Count('id'), size=Sum('stored_size', filter=Q(chunk_count=0))
+        )
+        return totals['count'], totals['size'] or 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Blob.objects.select_for_update(skip_locked=True)
+                    .filter(ref_count=0)
+                    .values_list('id', 'storage_name', 'stored_size', 'preview_status', 'chunk_count')[:GC_BATCH_SIZE]
+                )
+                if not batch:
+                    break
+                # Блоб из частей держит ссылки на свои части: освободившиеся
+                # части соберет следующая пачка
+                chunked = [row[0] for row in batch if row[4]]
+                if chunked:
+                    Blob.objects.release_many(Counter(
+                        BlobChunk.objects.filter(blob_id__in=chunked).values_list('chunk_id', flat=True)
+                    ))
+                Blob.objects.filter(pk__in=[row[0] for row in batch], ref_count=0).delete()
+
+            # У блоба из частей своего объекта в хранилище нет
+            names = [name for _, name, _, _, chunks in batch if not chunks]
+            # Превью, построение которого еще идет, останется сиротой и будет удалено sweep_orphans
+            names += [previews.preview_name(name) for _, name, _, state, _ in batch if state == previews.READY]
+            for name in pool.map(_unlink, names):
+                logger.debug(f'Удален блоб {name}')
+            collected += len(batch)
+            freed += sum(size for _, _, size, _, chunks in batch if not chunks)
+
+    return collected, freed
+
+
+def _walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield f'{path}/{name}' if path else name
+    for directory in directories:
+        yield from _walk(storage, f'{path}/{directory}' if path else directory)
+
+
+def _candidates(storage):
+    top_directories, _ = storage.listdir('')
+    for directory in top_directories:
+        if directory.startswith(ORPHAN_PREFIXES):
+            yield from _walk(storage, directory)
+
+
+def _batches(names, size):
+    batch = []
+    for name in names:
+        batch.append(name)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _referenced(names):
+    referenced = set()
+    for name, path in File.objects.filter(Q(file__in=names) | Q(storage_path__in=names)).values_list('file', 'storage_path'):
+        referenced.update((name, path))
+    # Превью принадлежит блобу, рядом с которым лежит
+    blob_names = {name[:-len(previews.SUFFIX)] if name.endswith(previews.SUFFIX) else name for name in names}
+    for name in Blob.objects.filter(storage_name__in=blob_names).values_list('storage_name', flat=True):
+        referenced.update((name, previews.preview_name(name)))
+    return referenced
+
+
+def sweep_orphans(workers=8, min_age=timedelta(hours=1), dry_run=False):
+    """
+    Удаляет файлы в user_* и blobs, на которые не ссылается ни File, ни Blob
+    (превью - по имени своего блоба).
+    Файлы моложе min_age пропускаются: это могут быть загрузки, которые
+    записали содержимое, но еще не создали строку. Возвращает число сирот.
+    """
+    deadline = timezone.now() - min_age
+    orphans = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in _batches(_candidates(default_storage), GC_BATCH_SIZE):
+            referenced = _referenced(batch)
+            stale = [
+                name for name in batch
+                if name not in referenced and default_storage.get_modified_time(name) < deadline
+            ]
+            orphans += len(stale)
+            if dry_run:
+                continue
+            for name in pool.map(_unlink, stale):
+                logger.info(f'Удален файл без записи в БД: {name}')
+    return orphans
@@ -0,0 +1,227 @@
+"""
+Загрузка дельтой: повторная загрузка измененного большого файла передает
+только изменившиеся части.
+
+Клиент режет файл на части по содержимому (эталон - storage.chunking.split
+с размерами DELTA_CHUNK_*), так что после правки файла большая часть частей
+совпадает с частями прошлой версии:
+
+    POST /api/files/delta/  {original_name, size, comment, chunks: [{sha256, size}, ...]}
+        -> id загрузки и missing - хэши частей, которые нужно прислать
+    PUT  /api/files/delta/<id>/chunks/<sha256>/   тело - байты части
+    GET  /api/files/delta/<id>/                    что еще не прислано
+    POST /api/files/delta/<id>/complete/  {folder}  -> файл
+
+Часть - обычный Blob: хранится один раз, может быть сжата и собирается
+сборщиком мусора, как любой блоб. Файл ссылается на блоб из частей
+(Blob.chunk_count, хэш блоба - хэш списка частей), при скачивании его
+содержимое склеивается потоком (chunking.ChunkedFile), полный хэш
+содержимого считает фоновая проверка, сверяя каждую часть.
+
+Уже имеющейся считается только часть, которую пользователь присылал сам: в
+эту загрузку или в одном из своих файлов. По хэшу чужого содержимого нельзя
+ни узнать, есть ли оно на сервере, ни получить к нему доступ; одинаковые
+части разных пользователей все равно хранятся один раз.
+"""
+import hashlib
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+
+from . import jobs, previews
+from .models import Blob, DeltaUpload, File
+from .naming import new_storage_path, save_with_unique_name
+from .upload_handlers import StagedUploadedFile
+from .uploads import COPY_BUFFER_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+# Больше хэшей в одном условии IN не передаем
+QUERY_BATCH_SIZE = 1000
+MANIFEST_PREFIX = b'my_cloud delta manifest v1\n'
+
+
+class DeltaError(Exception):
+    """Запрос загрузки дельтой неверен, текст - для ответа пользователю."""
+
+
+class MissingChunks(Exception):
+    def __init__(self, missing):
+        super().__init__(f'Не хватает частей: {len(missing)}')
+        self.missing = missing
+
+
+def validate_manifest(chunks, size):
+    """
+    Проверяет список частей [(sha256, размер)]: все части, кроме последней,
+    не меньше DELTA_CHUNK_MIN_SIZE, сумма размеров равна size.
+    """
+    if not chunks:
+        raise DeltaError('Список частей не может быть пустым')
+    sizes = {}
+    for index, (sha256, chunk_size) in enumerate(chunks):
+        if index < len(chunks) - 1 and chunk_size < settings.DELTA_CHUNK_MIN_SIZE:
+            raise DeltaError(f'Части, кроме последней, не могут быть меньше {settings.DELTA_CHUNK_MIN_SIZE} байт')
+        if sizes.setdefault(sha256, chunk_size) != chunk_size:
+            raise DeltaError(f'У части {sha256} указаны разные размеры')
+    if sum(chunk_size for _, chunk_size in chunks) != size:
+        raise DeltaError('Сумма размеров частей не равна размеру файла')
+
+
+def manifest_sha256(manifest):
+    """
+    Хэш списка частей - идентичность блоба, собранного из них. Хранится
+    отдельно от хэшей содержимого обычных блобов (Blob.chunk_count),
+    префикс только делает случайное совпадение с чьим-то файлом невозможным.
+    """
+    digest = hashlib.sha256(MANIFEST_PREFIX)
+    for sha256, size in manifest:
+        digest.update(f'{sha256}:{size}\n'.encode())
+    return digest.hexdigest()
+
+
+def _batches(items, size=QUERY_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def available(session):
+    """Части загрузки, которые уже есть у пользователя: {sha256: id блоба}."""
+    hashes = {sha256 for sha256, _ in session.manifest}
+    found = dict(session.received.values_list('sha256', 'pk'))
+    # Блоб из частей сам частью быть не может
+    plain = Blob.objects.filter(chunk_count=0)
+    for batch in _batches(hashes - found.keys()):
+        # Целиком загруженный файл или часть файла, загруженного дельтой
+        found.update(
+            plain.filter(sha256__in=batch, files__owner_id=session.owner_id)
+            .values_list('sha256', 'pk').distinct()
+        )
+        found.update(
+            plain.filter(sha256__in=batch, chunk_of__blob__files__owner_id=session.owner_id)
+            .values_list('sha256', 'pk').distinct()
+        )
+    return found
+
+
+def missing(session):
+    """Хэши частей, которые клиент должен прислать, без повторов, по порядку."""
+    found = available(session)
+    return list(dict.fromkeys(sha256 for sha256, _ in session.manifest if sha256 not in found))
+
+
+def receive_chunk(session, sha256, stream):
+    """
+    Пишет часть из потока запроса во временный файл, сверяя размер и хэш,
+    и сохраняет ее блобом. Загрузка берет ссылку на блоб один раз, сколько бы
+    раз, в том числе одновременно, часть ни прислали. Если загрузки уже нет,
+    выбрасывает DeltaUpload.DoesNotExist.
+    """
+    expected = dict(session.manifest).get(sha256)
+    if expected is None:
+        raise DeltaError('Части с таким хэшем нет в списке частей загрузки')
+
+    chunk = StagedUploadedFile(f'{sha256}.chunk', 'application/octet-stream', 0, None)
+    try:
+        digest = hashlib.sha256()
+        written = 0
+        while written <= expected:
+            block = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+            if not block:
+                break
+            digest.update(block)
+            chunk.write(block)
+            written += len(block)
+        if written != expected:
+            raise DeltaError(f'Ожидалось {expected} байт для части {sha256}, получено {written}')
+        if digest.hexdigest() != sha256:
+            raise DeltaError(f'SHA-256 присланных данных не совпадает с {sha256}')
+
+        chunk.flush()
+        chunk.size = written
+        blob = Blob.objects.store(chunk, sha256, written, name=session.original_name)
+    finally:
+        chunk.close()
+
+    open_session = created = False
+    try:
+        with transaction.atomic():
+            # Части одной загрузки записываются по очереди, и загрузка,
+            # которую уже завершили или отменили, новых частей не получает
+            open_session = DeltaUpload.objects.select_for_update().filter(pk=session.pk).exists()
+            if open_session:
+                _, created = DeltaUpload.received.through.objects.get_or_create(deltaupload_id=session.pk, blob=blob)
+    except IntegrityError:
+        # Ту же часть параллельно записал другой запрос
+        pass
+    if not created:
+        # Ссылку на часть уже держит загрузка или держать некому
+        Blob.objects.release(blob.pk)
+    if not open_session:
+        raise DeltaUpload.DoesNotExist
+    return blob
+
+
+def _release(session):
+    Blob.objects.release_many(Counter(session.received.values_list('pk', flat=True)))
+
+
+def complete(session, folder=None):
+    """
+    Создает файл из частей загрузки и удаляет загрузку. Если каких-то частей
+    нет, выбрасывает MissingChunks. Квоту проверяет вызывающий в той же
+    транзакции. Возвращает (файл, задача проверки).
+    """
+    with transaction.atomic():
+        session = DeltaUpload.objects.select_for_update().get(pk=session.pk)
+        found = available(session)
+        absent = [sha256 for sha256, _ in session.manifest if sha256 not in found]
+        if absent:
+            raise MissingChunks(list(dict.fromkeys(absent)))
+
+        # Части блокируются: сборщик мусора пропускает заблокированные блобы
+        # и не удалит часть, на которую сейчас появится ссылка
+        ids = [found[sha256] for sha256, _ in session.manifest]
+        chunks = {blob.pk: blob for blob in Blob.objects.select_for_update().filter(pk__in=set(ids)).order_by('pk')}
+        vanished = [sha256 for sha256, _ in session.manifest if found[sha256] not in chunks]
+        if vanished:
+            raise MissingChunks(list(dict.fromkeys(vanished)))
+        for sha256, size in session.manifest:
+            if chunks[found[sha256]].size != size:
+                raise DeltaError(f'Размер части {sha256} не совпадает с указанным')
+
+        blob = Blob.objects.store_chunked(manifest_sha256(session.manifest), [chunks[pk] for pk in ids])
+        file_instance = File(
+            owner_id=session.owner_id,
+            original_name=session.original_name,
+            storage_path=new_storage_path(session.owner_id, session.original_name),
+            size=session.size,
+            comment=session.comment,
+            folder=folder,
+            blob=blob,
+            file=blob.storage_name
+        )
+        save_with_unique_name(file_instance)
+        previews.schedule(file_instance)
+        job = jobs.enqueue(jobs.VERIFY_UPLOAD, file_instance)
+
+        sent = session.received.aggregate(sent=Sum('size'))['sent'] or 0
+        upload_id = session.pk
+        # Ссылки на части теперь держит блоб файла
+        _release(session)
+        session.delete()
+
+    logger.info(f'Загрузка дельтой {upload_id}: прислано {sent} байт из {session.size}')
+    return file_instance, job
+
+
+def discard(session):
+    """Отменяет загрузку, освобождая присланные части."""
+    with transaction.atomic():
+        _release(session)
+        session.delete()
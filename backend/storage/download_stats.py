@@ -0,0 +1,133 @@
+"""
+Учет скачиваний без записи в БД на каждый запрос.
+
+Скачивания копятся в памяти процесса и раз в DOWNLOAD_STATS_FLUSH_INTERVAL
+секунд записываются одним UPDATE на все накопленные файлы: last_download
+и прибавка к download_count. При DOWNLOAD_STATS_FLUSH_INTERVAL=0 каждое
+скачивание записывается сразу.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import File
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadBuffer:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, file_id, downloaded_at=None, count=1):
+        downloaded_at = downloaded_at or timezone.now()
+        with self._lock:
+            last, total = self._pending.get(file_id, (downloaded_at, 0))
+            self._pending[file_id] = (max(last, downloaded_at), total + count)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Записывает накопленное одним запросом, возвращает число файлов."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            _bulk_update(pending)
+        except Exception:
+            # Не теряем скачивания: вернем их в буфер до следующей попытки
+            for file_id, (downloaded_at, count) in pending.items():
+                self.add(file_id, downloaded_at, count)
+            raise
+        return len(pending)
+
+
+def _bulk_update(pending):
+    if connection.vendor == 'postgresql':
+        rows = ', '.join(['(%s::bigint, %s::timestamptz, %s::integer)'] * len(pending))
+        params = [value for file_id, (downloaded_at, count) in pending.items()
+                  for value in (file_id, downloaded_at, count)]
+        table = File._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} AS f '
+                f'SET last_download = GREATEST(f.last_download, v.downloaded_at), '
+                f'download_count = f.download_count + v.count '
+                f'FROM (VALUES {rows}) AS v(id, downloaded_at, count) '
+                f'WHERE f.id = v.id',
+                params
+            )
+        return
+
+    # Другие СУБД: тот же один UPDATE через CASE по id
+    downloaded_at = Case(
+        *[When(pk=file_id, then=Value(last)) for file_id, (last, _) in pending.items()],
+        output_field=DateTimeField()
+    )
+    File.objects.filter(pk__in=pending).update(
+        last_download=Greatest(downloaded_at, Coalesce(F('last_download'), downloaded_at)),
+        download_count=F('download_count') + Case(
+            *[When(pk=file_id, then=Value(count)) for file_id, (_, count) in pending.items()],
+            output_field=IntegerField()
+        ),
+    )
+
+
+_buffer = DownloadBuffer()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _safe_flush():
+    try:
+        _buffer.flush()
+    except Exception:
+        logger.exception('Не удалось записать статистику скачиваний')
+
+
+def _flush_periodically(interval):
+    while True:
+        time.sleep(interval)
+        close_old_connections()
+        _safe_flush()
+
+
+def _ensure_flusher(interval):
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_periodically, args=(interval,), name='download-stats', daemon=True
+            )
+            _flusher.start()
+            # Остаток буфера дописывается при остановке воркера
+            atexit.register(_safe_flush)
+
+
+def record(*file_ids):
+    """Отмечает скачивание файлов."""
+    for file_id in file_ids:
+        _buffer.add(file_id)
+    interval = settings.DOWNLOAD_STATS_FLUSH_INTERVAL
+    if interval <= 0:
+        _buffer.flush()
+    else:
+        _ensure_flusher(interval)
+
+
+def flush():
+    return _buffer.flush()
@@ -0,0 +1,295 @@
+import hashlib
+import uuid
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_etags, parse_http_date_safe
+
+from . import compression
+
+
+STREAM_BLOCK_SIZE = 64 * 1024
+# Больше диапазонов в одном запросе не обрабатываем и отдаем файл целиком
+MAX_RANGES = 16
+# Ответы, после которых скачивание считается состоявшимся
+DELIVERED_STATUSES = (200, 206, 302)
+
+
+def from_start(request):
+    """GET без Range или с диапазоном от начала файла, а не докачка с середины."""
+    if request.method != 'GET':
+        return False
+    range_header = request.META.get('HTTP_RANGE', '').replace(' ', '')
+    return not range_header or range_header.startswith('bytes=0-')
+
+
+def counts_as_download(request, response):
+    """
+    Засчитывать ли ответ в download_count. Докачка и загрузка файла
+    несколькими диапазонами засчитываются один раз - по запросу с начала файла.
+    """
+    if response.status_code not in DELIVERED_STATUSES:
+        return False
+    if response.status_code == 200 and not response.has_header('X-Accel-Redirect'):
+        # Django отдал файл целиком, в том числе вместо диапазона при несовпавшем If-Range
+        return request.method == 'GET'
+    # Диапазон обработали мы (206), nginx или хранилище по редиректу
+    return from_start(request)
+
+
+def file_etag(file_obj, encoding=''):
+    if file_obj.blob_id:
+        # Сжатое представление - другие байты, у него свой ETag
+        return '"%s-%s"' % (file_obj.blob.sha256, encoding) if encoding else '"%s"' % file_obj.blob.sha256
+    # Содержимое по storage_path после загрузки не меняется, поэтому
+    # путь, размер и дата загрузки однозначно определяют версию файла
+    source = f'{file_obj.storage_path}:{file_obj.size}:{file_obj.upload_date.isoformat()}'
+    return '"%s"' % hashlib.sha256(source.encode()).hexdigest()[:32]
+
+
+def _last_modified(file_obj):
+    return int(file_obj.upload_date.timestamp())
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range. Возвращает None, если заголовок нужно
+    проигнорировать, и список пар (start, end) включительно иначе.
+    Пустой список означает, что ни один диапазон не выполним.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                # Суффикс: последние N байт
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        if start > end:
+            return None
+        ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # If-Range допускает только сильное сравнение
+        return etag in parse_etags(if_range) and not if_range.startswith('W/')
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == last_modified
+
+
+def _iter_file(file, start, length):
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = file.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+def _iter_multipart(file, ranges, size, boundary):
+    try:
+        for start, end in ranges:
+            yield _part_header(boundary, start, end, size)
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = file.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+        yield f'\r\n--{boundary}--\r\n'.encode()
+    finally:
+        file.close()
+
+
+async def _aiterate(iterator):
+    # Чтение блоков уходит в пул потоков, event loop не блокируется,
+    # и ASGI-обработчику не нужно вычитывать синхронный итератор целиком
+    read_block = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            block = await read_block(iterator, None)
+            if block is None:
+                break
+            yield block
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=False)()
+
+
+def streaming_body(iterator, asynchronous):
+    return _aiterate(iterator) if asynchronous else iterator
+
+
+def _part_header(boundary, start, end, size):
+    return (
+        f'\r\n--{boundary}\r\n'
+        f'Content-Type: application/octet-stream\r\n'
+        f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+    ).encode()
+
+
+def _full_response(file_obj, asynchronous):
+    if not asynchronous and compression.stored_as_is(file_obj):
+        return FileResponse(file_obj.file.open('rb'), content_type='application/octet-stream')
+
+    # Размер сжатого файла FileResponse узнал бы, только распаковав его целиком,
+    # файл из частей склеивается по мере отдачи
+    response = StreamingHttpResponse(
+        streaming_body(_iter_file(compression.open_file(file_obj), 0, file_obj.size), asynchronous),
+        content_type='application/octet-stream'
+    )
+    response['Content-Length'] = file_obj.size
+    return response
+
+
+def _encoded_response(file_obj, asynchronous):
+    # Клиент распакует сам: байты сжатого блоба идут из хранилища как есть
+    blob = file_obj.blob
+    response = StreamingHttpResponse(
+        streaming_body(_iter_file(default_storage.open(blob.storage_name, 'rb'), 0, blob.stored_size), asynchronous),
+        content_type='application/octet-stream'
+    )
+    response['Content-Length'] = blob.stored_size
+    response['Content-Encoding'] = blob.encoding
+    return response
+
+
+def _range_response(file_obj, ranges, asynchronous):
+    size = file_obj.size
+    file = compression.open_file(file_obj)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            streaming_body(_iter_file(file, start, end - start + 1), asynchronous),
+            status=206,
+            content_type='application/octet-stream'
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
+
+    boundary = uuid.uuid4().hex
+    length = sum(
+        len(_part_header(boundary, start, end, size)) + end - start + 1
+        for start, end in ranges
+    ) + len(f'\r\n--{boundary}--\r\n')
+    response = StreamingHttpResponse(
+        streaming_body(_iter_multipart(file, ranges, size, boundary), asynchronous),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}'
+    )
+    response['Content-Length'] = length
+    return response
+
+
+def _accel_response(file_obj):
+    # Django только проверяет права, байты отдает nginx из internal-локации,
+    # Range nginx обрабатывает сам
+    response = HttpResponse(content_type='application/octet-stream')
+    response['X-Accel-Redirect'] = settings.FILE_DELIVERY_ACCEL_PREFIX + quote(file_obj.file.name)
+    return response
+
+
+def _redirect_response(file_obj):
+    # Байты идут клиенту напрямую из объектного хранилища, минуя Django.
+    # Range и условные запросы по ссылке обрабатывает само хранилище
+    url = file_obj.file.storage.presigned_url(file_obj.file.name, filename=file_obj.original_name)
+    response = HttpResponseRedirect(url)
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def _set_validators(response, etag, last_modified, encoding=''):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if encoding:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def file_response(request, file_obj, asynchronous=False):
+    """
+    Ответ на скачивание файла с поддержкой условных запросов
+    (If-None-Match, If-Modified-Since) и Range, в том числе нескольких диапазонов.
+    С asynchronous=True тело отдается асинхронным итератором для ASGI.
+    """
+    encoding = compression.file_encoding(file_obj)
+    # Диапазоны считаются по исходному содержимому, поэтому с Range
+    # сжатый файл распаковывается на сервере
+    passthrough = (
+        bool(encoding) and not request.META.get('HTTP_RANGE')
+        and compression.accepts_encoding(request, encoding)
+    )
+    etag = file_etag(file_obj, encoding if passthrough else '')
+    last_modified = _last_modified(file_obj)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return _set_validators(not_modified, etag, last_modified, encoding)
+
+    # nginx и объектное хранилище отдали бы сжатые байты без Content-Encoding,
+    # а файла из частей у них нет целиком: такие файлы всегда отдает Django
+    as_is = compression.stored_as_is(file_obj)
+    if settings.FILE_DELIVERY == 'redirect' and hasattr(file_obj.file.storage, 'presigned_url') and as_is:
+        return _redirect_response(file_obj)
+
+    if settings.FILE_DELIVERY == 'nginx' and as_is:
+        response = _accel_response(file_obj)
+    elif passthrough:
+        response = _encoded_response(file_obj, asynchronous)
+    else:
+        ranges = None
+        if _if_range_passes(request, etag, last_modified):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), file_obj.size)
+
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{file_obj.size}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+        if ranges:
+            response = _range_response(file_obj, ranges, asynchronous)
+        else:
+            response = _full_response(file_obj, asynchronous)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(True, file_obj.original_name)
+    return _set_validators(response, etag, last_modified, encoding)
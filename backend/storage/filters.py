@@ -0,0 +1,142 @@
+"""
+Поиск, фильтры и сортировка списка файлов на стороне сервера.
+
+    name=отч              подстрока в имени (без учета регистра)
+    name_prefix=отч       начало имени
+    comment=договор аренды  полнотекстовый поиск по комментарию
+    size_min, size_max    размер в байтах, включительно
+    uploaded_after, uploaded_before, downloaded_after, downloaded_before
+                          даты или дата-время ISO 8601
+    ordering=-size        name, size, upload_date, download_count, "-" - по убыванию
+    folder=12, folder=root  файлы папки или корня (индекс file_owner_folder_idx);
+                          действует и на запросы одного файла, например DELETE
+    recursive=1           с folder=<id> - вместе с вложенными папками
+
+На PostgreSQL имя ищется по триграммному индексу, комментарий - по индексу
+tsvector (миграция 0010), на других СУБД - обычным LIKE (в SQLite без
+учета регистра сравниваются только латинские буквы).
+"""
+from datetime import datetime, time
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Folder
+
+
+# Конфигурация полнотекстового поиска, должна совпадать с индексом в миграции
+SEARCH_CONFIG = 'russian'
+
+SORT_KEYS = {
+    'name': 'original_name',
+    'size': 'size',
+    'upload_date': 'upload_date',
+    'download_count': 'download_count',
+}
+DEFAULT_ORDERING = ('-upload_date', 'id')
+
+DATE_RANGES = {
+    'uploaded_after': 'upload_date__gte',
+    'uploaded_before': 'upload_date__lte',
+    'downloaded_after': 'last_download__gte',
+    'downloaded_before': 'last_download__lte',
+}
+
+
+def _invalid(param):
+    return ValidationError({"error": f"Некорректное значение параметра {param}"})
+
+
+def _parse_size(params, param):
+    try:
+        size = int(params[param])
+    except ValueError:
+        raise _invalid(param)
+    if size < 0:
+        raise _invalid(param)
+    return size
+
+
+def _parse_moment(params, param):
+    value = params[param]
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise _invalid(param)
+        # Дата без времени: before - до конца дня, after - с его начала
+        moment = datetime.combine(day, time.max if param.endswith('_before') else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_folder(queryset, params):
+    value = params['folder']
+    if value == 'root':
+        return queryset.filter(folder__isnull=True)
+    try:
+        folder_id = int(value)
+    except ValueError:
+        raise _invalid('folder')
+    if params.get('recursive') not in ('1', 'true'):
+        return queryset.filter(folder_id=folder_id)
+
+    # Путь подставляется литералом: LIKE с постоянным префиксом идет по индексу
+    path = Folder.objects.filter(pk=folder_id).values_list('path', flat=True).first()
+    if path is None:
+        return queryset.none()
+    return queryset.filter(folder__path__startswith=path)
+
+
+def file_ordering(params):
+    """Поля сортировки из параметра ordering, id в конце делает порядок однозначным."""
+    value = params.get('ordering')
+    if not value:
+        return DEFAULT_ORDERING
+    key = value.lstrip('-')
+    if key not in SORT_KEYS:
+        raise ValidationError({"error": f"Сортировка возможна по: {', '.join(SORT_KEYS)}"})
+    prefix = '-' if value.startswith('-') else ''
+    return (f'{prefix}{SORT_KEYS[key]}', f'{prefix}id')
+
+
+def search_comment(queryset, text):
+    if connection.vendor == 'postgresql':
+        return queryset.alias(
+            comment_vector=SearchVector('comment', config=SEARCH_CONFIG)
+        ).filter(comment_vector=SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch'))
+
+    for word in text.split():
+        queryset = queryset.filter(comment__icontains=word)
+    return queryset
+
+
+class FileSearchFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        # Чужая папка дает пустой результат: queryset уже ограничен владельцем
+        if params.get('folder'):
+            queryset = filter_folder(queryset, params)
+        if params.get('name'):
+            queryset = queryset.filter(original_name__icontains=params['name'])
+        if params.get('name_prefix'):
+            queryset = queryset.filter(original_name__istartswith=params['name_prefix'])
+        if params.get('comment'):
+            queryset = search_comment(queryset, params['comment'])
+
+        if params.get('size_min'):
+            queryset = queryset.filter(size__gte=_parse_size(params, 'size_min'))
+        if params.get('size_max'):
+            queryset = queryset.filter(size__lte=_parse_size(params, 'size_max'))
+
+        for param, lookup in DATE_RANGES.items():
+            if params.get(param):
+                queryset = queryset.filter(**{lookup: _parse_moment(params, param)})
+
+        return queryset.order_by(*file_ordering(params))
@@ -0,0 +1,128 @@
+"""
+Дерево папок пользователя на материализованном пути.
+
+Путь папки - id всех папок от корня до нее самой: '/1/5/9/'. Поддерево папки
+- строки, путь которых начинается с ее пути, это один диапазон индекса
+folder_path_idx. Файлы ссылаются на папку по id, поэтому переименование
+и перенос папки файлов не касаются:
+
+    переименование  UPDATE одной строки (путь из id не меняется)
+    перенос         UPDATE путей поддерева одним запросом и изменение
+                    размеров старых и новых предков
+    удаление        DELETE файлов поддерева и DELETE папок по префиксу пути
+
+Размер и число файлов папки - сумма по всему поддереву, они меняются
+вместе с StorageUsage при загрузке и удалении файлов (Folder.objects.adjust).
+"""
+from django.db import transaction
+from django.db.models import Case, F, Max, Value, When
+from django.db.models.functions import Concat, Length, Substr
+
+from . import deletion
+from .models import File, FileEvent, Folder
+
+
+class FolderError(Exception):
+    """Операция с папкой невозможна, текст - для ответа пользователю."""
+
+
+def validate_name(name):
+    name = (name or '').strip()
+    if not name:
+        raise FolderError('Имя папки не может быть пустым')
+    if '/' in name or name in ('.', '..'):
+        raise FolderError('Имя папки не может содержать "/" и быть "." или ".."')
+    if len(name) > 255:
+        raise FolderError('Имя папки не может быть длиннее 255 символов')
+    return name
+
+
+def create(owner, name, parent=None):
+    name = validate_name(name)
+    with transaction.atomic():
+        folder = Folder.objects.create(owner=owner, parent=parent, name=name)
+        # Путь содержит собственный id, известный только после вставки
+        folder.path = f'{parent.path if parent else "/"}{folder.pk}/'
+        if len(folder.path) > Folder.PATH_MAX_LENGTH:
+            raise FolderError('Слишком глубокая вложенность папок')
+        Folder.objects.filter(pk=folder.pk).update(path=folder.path)
+    return folder
+
+
+def rename(folder, name):
+    folder.name = validate_name(name)
+    Folder.objects.filter(pk=folder.pk).update(name=folder.name)
+    return folder
+
+
+def move(folder, parent):
+    """
+    Переносит папку со всем поддеревом в parent (None - в корень).
+    Пути поддерева и ссылка на родителя меняются одним UPDATE.
+    """
+    with transaction.atomic():
+        # Обе папки блокируются в порядке id: параллельные встречные переносы
+        # выполняются по очереди и видят пути друг друга
+        ids = sorted({folder.pk, parent.pk} if parent else {folder.pk})
+        locked = {item.pk: item for item in Folder.objects.select_for_update().filter(pk__in=ids).order_by('pk')}
+        folder = locked[folder.pk]
+        parent = locked[parent.pk] if parent else None
+
+        if parent is not None and parent.path.startswith(folder.path):
+            raise FolderError('Нельзя переместить папку в нее саму или во вложенную папку')
+        if folder.parent_id == (parent.pk if parent else None):
+            return folder
+
+        old_prefix = folder.path
+        new_prefix = f'{parent.path if parent else "/"}{folder.pk}/'
+        subtree = Folder.objects.filter(path__startswith=old_prefix)
+        longest = subtree.aggregate(longest=Max(Length('path')))['longest']
+        if longest - len(old_prefix) + len(new_prefix) > Folder.PATH_MAX_LENGTH:
+            raise FolderError('Слишком глубокая вложенность папок')
+
+        old_parent_id = folder.parent_id
+        subtree.update(
+            path=Concat(Value(new_prefix), Substr('path', len(old_prefix) + 1)),
+            parent=Case(
+                When(pk=folder.pk, then=Value(parent.pk if parent else None)),
+                default=F('parent'),
+                output_field=Folder._meta.pk,
+            ),
+        )
+
+        # Поддерево уносит свои файлы из размеров старых предков в новые
+        delta = (folder.size, folder.file_count)
+        if old_parent_id:
+            Folder.objects.adjust({old_parent_id: (-delta[0], -delta[1])})
+        if parent is not None:
+            Folder.objects.adjust({parent.pk: delta})
+
+        folder.parent = parent
+        folder.path = new_prefix
+    return folder
+
+
+def move_file(file_obj, folder):
+    """Переносит файл в folder (None - в корень)."""
+    with transaction.atomic():
+        old_folder_id = file_obj.folder_id
+        file_obj.folder = folder
+        File.objects.filter(pk=file_obj.pk).update(folder=folder)
+        if old_folder_id:
+            Folder.objects.adjust({old_folder_id: (-file_obj.size, -1)})
+        if folder is not None:
+            Folder.objects.adjust({folder.pk: (file_obj.size, 1)})
+        FileEvent.objects.record(
+            file_obj.owner_id, [(file_obj.pk, FileEvent.UPDATED, FileEvent.snapshot(file_obj))]
+        )
+    return file_obj
+
+
+def delete(folder):
+    """Удаляет папку, вложенные папки и все их файлы. Возвращает id удаленных файлов."""
+    with transaction.atomic():
+        # Размеры предков уменьшает bulk_delete вместе со счетчиками хранилища
+        deleted = deletion.bulk_delete(File.objects.filter(folder__path__startswith=folder.path))
+        # Файлов в поддереве уже нет, вложенные папки удаляются вместе с ней
+        deletion.raw_delete(Folder.objects.filter(path__startswith=folder.path))
+    return deleted
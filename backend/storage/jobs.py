@@ -0,0 +1,165 @@
+"""
+Очередь фоновых задач в таблице Job, без внешнего брокера.
+
+Задача создается в той же транзакции, что и файл: она не теряется при
+падении процесса и не выполняется для незакоммиченной загрузки.
+manage.py run_jobs забирает задачи (на PostgreSQL - SELECT ... FOR UPDATE
+SKIP LOCKED, несколько воркеров не мешают друг другу), выполняет их в пуле
+потоков и повторяет упавшие с нарастающей задержкой. Задача, воркер которой
+умер, снова становится доступной после JOB_LEASE_TIMEOUT.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import compression
+from .models import File, Job
+from .sniffing import SNIFF_SIZE, sniff_content_type
+
+
+logger = logging.getLogger(__name__)
+
+VERIFY_UPLOAD = 'verify_upload'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class PermanentError(Exception):
+    """Ошибка, которую повтор задачи не исправит."""
+
+
+def enqueue(kind, file_obj):
+    return Job.objects.create(kind=kind, file=file_obj)
+
+
+def enqueue_many(kind, files):
+    return Job.objects.bulk_create([Job(kind=kind, file=file_obj) for file_obj in files])
+
+
+def claim(limit):
+    """Забирает до limit готовых к выполнению задач и продлевает им аренду."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now))
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids).update(
+            status=Job.RUNNING,
+            attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=settings.JOB_LEASE_TIMEOUT),
+        )
+    return list(Job.objects.filter(pk__in=ids).select_related('file__blob'))
+
+
+def _sources(file_obj):
+    """Содержимое файла по порядку: (ожидаемый SHA-256 или None, открытый поток)."""
+    blob = file_obj.blob if file_obj.blob_id else None
+    if blob is not None and blob.chunk_count:
+        # Хэш блоба из частей - хэш их списка, поэтому сверяется каждая часть
+        for sha256, size, storage_name, encoding in blob.chunk_parts():
+            yield sha256, compression.open_stored(storage_name, encoding, size)
+    else:
+        yield (blob.sha256 if blob else None), compression.open_file(file_obj)
+
+
+def verify_upload(job):
+    """
+    Читает сохраненное содержимое потоком, считает SHA-256 и тип по первым
+    байтам и записывает их в File. Расхождение с хэшем, посчитанным при
+    загрузке, означает повреждение в хранилище.
+    """
+    file_obj = job.file
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
+    damaged = []
+    # Сжатый блоб распаковывается: проверяется исходное содержимое
+    for expected, source in _sources(file_obj):
+        part_digest = hashlib.sha256()
+        with source:
+            while block := source.read(HASH_BLOCK_SIZE):
+                if len(head) < SNIFF_SIZE:
+                    head += block[:SNIFF_SIZE - len(head)]
+                digest.update(block)
+                part_digest.update(block)
+                size += len(block)
+        if expected not in (None, part_digest.hexdigest()):
+            damaged.append(expected)
+
+    sha256 = digest.hexdigest()
+    content_type = sniff_content_type(head, file_obj.original_name)
+    intact = size == file_obj.size and not damaged
+
+    File.objects.filter(pk=file_obj.pk).update(
+        sha256=sha256,
+        content_type=content_type,
+        verified_at=timezone.now() if intact else None,
+    )
+    if not intact:
+        if file_obj.blob_id and file_obj.blob.chunk_count:
+            expected = f'повреждены части: {", ".join(damaged) or "нет"}'
+        else:
+            expected = f'SHA-256 {file_obj.blob.sha256 if file_obj.blob_id else None}'
+        raise PermanentError(
+            f'Содержимое файла {file_obj.pk} не совпадает с загруженным: '
+            f'{size} байт, SHA-256 {sha256}, ожидалось {file_obj.size} байт, {expected}'
+        )
+    return {'sha256': sha256, 'content_type': content_type, 'size': size}
+
+
+HANDLERS = {
+    VERIFY_UPLOAD: verify_upload,
+}
+
+
+def run(job):
+    """Выполняет задачу и записывает итог. Возвращает новый статус."""
+    try:
+        result = HANDLERS[job.kind](job)
+    except Exception as e:
+        permanent = isinstance(e, PermanentError) or job.kind not in HANDLERS
+        if permanent or job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            logger.error(f'Задача {job} завершилась ошибкой: {e}')
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, error=str(e), locked_until=None, finished_at=timezone.now()
+            )
+            return Job.FAILED
+
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        logger.warning(f'Задача {job} будет повторена через {delay} с: {e}')
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.QUEUED, error=str(e), locked_until=None,
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+        return Job.QUEUED
+
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE, result=result, error='', locked_until=None, finished_at=timezone.now()
+    )
+    return Job.DONE
+
+
+def run_in_thread(job):
+    # У каждого потока воркера свое соединение с БД, оно проверяется,
+    # как между запросами
+    close_old_connections()
+    try:
+        return run(job)
+    finally:
+        close_old_connections()
+
+
+def purge_finished():
+    """Удаляет выполненные задачи старше JOB_RETENTION, упавшие остаются для разбора."""
+    deadline = timezone.now() - settings.JOB_RETENTION
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=deadline).delete()
+    return deleted
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from storage import delta, uploads
+from storage.models import DeltaUpload, UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Удаляет незавершенные загрузки по частям и дельтой старше CHUNKED_UPLOAD_EXPIRATION'
+
+    def handle(self, *args, **options):
+        deadline = timezone.now() - settings.CHUNKED_UPLOAD_EXPIRATION
+        expired = UploadSession.objects.filter(created_at__lt=deadline)
+
+        count = 0
+        for session in expired.iterator():
+            uploads.discard(session)
+            session.delete()
+            count += 1
+
+        # Присланные части освобождаются, без других ссылок их заберет collect_garbage
+        for session in DeltaUpload.objects.filter(created_at__lt=deadline).iterator():
+            delta.discard(session)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Удалено незавершенных загрузок: {count}'))
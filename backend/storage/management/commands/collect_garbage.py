@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from storage.deletion import collect_blobs, sweep_orphans
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища блобы без ссылок и файлы, на которые не ссылается ни одна запись'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Число потоков, удаляющих файлы')
+        parser.add_argument('--sweep-orphans', action='store_true',
+                            help='Дополнительно обойти user_* и blobs в поисках файлов без записи в БД')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать сирот моложе стольких секунд (идущие загрузки)')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        action = 'Будет удалено' if dry_run else 'Удалено'
+
+        blobs, freed = collect_blobs(workers=options['workers'], dry_run=dry_run)
+        self.stdout.write(self.style.SUCCESS(f'{action} блобов без ссылок: {blobs} ({freed} байт)'))
+
+        if options['sweep_orphans']:
+            orphans = sweep_orphans(
+                workers=options['workers'],
+                min_age=timedelta(seconds=options['min_age']),
+                dry_run=dry_run
+            )
+            self.stdout.write(self.style.SUCCESS(f'{action} файлов без записи в БД: {orphans}'))
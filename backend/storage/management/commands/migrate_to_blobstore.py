@@ -0,0 +1,51 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from storage.models import Blob, File
+from storage.upload_handlers import hash_file
+
+
+class Command(BaseCommand):
+    help = 'Переносит файлы, сохраненные по storage_path, в общее хранилище блобов с дедупликацией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не переносить')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        migrated = deduplicated = missing = 0
+        saved_bytes = 0
+
+        for file_obj in File.objects.filter(blob__isnull=True).iterator():
+            old_name = file_obj.file.name
+            if not old_name or not default_storage.exists(old_name):
+                self.stderr.write(f'Файл ID:{file_obj.pk} отсутствует в хранилище: {old_name}')
+                missing += 1
+                continue
+
+            with default_storage.open(old_name, 'rb') as fh:
+                sha256 = hash_file(fh)
+
+            exists = Blob.objects.filter(sha256=sha256, chunk_count=0).exists()
+            if exists:
+                deduplicated += 1
+                saved_bytes += file_obj.size
+            migrated += 1
+            if dry_run:
+                continue
+
+            # Старый файл копируется, а удаляется только после фиксации
+            # транзакции, чтобы сбой посередине не терял данные
+            with default_storage.open(old_name, 'rb') as fh, transaction.atomic():
+                blob = Blob.objects.store(fh, sha256, file_obj.size, name=file_obj.original_name)
+                File.objects.filter(pk=file_obj.pk).update(blob=blob, file=blob.storage_name)
+
+            if old_name != blob.storage_name and default_storage.exists(old_name):
+                default_storage.delete(old_name)
+
+        action = 'Будет перенесено' if dry_run else 'Перенесено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {migrated}, из них дубликатов: {deduplicated} '
+            f'({saved_bytes} байт освобождено), отсутствует в хранилище: {missing}'
+        ))
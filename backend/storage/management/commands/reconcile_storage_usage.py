@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from storage.models import File, Folder, StorageUsage
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики использования хранилища и размеры папок по таблице файлов и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        actual = User.objects.annotate(bytes_used=Sum('files__size'), file_count=Count('files'))
+        stored = {usage.user_id: usage for usage in StorageUsage.objects.all()}
+
+        repaired = 0
+        for user in actual.iterator():
+            bytes_used = user.bytes_used or 0
+            usage = stored.get(user.id)
+            if usage and usage.bytes_used == bytes_used and usage.file_count == user.file_count:
+                continue
+
+            repaired += 1
+            self.stdout.write(
+                f'{user.username}: {usage.bytes_used if usage else None} байт / '
+                f'{usage.file_count if usage else None} файлов -> {bytes_used} байт / {user.file_count} файлов'
+            )
+            if not options['dry_run']:
+                StorageUsage.objects.update_or_create(
+                    user=user, defaults={'bytes_used': bytes_used, 'file_count': user.file_count}
+                )
+
+        repaired += self.reconcile_folders(options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(f'Исправлено расхождений: {repaired}'))
+
+    def reconcile_folders(self, dry_run):
+        # Суммы по файлам каждой папки раскладываются на всех ее предков по пути
+        paths = dict(Folder.objects.values_list('id', 'path'))
+        direct = (
+            File.objects.filter(folder__isnull=False).order_by()
+            .values('folder_id').annotate(size=Sum('size'), count=Count('id'))
+        )
+        totals = defaultdict(lambda: (0, 0))
+        for row in direct:
+            for folder_id in Folder.path_ids(paths.get(row['folder_id'], '')):
+                size, count = totals[folder_id]
+                totals[folder_id] = (size + row['size'], count + row['count'])
+
+        repaired = 0
+        for folder in Folder.objects.only('id', 'path', 'size', 'file_count').iterator():
+            size, count = totals[folder.pk]
+            if folder.size == size and folder.file_count == count:
+                continue
+
+            repaired += 1
+            self.stdout.write(
+                f'Папка {folder.path}: {folder.size} байт / {folder.file_count} файлов -> {size} байт / {count} файлов'
+            )
+            if not dry_run:
+                Folder.objects.filter(pk=folder.pk).update(size=size, file_count=count)
+        return repaired
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from storage import changes, jobs
+
+
+# Как часто воркер удаляет старые выполненные задачи и сжимает журнал изменений, секунд
+PURGE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в БД (проверка загруженных файлов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Число задач, выполняемых одновременно')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, секунд')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        processed = 0
+        next_purge = 0
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            try:
+                while True:
+                    if time.monotonic() >= next_purge:
+                        jobs.purge_finished()
+                        changes.compact()
+                        next_purge = time.monotonic() + PURGE_INTERVAL
+
+                    # Новые задачи забираются по мере освобождения потоков
+                    if len(in_flight) < concurrency:
+                        for job in jobs.claim(concurrency - len(in_flight)):
+                            in_flight.add(pool.submit(jobs.run_in_thread, job))
+
+                    if in_flight:
+                        done, in_flight = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                        processed += len(done)
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                # Начатые задачи доделываются, остальные дождутся следующего запуска
+                self.stdout.write('Остановка, ожидание выполняемых задач...')
+                processed += len(wait(in_flight).done)
+
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {processed}'))
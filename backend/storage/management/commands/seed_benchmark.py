@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from storage import deletion
+from storage.models import Blob, File, ShareLink, StorageUsage
+
+
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'bench-password'
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает синтетические данные для benchmarks/api_bench.py: по пользователю '
+        'на каждый размер списка и общий блоб, на который ссылаются все файлы'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list-sizes', default='1000,10000,100000',
+                            help='Сколько файлов создать пользователям, через запятую')
+        parser.add_argument('--file-size', type=int, default=1024 * 1024,
+                            help='Размер содержимого файлов (для скачивания), байт')
+        parser.add_argument('--manifest', default='benchmarks/manifest.json',
+                            help='Куда записать логины и id файлов для бенчмарка')
+        parser.add_argument('--reset', action='store_true', help='Удалить данные предыдущего запуска')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            self.reset()
+
+        sizes = [int(size) for size in options['list_sizes'].split(',') if size]
+        blob = self.create_blob(options['file_size'])
+
+        users = {}
+        for count in sizes:
+            user = self.create_user(count, blob)
+            first = File.objects.filter(owner=user).order_by('id').first()
+            link = ShareLink.objects.filter(file=first).first() or ShareLink.objects.create(file=first)
+            users[str(count)] = {
+                'username': user.username,
+                'password': PASSWORD,
+                'file_id': first.pk,
+                'share_link': str(link.token),
+            }
+            self.stdout.write(f'{user.username}: {count} файлов')
+
+        manifest = {
+            'database': connection.vendor,
+            'file_size': options['file_size'],
+            'users': users,
+        }
+        os.makedirs(os.path.dirname(options['manifest']) or '.', exist_ok=True)
+        with open(options['manifest'], 'w') as target:
+            json.dump(manifest, target, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Данные созданы, манифест: {options['manifest']}"))
+
+    def reset(self):
+        users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        for user in users:
+            with transaction.atomic():
+                deletion.bulk_delete(File.objects.filter(owner=user))
+                user.delete()
+
+    def create_blob(self, size):
+        # Одно содержимое на все файлы: данные создаются быстро и почти
+        # не занимают место, а скачивание идет через обычный путь блоба
+        content = (b'benchmark data\n' * (size // 15 + 1))[:size]
+        sha256 = hashlib.sha256(content).hexdigest()
+        blob = Blob.objects.store(ContentFile(content), sha256, size, name='benchmark.txt')
+        # Ссылку от store отдают файлы, создаваемые ниже
+        Blob.objects.release(blob.pk)
+        return blob
+
+    def create_user(self, count, blob):
+        username = f'{USERNAME_PREFIX}{count}'
+        user, created = User.objects.get_or_create(username=username)
+        if created:
+            user.set_password(PASSWORD)
+            user.save()
+
+        existing = File.objects.filter(owner=user).count()
+        missing = max(count - existing, 0)
+        for start in range(existing, existing + missing, BATCH_SIZE):
+            end = min(start + BATCH_SIZE, existing + missing)
+            # bulk_create не шлет post_save, счетчики обновляются ниже одним запросом
+            File.objects.bulk_create([
+                File(
+                    owner=user,
+                    original_name=f'bench_{i:07d}.txt',
+                    storage_path=f'user_{user.pk}/bench_{i:07d}.txt',
+                    size=blob.size,
+                    blob=blob,
+                    file=blob.storage_name,
+                    comment=f'синтетический файл {i}',
+                )
+                for i in range(start, end)
+            ], batch_size=BATCH_SIZE)
+
+        if missing:
+            StorageUsage.objects.add(user.pk, blob.size * missing, missing)
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + missing)
+        return user
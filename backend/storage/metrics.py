@@ -0,0 +1,261 @@
+"""
+Метрики производительности запросов в формате Prometheus.
+
+MetricsMiddleware считает по каждому маршруту (имя URL) задержку, число и
+время запросов к БД, принятые и отданные байты, а также число потоковых
+ответов, которые еще передаются. Медленные запросы пишутся в лог одной
+JSON-строкой. Метрики хранятся в памяти процесса: каждый воркер gunicorn
+отдает на /api/metrics свои значения.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import cache
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'mycloud'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_request_stats = contextvars.ContextVar('storage_request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('db_queries', 'db_time')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+
+
+def _db_timer(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_db_timer(sender, connection, **kwargs):
+    # Обертка ставится на каждое соединение один раз; вне запроса
+    # (команды, фоновые потоки) она сразу передает вызов дальше
+    if _db_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_timer)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)  # (route, method, status)
+        self.latency = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))  # (route, method)
+        self.latency_sum = defaultdict(float)
+        self.db_queries = defaultdict(int)  # route
+        self.db_time = defaultdict(float)
+        self.bytes_received = defaultdict(int)
+        self.bytes_sent = defaultdict(int)
+        self.streams_in_flight = 0
+
+    def observe(self, route, method, status, duration, stats, received):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if duration <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            self.requests[route, method, status] += 1
+            self.latency[route, method][bucket] += 1
+            self.latency_sum[route, method] += duration
+            self.db_queries[route] += stats.db_queries
+            self.db_time[route] += stats.db_time
+            self.bytes_received[route] += received
+
+    def add_sent(self, route, size):
+        with self._lock:
+            self.bytes_sent[route] += size
+
+    def stream_started(self):
+        with self._lock:
+            self.streams_in_flight += 1
+
+    def stream_finished(self, route, size):
+        with self._lock:
+            self.streams_in_flight -= 1
+            self.bytes_sent[route] += size
+
+    def render(self):
+        with self._lock:
+            requests = dict(self.requests)
+            latency = {key: list(counts) for key, counts in self.latency.items()}
+            latency_sum = dict(self.latency_sum)
+            db_queries, db_time = dict(self.db_queries), dict(self.db_time)
+            received, sent = dict(self.bytes_received), dict(self.bytes_sent)
+            in_flight = self.streams_in_flight
+
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+        def sample(name, labels, value):
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f'{PREFIX}_{name}{{{label_text}}} {value}' if label_text else f'{PREFIX}_{name} {value}')
+
+        family('http_requests_total', 'counter', 'HTTP requests by route, method and status.')
+        for (route, method, status), value in sorted(requests.items()):
+            sample('http_requests_total', {'route': route, 'method': method, 'status': status}, value)
+
+        family('http_request_duration_seconds', 'histogram', 'Time until the view returned a response.')
+        for (route, method), counts in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                sample('http_request_duration_seconds_bucket',
+                       {'route': route, 'method': method, 'le': bound}, cumulative)
+            sample('http_request_duration_seconds_sum', {'route': route, 'method': method},
+                   round(latency_sum[route, method], 6))
+            sample('http_request_duration_seconds_count', {'route': route, 'method': method}, cumulative)
+
+        family('db_queries_total', 'counter', 'Database queries executed while handling requests.')
+        for route, value in sorted(db_queries.items()):
+            sample('db_queries_total', {'route': route}, value)
+
+        family('db_query_duration_seconds_total', 'counter', 'Time spent in database queries.')
+        for route, value in sorted(db_time.items()):
+            sample('db_query_duration_seconds_total', {'route': route}, round(value, 6))
+
+        family('http_request_bytes_total', 'counter', 'Request body bytes received (Content-Length).')
+        for route, value in sorted(received.items()):
+            sample('http_request_bytes_total', {'route': route}, value)
+
+        family('http_response_bytes_total', 'counter', 'Response body bytes sent.')
+        for route, value in sorted(sent.items()):
+            sample('http_response_bytes_total', {'route': route}, value)
+
+        family('streaming_responses_in_flight', 'gauge', 'Streaming responses still being transferred.')
+        sample('streaming_responses_in_flight', {}, in_flight)
+
+        family('cache_requests_total', 'counter', 'Cache lookups by namespace and result.')
+        for namespace, values in cache.stats().items():
+            for result in ('hits', 'misses'):
+                sample('cache_requests_total', {'namespace': namespace, 'result': result}, values[result])
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def _counted(chunks, counter, asynchronous):
+    if asynchronous:
+        async def counted():
+            async for chunk in chunks:
+                counter[0] += len(chunk)
+                yield chunk
+    else:
+        def counted():
+            for chunk in chunks:
+                counter[0] += len(chunk)
+                yield chunk
+    return counted()
+
+
+def _track_stream(response, route):
+    # Без Content-Length тело оборачивается счетчиком байт. Поток считается
+    # завершенным, когда сервер закрывает ответ
+    length = response.get('Content-Length')
+    sent = [0]
+    if length is None:
+        response.streaming_content = _counted(response.streaming_content, sent, response.is_async)
+
+    registry.stream_started()
+    # Публичного хука на закрытие ответа нет, Django сам пользуется этим списком
+    response._resource_closers.append(
+        lambda: registry.stream_finished(route, int(length) if length is not None else sent[0])
+    )
+
+
+def _user(request, response):
+    # JWT проверяет не AuthenticationMiddleware, а DRF внутри view: пользователь
+    # берется из запроса DRF, асинхронные view кладут его в request.user сами
+    drf_request = (getattr(response, 'renderer_context', None) or {}).get('request')
+    if drf_request is not None:
+        return drf_request.user
+    return getattr(request, 'user', None)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self):
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        return stats, token, time.perf_counter()
+
+    def _finish(self, request, response, stats, token, started):
+        duration = time.perf_counter() - started
+        _request_stats.reset(token)
+
+        route = _route(request)
+        received = int(request.META.get('CONTENT_LENGTH') or 0)
+        registry.observe(route, request.method, response.status_code, duration, stats, received)
+
+        if response.streaming:
+            _track_stream(response, route)
+        else:
+            registry.add_sent(route, len(response.content))
+
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            user = _user(request, response)
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'route': route,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 1),
+                'db_queries': stats.db_queries,
+                'db_time_ms': round(stats.db_time * 1000, 1),
+                'user_id': user.pk if user is not None and user.is_authenticated else None,
+            }, ensure_ascii=False))
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self._start()
+        response = self.get_response(request)
+        return self._finish(request, response, stats, token, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self._start()
+        response = await self.get_response(request)
+        return self._finish(request, response, stats, token, started)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_storage_usage(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    StorageUsage = apps.get_model('storage', 'StorageUsage')
+
+    users = User.objects.annotate(bytes_used=Sum('files__size'), file_count=Count('files'))
+    StorageUsage.objects.bulk_create([
+        StorageUsage(user_id=user.id, bytes_used=user.bytes_used or 0, file_count=user.file_count)
+        for user in users.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('storage', '0005_file_pagination_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+                ('quota_bytes', models.BigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Использование хранилища',
+                'verbose_name_plural': 'Использование хранилища',
+            },
+        ),
+        migrations.RunPython(fill_storage_usage, migrations.RunPython.noop),
+    ]
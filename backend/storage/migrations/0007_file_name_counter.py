@@ -0,0 +1,62 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:05
+
+import os
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicates(apps, schema_editor):
+    # Перед созданием уникального индекса (owner, original_name)
+    # переименовываем повторы так же, как это делала загрузка: name_1.ext, ...
+    File = apps.get_model('storage', 'File')
+
+    duplicates = (
+        File.objects.values('owner_id', 'original_name')
+        .annotate(copies=Count('id'))
+        .filter(copies__gt=1)
+    )
+    for duplicate in duplicates:
+        owner_id, name = duplicate['owner_id'], duplicate['original_name']
+        base_name, ext = os.path.splitext(name)
+        taken = set(
+            File.objects.filter(owner_id=owner_id, original_name__startswith=base_name)
+            .values_list('original_name', flat=True)
+        )
+
+        counter = 1
+        extra = File.objects.filter(owner_id=owner_id, original_name=name).order_by('upload_date', 'id')[1:]
+        for file_id in extra.values_list('id', flat=True):
+            while f'{base_name}_{counter}{ext}' in taken:
+                counter += 1
+            new_name = f'{base_name}_{counter}{ext}'
+            taken.add(new_name)
+            File.objects.filter(pk=file_id).update(original_name=new_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_storage_usage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileNameCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('last_suffix', models.PositiveIntegerField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_name_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Счетчик имен файлов',
+                'verbose_name_plural': 'Счетчики имен файлов',
+                'constraints': [models.UniqueConstraint(fields=('owner', 'name'), name='unique_file_name_counter')],
+            },
+        ),
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0008_file_unique_name_per_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='download_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
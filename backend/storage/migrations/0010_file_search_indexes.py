@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Выражения должны совпадать с запросами в storage.filters: icontains на
+# PostgreSQL сравнивает UPPER(original_name), поиск по комментарию строит
+# to_tsvector с конфигурацией SEARCH_CONFIG
+SEARCH_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS file_name_trgm_idx '
+    'ON storage_file USING gin (UPPER(original_name) gin_trgm_ops)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS file_comment_fts_idx '
+    "ON storage_file USING gin (to_tsvector('russian'::regconfig, COALESCE(comment, '')))",
+]
+DROP_SEARCH_INDEXES = [
+    'DROP INDEX CONCURRENTLY IF EXISTS file_name_trgm_idx',
+    'DROP INDEX CONCURRENTLY IF EXISTS file_comment_fts_idx',
+]
+
+
+def _run_on_postgresql(statements):
+    # Индексы только для PostgreSQL, на SQLite поиск работает без них
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции,
+    # зато не блокирует запись в таблицу на время построения
+    atomic = False
+
+    dependencies = [
+        ('storage', '0009_file_download_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['owner', 'size', 'id'], name='file_owner_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['owner', 'download_count', 'id'], name='file_owner_downloads_idx'),
+        ),
+        migrations.RunPython(_run_on_postgresql(SEARCH_INDEXES), _run_on_postgresql(DROP_SEARCH_INDEXES)),
+    ]
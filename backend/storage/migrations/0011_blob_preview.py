@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0010_file_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='preview_status',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='preview_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_stored_size(apps, schema_editor):
+    # Блобы до появления сжатия хранятся как есть
+    Blob = apps.get_model('storage', 'Blob')
+    Blob.objects.update(stored_size=F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0012_upload_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(),
+        ),
+    ]
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+BATCH_SIZE = 5000
+
+
+def copy_share_links(apps, schema_editor):
+    # У каждого файла была бессрочная ссылка: она переносится с тем же
+    # токеном, чтобы уже разосланные адреса продолжали работать
+    File = apps.get_model('storage', 'File')
+    ShareLink = apps.get_model('storage', 'ShareLink')
+    batch = []
+    for file_id, token in File.objects.values_list('id', 'share_link').iterator(chunk_size=BATCH_SIZE):
+        batch.append(ShareLink(file_id=file_id, token=token))
+        if len(batch) >= BATCH_SIZE:
+            ShareLink.objects.bulk_create(batch)
+            batch = []
+    ShareLink.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0014_folders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShareLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('max_downloads', models.PositiveIntegerField(blank=True, null=True)),
+                ('download_count', models.PositiveIntegerField(default=0)),
+                ('password', models.CharField(blank=True, max_length=128)),
+                ('revoked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='share_links', to='storage.file')),
+            ],
+            options={
+                'verbose_name': 'Публичная ссылка',
+                'verbose_name_plural': 'Публичные ссылки',
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.RunPython(copy_share_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Отдельная миграция: на PostgreSQL таблицу нельзя менять в той же
+    # транзакции, где в связанную таблицу вставлялись строки (0015)
+
+    dependencies = [
+        ('storage', '0015_share_links'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='file',
+            name='share_link',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('storage', '0016_remove_file_share_link'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeFeed',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='change_feed', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seq', models.BigIntegerField(default=0)),
+                ('pruned_seq', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Лента изменений',
+                'verbose_name_plural': 'Ленты изменений',
+            },
+        ),
+        migrations.CreateModel(
+            name='FileEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('file_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('created', 'Создан'), ('updated', 'Изменен'), ('deleted', 'Удален')], max_length=16)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='file_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Событие файла',
+                'verbose_name_plural': 'События файлов',
+                'ordering': ['owner', 'seq'],
+                'indexes': [models.Index(fields=['owner', 'file_id', 'seq'], name='file_event_file_idx'), models.Index(fields=['created_at'], name='file_event_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'seq'), name='unique_file_event_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:03
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0017_change_feed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='chunk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DeltaUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('original_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('comment', models.TextField(blank=True)),
+                ('manifest', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delta_uploads', to=settings.AUTH_USER_MODEL)),
+                ('received', models.ManyToManyField(blank=True, related_name='delta_uploads', to='storage.blob')),
+            ],
+            options={
+                'verbose_name': 'Загрузка дельтой',
+                'verbose_name_plural': 'Загрузки дельтой',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BlobChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='storage.blob')),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='chunk_of', to='storage.blob')),
+            ],
+            options={
+                'verbose_name': 'Часть блоба',
+                'verbose_name_plural': 'Части блобов',
+                'constraints': [models.UniqueConstraint(fields=('blob', 'index'), name='unique_blob_chunk_index')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Concat
+
+
+def rename_chunked_blobs(apps, schema_editor):
+    # Имя блоба из частей не должно совпадать с именем обычного блоба с тем же
+    # хэшем: по нему строится имя превью. Старые превью удалит sweep_orphans
+    Blob = apps.get_model('storage', 'Blob')
+    Blob.objects.filter(chunk_count__gt=0).exclude(storage_name__endswith='.chunks').update(
+        storage_name=Concat('storage_name', Value('.chunks')), preview_status='', preview_updated_at=None
+    )
+    File = apps.get_model('storage', 'File')
+    File.objects.filter(blob__chunk_count__gt=0).update(
+        file=Subquery(Blob.objects.filter(pk=OuterRef('blob_id')).values('storage_name')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0018_delta_uploads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blob',
+            name='sha256',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='blob',
+            constraint=models.UniqueConstraint(condition=models.Q(('chunk_count', 0)), fields=('sha256',), name='unique_plain_blob_sha256'),
+        ),
+        migrations.AddConstraint(
+            model_name='blob',
+            constraint=models.UniqueConstraint(condition=models.Q(('chunk_count__gt', 0)), fields=('sha256',), name='unique_chunked_blob_sha256'),
+        ),
+        migrations.RunPython(rename_chunked_blobs, migrations.RunPython.noop),
+    ]
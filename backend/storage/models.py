@@ -1,13 +1,244 @@
+import math
 import uuid
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-from django.db.models.signals import post_delete
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.conf import settings
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate
 from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, compression
 
 
 def user_directory_path(instance, filename):
     return instance.storage_path
 
+def blob_path(sha256):
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+def chunked_blob_path(sha256):
+    # Объекта по этому имени нет, от него считается только имя превью
+    return f"{blob_path(sha256)}.chunks"
+
+class BlobManager(models.Manager):
+    def store(self, content, sha256, size, name='', refs=1):
+        """
+        Возвращает блоб с данным содержимым, увеличив его счетчик ссылок на refs.
+        content записывается в хранилище, только если такого содержимого еще нет,
+        и сжимается, если включено STORAGE_COMPRESSION и содержимое сжимаемо
+        (name - исходное имя файла, по нему уточняется тип).
+        """
+        plain = self.filter(sha256=sha256, chunk_count=0)
+        with transaction.atomic():
+            if plain.update(ref_count=F('ref_count') + refs):
+                return plain.get()
+
+        encoding = compression.choose_encoding(content, name, size)
+        stored, stored_size = compression.compress(content, encoding) if encoding else (content, size)
+
+        # Если файл с таким именем еще не удален после освобождения блоба,
+        # хранилище выдаст свободное имя, поэтому сохраняем фактическое
+        try:
+            name = default_storage.save(blob_path(sha256), stored)
+        finally:
+            if encoding:
+                stored.close()
+        try:
+            with transaction.atomic():
+                return self.create(
+                    sha256=sha256, size=size, storage_name=name, ref_count=refs,
+                    encoding=encoding, stored_size=stored_size
+                )
+        except IntegrityError:
+            # Параллельная загрузка того же содержимого успела создать блоб
+            default_storage.delete(name)
+            with transaction.atomic():
+                plain.update(ref_count=F('ref_count') + refs)
+                return plain.get()
+
+    def store_chunked(self, sha256, chunks):
+        """
+        Возвращает блоб, собранный из блобов chunks (по порядку содержимого),
+        увеличив его счетчик ссылок. sha256 - хэш списка частей, см.
+        storage.delta. Новый блоб берет ссылку на каждое вхождение части.
+        Хэши блобов из частей и обычных блобов не пересекаются: содержимое,
+        совпавшее с текстом списка частей, не подменит файл из частей.
+        """
+        chunked = self.filter(sha256=sha256, chunk_count__gt=0)
+        with transaction.atomic():
+            if chunked.update(ref_count=F('ref_count') + 1):
+                return chunked.get()
+            try:
+                with transaction.atomic():
+                    # Своего объекта в хранилище у блоба нет, storage_name нужен
+                    # для имени превью, stored_size - сколько занимают части
+                    blob = self.create(
+                        sha256=sha256, size=sum(chunk.size for chunk in chunks),
+                        stored_size=sum(chunk.stored_size for chunk in chunks),
+                        storage_name=chunked_blob_path(sha256), ref_count=1, chunk_count=len(chunks)
+                    )
+            except IntegrityError:
+                chunked.update(ref_count=F('ref_count') + 1)
+                return chunked.get()
+
+            BlobChunk.objects.bulk_create([
+                BlobChunk(blob=blob, index=index, chunk=chunk) for index, chunk in enumerate(chunks)
+            ])
+            self.retain_many(Counter(chunk.pk for chunk in chunks))
+            return blob
+
+    def release(self, blob_id, count=1):
+        """
+        Уменьшает счетчик ссылок. Блоб без ссылок и его содержимое удаляет
+        сборщик мусора (manage.py collect_garbage), а не запрос на удаление.
+        """
+        self.filter(pk=blob_id).update(ref_count=F('ref_count') - count)
+
+    def _add_refs(self, counts, sign):
+        by_count = {}
+        for blob_id, count in counts.items():
+            by_count.setdefault(count, []).append(blob_id)
+        for count, blob_ids in by_count.items():
+            self.filter(pk__in=blob_ids).update(ref_count=F('ref_count') + sign * count)
+
+    def retain_many(self, counts):
+        """Добавляет ссылки {blob_id: число}, одним UPDATE на каждое различное число."""
+        self._add_refs(counts, 1)
+
+    def release_many(self, counts):
+        """Освобождает ссылки {blob_id: число}, одним UPDATE на каждое различное число."""
+        self._add_refs(counts, -1)
+
+class Blob(models.Model):
+    # Уникален среди обычных блобов и отдельно среди блобов из частей
+    sha256 = models.CharField(max_length=64, db_index=True)
+    # Исходный размер и размер в хранилище, они различаются у сжатых блобов
+    size = models.BigIntegerField()
+    stored_size = models.BigIntegerField()
+    # '', gzip или zstd, см. storage.compression
+    encoding = models.CharField(max_length=8, blank=True, default='')
+    storage_name = models.CharField(max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Превью строится один раз на содержимое, см. storage.previews
+    preview_status = models.CharField(max_length=16, blank=True, default='')
+    preview_updated_at = models.DateTimeField(null=True, blank=True)
+    # Больше 0 - содержимое склеивается из частей BlobChunk (загрузка дельтой,
+    # см. storage.delta), 0 - лежит в хранилище одним объектом storage_name
+    chunk_count = models.PositiveIntegerField(default=0)
+
+    objects = BlobManager()
+
+    class Meta:
+        verbose_name = 'Блоб'
+        verbose_name_plural = 'Блобы'
+        constraints = [
+            models.UniqueConstraint(fields=['sha256'], condition=Q(chunk_count=0), name='unique_plain_blob_sha256'),
+            models.UniqueConstraint(fields=['sha256'], condition=Q(chunk_count__gt=0), name='unique_chunked_blob_sha256'),
+        ]
+
+    def chunk_parts(self):
+        """Части блоба по порядку: [(sha256, размер, storage_name, encoding)]."""
+        return list(
+            self.chunks.order_by('index')
+            .values_list('chunk__sha256', 'chunk__size', 'chunk__storage_name', 'chunk__encoding')
+        )
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count})"
+
+class BlobChunk(models.Model):
+    """Часть содержимого блоба, собранного из частей. Часть - тоже блоб."""
+
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    chunk = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='chunk_of')
+
+    class Meta:
+        verbose_name = 'Часть блоба'
+        verbose_name_plural = 'Части блобов'
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'index'], name='unique_blob_chunk_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_id}[{self.index}]: {self.chunk_id}"
+
+class FolderManager(models.Manager):
+    def adjust(self, deltas):
+        """
+        Прибавляет {folder_id: (байт, файлов)} к размерам папок и всех их
+        предков: один SELECT путей и по UPDATE на каждое различное приращение.
+        Отрицательные значения - удаление файлов.
+        """
+        deltas = {folder_id: delta for folder_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        totals = defaultdict(lambda: [0, 0])
+        for folder_id, path in self.filter(pk__in=deltas).values_list('id', 'path'):
+            size, count = deltas[folder_id]
+            for ancestor_id in Folder.path_ids(path):
+                totals[ancestor_id][0] += size
+                totals[ancestor_id][1] += count
+
+        by_delta = defaultdict(list)
+        for folder_id, (size, count) in totals.items():
+            by_delta[size, count].append(folder_id)
+        for (size, count), folder_ids in by_delta.items():
+            self.filter(pk__in=folder_ids).update(
+                size=F('size') + size, file_count=F('file_count') + count
+            )
+
+class Folder(models.Model):
+    """
+    Папка пользователя. path - цепочка id от корня до самой папки ('/1/5/9/'):
+    поддерево выбирается по префиксу пути одним индексным диапазоном,
+    переименование меняет одну строку, перенос поддерева - один UPDATE
+    путей, см. storage.folders.
+    """
+
+    # Предел длины пути ограничивает вложенность (около 50 уровней при 19-значных id)
+    PATH_MAX_LENGTH = 1024
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='children', null=True, blank=True)
+    name = models.CharField(max_length=255)
+    path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True)
+    # Сумма по всем файлам поддерева, обновляется при загрузке, удалении и переносе
+    size = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FolderManager()
+
+    class Meta:
+        verbose_name = 'Папка'
+        verbose_name_plural = 'Папки'
+        ordering = ['name', 'id']
+        indexes = [
+            # Выборка поддерева по префиксу пути (LIKE 'prefix%' на PostgreSQL)
+            models.Index(fields=['path'], name='folder_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
+        constraints = [
+            # Индексы ограничений служат и для списка содержимого папки по имени
+            models.UniqueConstraint(fields=['parent', 'name'], name='unique_folder_name_per_parent'),
+            models.UniqueConstraint(
+                fields=['owner', 'name'], condition=models.Q(parent__isnull=True),
+                name='unique_root_folder_name_per_owner'
+            ),
+        ]
+
+    @staticmethod
+    def path_ids(path):
+        """id папок пути от корня до самой папки."""
+        return [int(part) for part in path.strip('/').split('/') if part]
+
+    def __str__(self):
+        return f"{self.name} ({self.owner_id}, {self.path})"
+
 class File(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
     original_name = models.CharField(max_length=255)
@@ -15,19 +246,41 @@ class File(models.Model):
     size = models.BigIntegerField()
     upload_date = models.DateTimeField(auto_now_add=True)
     last_download = models.DateTimeField(null=True, blank=True)
+    # Обновляется пачками, см. storage.download_stats
+    download_count = models.PositiveIntegerField(default=0)
     comment = models.TextField(blank=True)
-    share_link = models.UUIDField(default=uuid.uuid4, unique=True)
     file = models.FileField(upload_to=user_directory_path)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='files', null=True, blank=True)
+    # None - корень хранилища пользователя
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='files', null=True, blank=True)
+    # Заполняются фоновой проверкой после загрузки, см. storage.jobs
+    sha256 = models.CharField(max_length=64, blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    verified_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         verbose_name = 'Файл'
         verbose_name_plural = 'Файлы'
         ordering = ['-upload_date']
+        indexes = [
+            # Под пагинацию списка файлов пользователя по (-upload_date, id)
+            models.Index(fields=['owner', '-upload_date', 'id'], name='file_owner_upload_date_idx'),
+            # Под список одной папки (или корня, folder IS NULL) в том же порядке
+            models.Index(fields=['owner', 'folder', '-upload_date', 'id'], name='file_owner_folder_idx'),
+            # Под сортировку списка, см. storage.filters; поиск по имени и комментарию
+            # на PostgreSQL идет по GIN-индексам из миграции 0010
+            models.Index(fields=['owner', 'size', 'id'], name='file_owner_size_idx'),
+            models.Index(fields=['owner', 'download_count', 'id'], name='file_owner_downloads_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['owner', 'storage_path'],
                 name='unique_original_name_per_user'
-            )
+            ),
+            models.UniqueConstraint(
+                fields=['owner', 'original_name'],
+                name='unique_file_name_per_owner'
+            ),
         ]
 
     def save(self, *args, **kwargs):
@@ -38,7 +291,363 @@ class File(models.Model):
     def __str__(self):
         return f"{self.original_name} ({self.owner.username})"
 
+class ShareLink(models.Model):
+    """
+    Публичная ссылка на файл /api/files/share/<token>/. Срок, предел
+    скачиваний, пароль и отзыв проверяет storage.sharing.
+    """
+
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='share_links')
+    token = models.UUIDField(default=uuid.uuid4, unique=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # None - без ограничения. Скачивания по ссылке считаются только при заданном
+    # пределе: проверка и увеличение счетчика - один условный UPDATE
+    max_downloads = models.PositiveIntegerField(null=True, blank=True)
+    download_count = models.PositiveIntegerField(default=0)
+    # Хэш пароля (django.contrib.auth.hashers), пусто - без пароля
+    password = models.CharField(max_length=128, blank=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Публичная ссылка'
+        verbose_name_plural = 'Публичные ссылки'
+        ordering = ['-created_at', '-id']
+
+    @property
+    def has_password(self):
+        return bool(self.password)
+
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+    @property
+    def is_active(self):
+        exhausted = self.max_downloads is not None and self.download_count >= self.max_downloads
+        return self.revoked_at is None and not self.is_expired() and not exhausted
+
+    def __str__(self):
+        return f"{self.token} ({self.file_id})"
+
+class FileNameCounter(models.Model):
+    # Последний выданный номер для имен вида base_N.ext, см. storage.naming
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_name_counters')
+    name = models.CharField(max_length=255)
+    last_suffix = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик имен файлов'
+        verbose_name_plural = 'Счетчики имен файлов'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'name'], name='unique_file_name_counter')
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.owner_id}): {self.last_suffix}"
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    original_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Сессия загрузки'
+        verbose_name_plural = 'Сессии загрузки'
+        ordering = ['-created_at']
+
+    @property
+    def total_chunks(self):
+        return max(1, math.ceil(self.size / self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def __str__(self):
+        return f"{self.original_name} ({self.owner.username}, {self.id})"
+
+class DeltaUpload(models.Model):
+    """
+    Загрузка файла дельтой: клиент присылает список частей файла и только
+    те части, которых у него на сервере еще нет, см. storage.delta.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='delta_uploads')
+    original_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    comment = models.TextField(blank=True)
+    # [[sha256, размер], ...] в порядке содержимого файла
+    manifest = models.JSONField()
+    # Части, присланные в эту загрузку: до завершения или отмены загрузка
+    # держит на каждую ссылку, чтобы их не забрал сборщик мусора
+    received = models.ManyToManyField(Blob, related_name='delta_uploads', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Загрузка дельтой'
+        verbose_name_plural = 'Загрузки дельтой'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.original_name} ({self.owner_id}, {self.id})"
+
+class Job(models.Model):
+    """Фоновая задача в очереди на БД, выполняется manage.py run_jobs."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=32)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            # Выборка следующих задач воркером
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+class StorageUsageManager(models.Manager):
+    def add(self, user_id, size, count=1):
+        if self.filter(user_id=user_id).update(
+            bytes_used=F('bytes_used') + size, file_count=F('file_count') + count
+        ):
+            return
+        try:
+            with transaction.atomic():
+                self.create(user_id=user_id, bytes_used=size, file_count=count)
+        except IntegrityError:
+            # Запись успели создать параллельно
+            self.filter(user_id=user_id).update(
+                bytes_used=F('bytes_used') + size, file_count=F('file_count') + count
+            )
+
+    def remove(self, user_id, size, count=1):
+        # Запись не создается заново: при каскадном удалении пользователя ее уже нет
+        self.filter(user_id=user_id).update(
+            bytes_used=F('bytes_used') - size, file_count=F('file_count') - count
+        )
+
+    def fits_quota(self, user_id, size, lock=False):
+        """
+        Помещается ли еще size байт в квоту пользователя. С lock=True строка
+        блокируется до конца транзакции, чтобы параллельные загрузки одного
+        пользователя не превысили квоту вместе.
+        """
+        queryset = self.select_for_update() if lock else self
+        usage = queryset.filter(user_id=user_id).first()
+        if usage is None:
+            usage = StorageUsage(user_id=user_id)
+        return usage.fits(size)
+
+class StorageUsage(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    # None - квота по умолчанию из STORAGE_DEFAULT_QUOTA
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
+
+    objects = StorageUsageManager()
+
+    class Meta:
+        verbose_name = 'Использование хранилища'
+        verbose_name_plural = 'Использование хранилища'
+
+    @property
+    def quota(self):
+        if self.quota_bytes is not None:
+            return self.quota_bytes
+        return settings.STORAGE_DEFAULT_QUOTA
+
+    def fits(self, size):
+        return self.quota is None or self.bytes_used + size <= self.quota
+
+    def __str__(self):
+        return f"{self.user_id}: {self.bytes_used} байт, {self.file_count} файлов"
+
+class ChangeFeedManager(models.Manager):
+    def allocate(self, user_id, count):
+        """
+        Резервирует count номеров событий пользователя, возвращает первый.
+        Строка остается заблокированной до конца транзакции.
+        """
+        if not self.filter(user_id=user_id).update(last_seq=F('last_seq') + count):
+            try:
+                with transaction.atomic():
+                    self.create(user_id=user_id, last_seq=count)
+                return 1
+            except IntegrityError:
+                # Запись успели создать параллельно
+                self.filter(user_id=user_id).update(last_seq=F('last_seq') + count)
+        return self.filter(user_id=user_id).values_list('last_seq', flat=True).get() - count + 1
+
+class ChangeFeed(models.Model):
+    """Номера событий FileEvent пользователя, см. storage.changes."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='change_feed')
+    last_seq = models.BigIntegerField(default=0)
+    # Номер последнего события, удаленного по сроку хранения: курсор меньше
+    # него мог пропустить удаление, клиенту нужна полная синхронизация
+    pruned_seq = models.BigIntegerField(default=0)
+
+    objects = ChangeFeedManager()
+
+    class Meta:
+        verbose_name = 'Лента изменений'
+        verbose_name_plural = 'Ленты изменений'
+
+    def __str__(self):
+        return f"{self.user_id}: {self.last_seq}"
+
+class FileEventManager(models.Manager):
+    def record(self, owner_id, events):
+        """
+        Добавляет события владельца [(file_id, kind, data)] одним запросом.
+        Номер выдается под блокировкой строки ChangeFeed, поэтому события
+        одного пользователя фиксируются в порядке номеров: читатель не
+        пропустит событие с номером меньше уже прочитанного курсора.
+        """
+        if not events:
+            return []
+        with transaction.atomic():
+            first = ChangeFeed.objects.allocate(owner_id, len(events))
+            return self.bulk_create([
+                FileEvent(owner_id=owner_id, seq=first + offset, file_id=file_id, kind=kind, data=data)
+                for offset, (file_id, kind, data) in enumerate(events)
+            ])
+
+class FileEvent(models.Model):
+    """
+    Запись журнала изменений файлов пользователя. Ссылки на файл нет:
+    событие удаления переживает сам файл.
+    """
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    KIND_CHOICES = [
+        (CREATED, 'Создан'),
+        (UPDATED, 'Изменен'),
+        (DELETED, 'Удален'),
+    ]
+
+    # Отдельный индекс по owner не нужен, его заменяет unique_file_event_seq
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_events', db_index=False)
+    # Курсор ленты: растет на единицу с каждым событием пользователя
+    seq = models.BigIntegerField()
+    file_id = models.BigIntegerField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    # Состояние файла после события, см. snapshot
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = FileEventManager()
+
+    class Meta:
+        verbose_name = 'Событие файла'
+        verbose_name_plural = 'События файлов'
+        ordering = ['owner', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'seq'], name='unique_file_event_seq'),
+        ]
+        indexes = [
+            # Под сжатие журнала: последнее событие каждого файла
+            models.Index(fields=['owner', 'file_id', 'seq'], name='file_event_file_idx'),
+            models.Index(fields=['created_at'], name='file_event_created_idx'),
+        ]
+
+    @staticmethod
+    def snapshot(file_obj):
+        return {
+            'original_name': file_obj.original_name,
+            'size': file_obj.size,
+            'folder': file_obj.folder_id,
+            'comment': file_obj.comment,
+        }
+
+    def __str__(self):
+        return f"{self.owner_id}#{self.seq}: {self.kind} {self.file_id}"
+
+# Пока идет migrate, таблицы StorageUsage может еще не быть: пользователей,
+# созданных миграциями (0002_create_superuser), учитывает миграция 0006
+_migrating = False
+
+@receiver(pre_migrate)
+def start_migrating(sender, **kwargs):
+    global _migrating
+    _migrating = True
+
+@receiver(post_migrate)
+def finish_migrating(sender, **kwargs):
+    global _migrating
+    _migrating = False
+
+@receiver(post_save, sender=User)
+def create_storage_usage(sender, instance, created, **kwargs):
+    if created and not _migrating:
+        StorageUsage.objects.get_or_create(user=instance)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Смена прав (set_admin), блокировка или удаление должны сразу
+    # действовать на запросы с уже выданными токенами
+    cache.invalidate_user(instance.pk)
+
+@receiver(post_save, sender=File)
+def count_added_file(sender, instance, created, **kwargs):
+    if created:
+        StorageUsage.objects.add(instance.owner_id, instance.size)
+        if instance.folder_id:
+            Folder.objects.adjust({instance.folder_id: (instance.size, 1)})
+    # Событие пишется последним: строка ChangeFeed блокируется после
+    # StorageUsage, как и при удалении, иначе возможна взаимная блокировка
+    kind = FileEvent.CREATED if created else FileEvent.UPDATED
+    FileEvent.objects.record(instance.owner_id, [(instance.pk, kind, FileEvent.snapshot(instance))])
+
 @receiver(post_delete, sender=File)
 def delete_file(sender, instance, **kwargs):
-    if instance.file:
-        instance.file.delete(save=False)
+    StorageUsage.objects.remove(instance.owner_id, instance.size)
+    if instance.folder_id:
+        Folder.objects.adjust({instance.folder_id: (-instance.size, -1)})
+
+    # Содержимое в запросе не удаляется: блоб без ссылок и файлы старого
+    # формата без записи в БД убирает manage.py collect_garbage
+    if instance.blob_id:
+        Blob.objects.release(instance.blob_id)
+
+    # При удалении пользователя его лента удаляется вместе с ним
+    if not isinstance(kwargs.get('origin'), User):
+        FileEvent.objects.record(
+            instance.owner_id, [(instance.pk, FileEvent.DELETED, {'original_name': instance.original_name})]
+        )
+
+@receiver(post_delete, sender=ShareLink)
+def invalidate_deleted_share_link(sender, instance, **kwargs):
+    cache.invalidate_share_link(instance.token)
@@ -0,0 +1,117 @@
+import os
+import re
+import uuid
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+
+from .models import File, FileNameCounter
+
+
+# Признаки нарушения уникальности (owner, original_name) в тексте ошибки
+# PostgreSQL (имя ограничения) и SQLite (список колонок)
+NAME_CONFLICT_MARKERS = ('unique_file_name_per_owner', 'storage_file.original_name')
+MAX_SAVE_ATTEMPTS = 10
+
+
+class NameAllocationFailed(IntegrityError):
+    """Свободное имя не нашлось за MAX_SAVE_ATTEMPTS попыток."""
+
+
+def new_storage_path(owner_id, original_name):
+    ext = os.path.splitext(original_name)[1]
+    return f"user_{owner_id}/{uuid.uuid4().hex}{ext}"
+
+
+def is_name_conflict(error):
+    message = str(error)
+    return any(marker in message for marker in NAME_CONFLICT_MARKERS)
+
+
+def _max_existing_suffix(owner_id, base_name, ext):
+    # Выполняется один раз при создании счетчика, чтобы не перебирать
+    # номера, занятые до его появления
+    pattern = rf'^{re.escape(base_name)}_([0-9]+){re.escape(ext)}$'
+    names = File.objects.filter(owner_id=owner_id, original_name__regex=pattern).values_list('original_name', flat=True)
+    suffixes = [int(re.match(pattern, name).group(1)) for name in names]
+    return max(suffixes, default=0)
+
+
+def _reserve_names(owner_id, requested_name, count):
+    """
+    count следующих имен вида base_N.ext для requested_name по счетчику
+    (владелец, имя). Число запросов не зависит ни от того, сколько копий
+    файла уже загружено, ни от count.
+    """
+    base_name, ext = os.path.splitext(requested_name)
+    counters = FileNameCounter.objects.select_for_update()
+
+    with transaction.atomic():
+        counter = counters.filter(owner_id=owner_id, name=requested_name).first()
+        if counter is None:
+            try:
+                with transaction.atomic():
+                    counter = FileNameCounter.objects.create(
+                        owner_id=owner_id,
+                        name=requested_name,
+                        last_suffix=_max_existing_suffix(owner_id, base_name, ext)
+                    )
+            except IntegrityError:
+                counter = counters.get(owner_id=owner_id, name=requested_name)
+
+        first = counter.last_suffix + 1
+        counter.last_suffix += count
+        counter.save(update_fields=['last_suffix'])
+
+    return [f'{base_name}_{suffix}{ext}' for suffix in range(first, counter.last_suffix + 1)]
+
+
+def next_free_name(owner_id, requested_name):
+    """Следующее имя вида base_N.ext для requested_name, см. _reserve_names."""
+    return _reserve_names(owner_id, requested_name, 1)[0]
+
+
+def allocate_names(owner_id, requested_names):
+    """
+    Имена для пакета файлов за один проход: занятые имена выбираются одним
+    запросом, номера для повторов (и среди уже загруженных, и внутри пакета)
+    берутся из счетчика одним обращением на каждое повторяющееся имя.
+    Имя base_N.ext, загруженное мимо счетчика, может совпасть с выданным -
+    такой конфликт ловит индекс (owner, original_name) при вставке.
+    """
+    taken = set(
+        File.objects.filter(owner_id=owner_id, original_name__in=set(requested_names))
+        .values_list('original_name', flat=True)
+    )
+    names = []
+    repeats = defaultdict(list)
+    for index, name in enumerate(requested_names):
+        if name in taken:
+            repeats[name].append(index)
+        else:
+            taken.add(name)
+        names.append(name)
+
+    for name, indexes in repeats.items():
+        for index, free_name in zip(indexes, _reserve_names(owner_id, name, len(indexes))):
+            names[index] = free_name
+    return names
+
+
+def save_with_unique_name(file_instance):
+    """
+    Сохраняет новый файл, при занятом имени подбирая следующее свободное.
+    Уникальность гарантирует индекс (owner, original_name), поэтому
+    гонка параллельных загрузок заканчивается повторной попыткой, а не дублем.
+    """
+    requested_name = file_instance.original_name
+    for _ in range(MAX_SAVE_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                file_instance.save()
+            return file_instance
+        except IntegrityError as e:
+            if not is_name_conflict(e):
+                raise
+            file_instance.original_name = next_free_name(file_instance.owner_id, requested_name)
+    raise NameAllocationFailed(f'Не удалось подобрать свободное имя для {requested_name}')
@@ -0,0 +1,124 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .filters import DEFAULT_ORDERING, file_ordering
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу (keyset): курсор хранит значения полей сортировки
+    последней строки страницы, следующая страница выбирается условием
+    "строго после курсора" по составному индексу, без OFFSET.
+
+    Списки всегда отдаются страницами по page_size (по умолчанию 100)
+    строк: {"next": ссылка на следующую страницу или null, "results": [...]}.
+    """
+    ordering = ('-id',)
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_ordering(self, request, view):
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        self.request = request
+        self.model = queryset.model
+        self.ordering = self.get_ordering(request, view)
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last_row = rows[-1] if rows else None
+        return rows
+
+    def _fields(self):
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    def _after(self, values):
+        # (a, b) после (va, vb) <=> a > va OR (a = va AND b > vb), с учетом направления
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self._fields(), values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, row):
+        values = []
+        for name, _ in self._fields():
+            value = getattr(row, name)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        raw = json.dumps(values, ensure_ascii=False).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+            fields = self._fields()
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [
+                self.model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            raise NotFound('Некорректный курсор')
+
+    def get_next_link(self):
+        if not self.has_next or self.last_row is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_row))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class FileKeysetPagination(KeysetPagination):
+    ordering = DEFAULT_ORDERING
+
+    def get_ordering(self, request, view):
+        return file_ordering(request.query_params)
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering = ('id',)
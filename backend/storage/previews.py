@@ -0,0 +1,217 @@
+"""
+Превью файлов: уменьшенные копии изображений и первая страница PDF.
+
+После загрузки файл ставится в очередь пула процессов, ответ на загрузку
+генерации не ждет. Превью строится один раз на блоб (одинаковое содержимое
+разных файлов - одно превью) и хранится рядом с ним: <имя блоба>.preview.jpg.
+Состояние хранится в Blob.preview_status. Процесс-исполнитель сам пишет
+результат в БД, поэтому превью не теряется при перезапуске веб-воркера;
+зависшие в pending блобы ставятся в очередь заново при запросе превью.
+"""
+import io
+import logging
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import compression
+from .chunking import ChunkedFile
+from .models import Blob
+
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.preview.jpg'
+CONTENT_TYPE = 'image/jpeg'
+JPEG_QUALITY = 80
+PDF_TIMEOUT = 30
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+UNSUPPORTED = 'unsupported'
+
+# Показывается, пока превью строится
+PLACEHOLDER = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64" viewBox="0 0 64 64">'
+    b'<rect width="64" height="64" rx="6" fill="#e5e7eb"/>'
+    b'<circle cx="32" cy="32" r="10" fill="none" stroke="#9ca3af" stroke-width="4"/>'
+    b'</svg>'
+)
+PLACEHOLDER_CONTENT_TYPE = 'image/svg+xml'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def preview_name(storage_name):
+    return f'{storage_name}{SUFFIX}'
+
+
+def preview_kind(original_name):
+    """'image', 'pdf' или None, если превью для такого файла не строится."""
+    content_type, _ = mimetypes.guess_type(original_name)
+    if not content_type:
+        return None
+    if content_type.startswith('image/') and content_type != 'image/svg+xml':
+        return 'image'
+    if content_type == 'application/pdf' and shutil.which('pdftoppm'):
+        return 'pdf'
+    return None
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PREVIEW_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                # Процессы запускаются через spawn и настраивают Django заново
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _submit(blob, kind):
+    # Процесс пула читает части сам, в БД за ними не ходит
+    parts = blob.chunk_parts() if blob.chunk_count else None
+    args = (blob.pk, blob.storage_name, kind, blob.encoding, blob.size, parts)
+    if not settings.PREVIEW_WORKERS:
+        generate(*args)
+        return
+    try:
+        _get_pool().submit(_generate_in_worker, *args)
+    except BrokenProcessPool:
+        # Процесс пула упал (например, по памяти), пул пересоздается
+        logger.warning('Пул генерации превью перезапущен')
+        _reset_pool()
+        _get_pool().submit(_generate_in_worker, *args)
+
+
+def schedule(file_obj):
+    """
+    Ставит построение превью в очередь после фиксации транзакции. Если для
+    блоба превью уже есть или строится, ничего не делает.
+    """
+    blob = file_obj.blob
+    if blob is None or blob.preview_status:
+        return
+
+    kind = preview_kind(file_obj.original_name)
+    if kind is None or blob.size > settings.PREVIEW_MAX_SOURCE_SIZE:
+        Blob.objects.filter(pk=blob.pk, preview_status='').update(preview_status=UNSUPPORTED)
+        blob.preview_status = UNSUPPORTED
+        return
+
+    # Условный UPDATE - захват: параллельная загрузка того же содержимого
+    # не поставит вторую задачу
+    claimed = Blob.objects.filter(pk=blob.pk, preview_status='').update(
+        preview_status=PENDING, preview_updated_at=timezone.now()
+    )
+    blob.preview_status = PENDING
+    if claimed:
+        transaction.on_commit(lambda: _submit(blob, kind))
+
+
+def retry_stale(file_obj):
+    """Заново ставит в очередь превью, которое слишком долго в pending."""
+    blob = file_obj.blob
+    deadline = timezone.now() - timedelta(seconds=settings.PREVIEW_RETRY_AFTER)
+    if blob.preview_updated_at and blob.preview_updated_at > deadline:
+        return
+    kind = preview_kind(file_obj.original_name)
+    reclaimed = kind and Blob.objects.filter(
+        pk=blob.pk, preview_status=PENDING, preview_updated_at=blob.preview_updated_at
+    ).update(preview_updated_at=timezone.now())
+    if reclaimed:
+        logger.info(f'Повторная постановка превью блоба {blob.pk}')
+        _submit(blob, kind)
+
+
+def _render_image(source, size):
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # Для JPEG декодер сразу уменьшает изображение кратно 1/2..1/8
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+def _render_pdf(source, size):
+    # pdftoppm (poppler-utils) читает только файл на диске
+    os.makedirs(settings.STORAGE_UPLOAD_TEMP_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.STORAGE_UPLOAD_TEMP_DIR) as directory:
+        path = os.path.join(directory, 'source.pdf')
+        with open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        subprocess.run(
+            ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(size),
+             path, os.path.join(directory, 'page')],
+            check=True, capture_output=True, timeout=PDF_TIMEOUT,
+        )
+        with open(os.path.join(directory, 'page.jpg'), 'rb') as page:
+            return _render_image(page, size)
+
+
+RENDERERS = {'image': _render_image, 'pdf': _render_pdf}
+
+
+def generate(blob_id, storage_name, kind, encoding='', size=None, parts=None):
+    """Строит превью блоба (из частей parts, если он собран из частей) и записывает итог в БД."""
+    try:
+        source = ChunkedFile(parts, compression.open_stored) if parts else compression.open_stored(storage_name, encoding, size)
+        with source:
+            data = RENDERERS[kind](source, settings.PREVIEW_SIZE)
+        name = preview_name(storage_name)
+        # Имя превью должно совпадать с именем блоба, старую копию заменяем
+        default_storage.delete(name)
+        default_storage.save(name, ContentFile(data))
+        result = READY
+    except Exception:
+        logger.exception(f'Не удалось построить превью блоба {blob_id}')
+        result = FAILED
+
+    Blob.objects.filter(pk=blob_id).update(preview_status=result, preview_updated_at=timezone.now())
+    return result
+
+
+def _generate_in_worker(*args):
+    # Процесс пула живет долго, соединение с БД проверяется, как между запросами
+    close_old_connections()
+    try:
+        return generate(*args)
+    finally:
+        close_old_connections()
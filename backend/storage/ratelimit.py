@@ -0,0 +1,96 @@
+"""
+Ограничение частоты запросов алгоритмом token bucket.
+
+Корзина ключа вмещает burst жетонов и пополняется на rate жетонов в секунду,
+запрос забирает жетон или получает отказ со временем до следующего жетона.
+Бэкенд задается SHARE_RATE_LIMIT_BACKEND:
+
+    memory  корзины в памяти процесса: ни сети, ни БД, но у каждого воркера
+            свои корзины, и фактический предел умножается на число воркеров
+    cache   корзины в кэше STORAGE_CACHE_ALIAS (Redis при REDIS_URL), общие
+            для всех воркеров; состояние читается и пишется без блокировки,
+            поэтому одновременные запросы могут немного превысить предел
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+
+# Больше ключей в памяти не хранится: самые давние корзины забываются
+MEMORY_MAX_KEYS = 100_000
+
+
+def _take(state, rate, burst, now):
+    """Новое состояние (жетоны, время) и сколько секунд ждать, 0 - запрос разрешен."""
+    tokens, updated = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys=MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state, wait = _take(self._buckets.pop(key, None), rate, burst, now)
+            self._buckets[key] = state
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class CacheBuckets:
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, rate, burst, now=None):
+        # Время стенное: корзину читают разные процессы и узлы
+        now = time.time() if now is None else now
+        cache = caches[self.alias]
+        cache_key = f'storage:ratelimit:{key}'
+        state, wait = _take(cache.get(cache_key), rate, burst, now)
+        # Полная корзина не отличается от отсутствующей, дольше ее хранить незачем
+        cache.set(cache_key, state, math.ceil(burst / rate) + 1)
+        return wait
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def _backend():
+    global _buckets
+    with _buckets_lock:
+        if _buckets is None:
+            if settings.SHARE_RATE_LIMIT_BACKEND == 'memory':
+                _buckets = MemoryBuckets()
+            elif settings.SHARE_RATE_LIMIT_BACKEND == 'cache':
+                _buckets = CacheBuckets(settings.STORAGE_CACHE_ALIAS)
+            else:
+                raise ImproperlyConfigured('SHARE_RATE_LIMIT_BACKEND должно быть memory или cache')
+        return _buckets
+
+
+def take(key, rate, burst):
+    """Забирает жетон из корзины key. Возвращает секунды до следующего жетона, 0 - можно."""
+    if not rate:
+        return 0
+    return _backend().take(key, rate, max(burst, 1))
+
+
+def reset():
+    """Забывает корзины и бэкенд (после смены настроек, в тестах)."""
+    global _buckets
+    with _buckets_lock:
+        _buckets = None
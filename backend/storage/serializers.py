@@ -1,14 +1,51 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import RegexValidator
-from .models import File
+from django.utils import timezone
+from .models import DeltaUpload, File, Folder, Job, ShareLink, UploadSession
+from . import delta, uploads
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля из параметра запроса fields=a,b,c."""
+
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get(self.fields_query_param) if request else None
+        if requested:
+            allowed = {name.strip() for name in requested.split(',')}
+            for name in set(self.fields) - allowed:
+                self.fields.pop(name)
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    is_admin = serializers.BooleanField(source='is_staff', read_only=True)
+    # Счетчики хранятся в StorageUsage и обновляются при создании и удалении файлов
+    total_file_size = serializers.IntegerField(source='storage_usage.bytes_used', read_only=True)
+    files_count = serializers.IntegerField(source='storage_usage.file_count', read_only=True)
+    storage_quota = serializers.IntegerField(source='storage_usage.quota', read_only=True)
+
+    class Meta:
+        model = User
+        fields = [
+            'id', 'username', 'email',
+            'first_name', 'last_name',
+            'is_admin', 'is_staff',
+            'total_file_size', 'files_count', 'storage_quota',
+            'date_joined'
+        ]
+
+
+class OwnerSerializer(serializers.ModelSerializer):
+    # Владелец во вложенном виде, без агрегатов по файлам: их нет у
+    # пользователя, подтянутого через select_related
     is_admin = serializers.BooleanField(source='is_staff', read_only=True)
-    total_file_size = serializers.IntegerField(read_only=True)
-    files_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -16,7 +53,6 @@ class UserSerializer(serializers.ModelSerializer):
             'id', 'username', 'email',
             'first_name', 'last_name',
             'is_admin', 'is_staff',
-            'total_file_size', 'files_count',
             'date_joined'
         ]
 
@@ -51,26 +87,97 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class FileSerializer(serializers.ModelSerializer):
-    owner = UserSerializer(read_only=True)
+class FileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    owner = OwnerSerializer(read_only=True)
+    # Сколько файл занимает в хранилище: меньше size, если блоб сжат
+    stored_size = serializers.SerializerMethodField()
     download_url = serializers.SerializerMethodField()
-    share_url = serializers.SerializerMethodField()
 
     class Meta:
         model = File
-        fields = ['id', 'owner', 'original_name', 'storage_path', 'size',
-                  'upload_date', 'last_download', 'comment', 'share_link',
-                  'download_url', 'share_url']
-        read_only_fields = ['storage_path', 'size', 'upload_date',
-                            'last_download', 'share_link']
+        fields = ['id', 'owner', 'original_name', 'folder', 'storage_path', 'size', 'stored_size',
+                  'upload_date', 'last_download', 'download_count', 'comment',
+                  'sha256', 'content_type', 'verified_at',
+                  'download_url']
+        # Папка меняется через /api/files/<id>/move/, вместе с размерами папок
+        read_only_fields = ['folder', 'storage_path', 'size', 'upload_date',
+                            'last_download', 'download_count',
+                            'sha256', 'content_type', 'verified_at']
+
+    def update(self, instance, validated_data):
+        # Пишутся только принятые поля: полное сохранение строки затерло бы
+        # счетчики скачиваний, которые записывает download_stats
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+    def get_stored_size(self, obj):
+        return obj.blob.stored_size if obj.blob_id else obj.size
 
     def get_download_url(self, obj):
         request = self.context.get('request')
         return request.build_absolute_uri(f'/files/{obj.id}/download/')
 
+
+class ShareLinkSerializer(serializers.ModelSerializer):
+    # Пароль только принимается и хранится хэшем, пустая строка снимает пароль
+    password = serializers.CharField(write_only=True, required=False, allow_blank=True)
+    max_downloads = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    has_password = serializers.BooleanField(read_only=True)
+    is_active = serializers.BooleanField(read_only=True)
+    share_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShareLink
+        fields = ['id', 'file', 'token', 'share_url', 'expires_at', 'max_downloads', 'download_count',
+                  'password', 'has_password', 'is_active', 'revoked_at', 'created_at']
+        read_only_fields = ['token', 'download_count', 'revoked_at', 'created_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and 'file' in self.fields:
+            # Ссылку можно создать только на свой файл, файл ссылки не меняется
+            self.fields['file'].queryset = File.objects.filter(owner=request.user)
+            if self.instance is not None:
+                self.fields['file'].read_only = True
+
+    def validate_expires_at(self, value):
+        if value is not None and value <= timezone.now():
+            raise serializers.ValidationError('Срок действия должен быть в будущем')
+        return value
+
+    def _hash_password(self, validated_data):
+        if 'password' in validated_data:
+            password = validated_data['password']
+            validated_data['password'] = make_password(password) if password else ''
+        return validated_data
+
+    def create(self, validated_data):
+        return super().create(self._hash_password(validated_data))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self._hash_password(validated_data))
+
     def get_share_url(self, obj):
         request = self.context.get('request')
-        return request.build_absolute_uri(f'/share/{obj.share_link}/')
+        return request.build_absolute_uri(f'/share/{obj.token}/')
+
+
+class FolderSerializer(serializers.ModelSerializer):
+    # Размер и число файлов - по всему поддереву папки
+    class Meta:
+        model = Folder
+        fields = ['id', 'name', 'parent', 'path', 'size', 'file_count', 'created_at']
+        read_only_fields = fields
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'file', 'status', 'attempts', 'result', 'error', 'created_at', 'finished_at']
+        read_only_fields = fields
 
 
 class FileUploadSerializer(serializers.ModelSerializer):
@@ -98,3 +205,86 @@ class FileUploadSerializer(serializers.ModelSerializer):
 
         file_instance.save()
         return file_instance
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    comment = serializers.CharField(required=False, allow_blank=True)
+    total_chunks = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'original_name', 'size', 'chunk_size', 'total_chunks',
+                  'received_chunks', 'comment', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError('Размер файла не может быть отрицательным')
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Размер файла превышает {settings.CHUNKED_UPLOAD_MAX_SIZE} байт'
+            )
+        return value
+
+    def validate_chunk_size(self, value):
+        if value > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(
+                f'Размер части не может превышать {settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE} байт'
+            )
+        return value
+
+    def create(self, validated_data):
+        validated_data.setdefault('chunk_size', settings.CHUNKED_UPLOAD_CHUNK_SIZE)
+        return super().create(validated_data)
+
+    def get_received_chunks(self, obj):
+        return uploads.received_chunks(obj)
+
+
+class DeltaChunkSerializer(serializers.Serializer):
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$')
+    size = serializers.IntegerField(min_value=1)
+
+    def validate_size(self, value):
+        if value > settings.DELTA_CHUNK_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Размер части не может превышать {settings.DELTA_CHUNK_MAX_SIZE} байт'
+            )
+        return value
+
+
+class DeltaUploadSerializer(serializers.ModelSerializer):
+    chunks = DeltaChunkSerializer(many=True, write_only=True)
+    comment = serializers.CharField(required=False, allow_blank=True)
+    total_chunks = serializers.SerializerMethodField()
+    # Хэши частей, которые клиент должен прислать
+    missing = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DeltaUpload
+        fields = ['id', 'original_name', 'size', 'comment', 'chunks', 'total_chunks', 'missing', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def validate_size(self, value):
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Размер файла превышает {settings.CHUNKED_UPLOAD_MAX_SIZE} байт'
+            )
+        return value
+
+    def validate(self, attrs):
+        manifest = [[chunk['sha256'], chunk['size']] for chunk in attrs.pop('chunks')]
+        try:
+            delta.validate_manifest(manifest, attrs['size'])
+        except delta.DeltaError as e:
+            raise serializers.ValidationError({'chunks': str(e)})
+        attrs['manifest'] = manifest
+        return attrs
+
+    def get_total_chunks(self, obj):
+        return len(obj.manifest)
+
+    def get_missing(self, obj):
+        return delta.missing(obj)
@@ -0,0 +1,116 @@
+"""
+Доступ к файлам по публичным ссылкам (ShareLink).
+
+Проверки идут от дешевых к дорогим, чтобы поток запросов по утекшей
+ссылке отсекался до обращений к БД и чтения файла:
+
+    1. token bucket на ссылку и на IP клиента (storage.ratelimit) - 429
+    2. ссылка из кэша (storage.cache): нет - 404, отозвана или истекла - 410
+    3. пароль из заголовка X-Share-Password - 401
+    4. у ссылки с пределом скачиваний - условный UPDATE счетчика, 410 при
+       исчерпании; ответ без тела (304, 416) скачивание возвращает
+"""
+import logging
+import math
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.db.models import F
+
+from . import cache, downloads, ratelimit
+from .models import ShareLink
+
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HEADER = 'HTTP_X_SHARE_PASSWORD'
+
+
+class ShareDenied(Exception):
+    def __init__(self, status, error, headers=None, **extra):
+        super().__init__(error)
+        self.status = status
+        self.data = {"error": error, **extra}
+        self.headers = headers or {}
+
+
+def client_ip(request):
+    # За nginx адрес клиента приходит в заголовке (CLIENT_IP_HEADER), иначе все
+    # запросы выглядели бы пришедшими с адреса прокси
+    if settings.CLIENT_IP_HEADER:
+        forwarded = request.META.get(settings.CLIENT_IP_HEADER, '').split(',')[0].strip()
+        if forwarded:
+            return forwarded
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _check_rate(request, token):
+    # Сначала корзина IP: запросы, которым она отказала, не расходуют жетоны
+    # ссылки, иначе один клиент закрыл бы ссылку для всех
+    wait = ratelimit.take(f'ip:{client_ip(request)}', settings.SHARE_IP_RATE, settings.SHARE_IP_BURST)
+    if not wait:
+        wait = ratelimit.take(f'link:{token}', settings.SHARE_LINK_RATE, settings.SHARE_LINK_BURST)
+    if wait:
+        raise ShareDenied(
+            429, "Слишком много запросов по ссылке, попробуйте позже",
+            headers={'Retry-After': str(math.ceil(wait))}
+        )
+
+
+def get_link(token):
+    """Ссылка с файлом и блобом, из кэша. None - ссылки нет."""
+    try:
+        token = uuid.UUID(str(token))
+    except ValueError:
+        return None
+    return cache.get_share_link(
+        token,
+        lambda: ShareLink.objects.select_related('file__blob').filter(token=token).first()
+    )
+
+
+def resolve(request, token, download=False):
+    """
+    Ссылка, по которой разрешен доступ, или ShareDenied с кодом и текстом
+    ответа. С download=True для ссылки с пределом расходуется скачивание.
+    """
+    _check_rate(request, token)
+
+    link = get_link(token)
+    if link is None:
+        raise ShareDenied(404, "Ссылка не найдена")
+    if link.revoked_at is not None:
+        raise ShareDenied(410, "Ссылка отозвана владельцем")
+    if link.is_expired():
+        raise ShareDenied(410, "Срок действия ссылки истек")
+
+    if link.password and not check_password(request.META.get(PASSWORD_HEADER, ''), link.password):
+        logger.warning(f'Неверный пароль к ссылке {link.token} с адреса {client_ip(request)}')
+        raise ShareDenied(401, "Для доступа к файлу нужен пароль", password_required=True)
+
+    if link.max_downloads is not None:
+        if link.download_count >= link.max_downloads:
+            raise ShareDenied(410, "Лимит скачиваний по ссылке исчерпан")
+        # HEAD и докачка с середины файла не расходуют скачивание
+        if download and downloads.from_start(request):
+            # Счетчик в кэшированной ссылке устаревает, предел проверяет сам UPDATE
+            consumed = ShareLink.objects.filter(
+                pk=link.pk, download_count__lt=link.max_downloads
+            ).update(download_count=F('download_count') + 1)
+            if not consumed:
+                cache.invalidate_share_link(link.token)
+                raise ShareDenied(410, "Лимит скачиваний по ссылке исчерпан")
+            link.consumed = True
+    return link
+
+
+def refund(link):
+    """Возвращает скачивание, если ответ оказался без тела файла."""
+    if getattr(link, 'consumed', False):
+        ShareLink.objects.filter(pk=link.pk, download_count__gt=0).update(download_count=F('download_count') - 1)
+
+
+def invalidate_file_links(file_obj):
+    """Сбрасывает кэш всех ссылок файла, например после смены комментария."""
+    cache.invalidate_share_links(file_obj.share_links.values_list('token', flat=True))
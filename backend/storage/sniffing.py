@@ -0,0 +1,84 @@
+"""
+Определение типа содержимого по первым байтам файла.
+
+Сигнатуры проверяются по началу файла, имя файла используется только для
+уточнения: контейнеров на основе zip (docx, odt, epub) и текстовых форматов.
+"""
+import mimetypes
+
+
+# Столько байт с начала файла достаточно для всех сигнатур ниже
+SNIFF_SIZE = 4096
+DEFAULT_TYPE = 'application/octet-stream'
+
+# (смещение, сигнатура, тип)
+SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'PK\x05\x06', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'(\xb5/\xfd', 'application/zstd'),
+    (0, b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (257, b'ustar', 'application/x-tar'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+)
+RIFF_TYPES = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+
+# Форматы-контейнеры, которые по сигнатуре выглядят как zip или OLE
+CONTAINER_PREFIXES = (
+    'application/vnd.openxmlformats-officedocument.',
+    'application/vnd.oasis.opendocument.',
+    'application/vnd.ms-',
+    'application/msword',
+    'application/epub+zip',
+    'application/java-archive',
+)
+TEXT_TYPES = ('application/json', 'application/xml', 'application/javascript', 'application/x-sh')
+
+
+def _looks_like_text(head):
+    if b'\x00' in head:
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Начало файла могло обрезать многобайтовый символ
+        return e.start >= len(head) - 3 and e.reason == 'unexpected end of data'
+    return True
+
+
+def sniff_content_type(head, name=''):
+    """MIME-тип по первым SNIFF_SIZE байтам содержимого и имени файла."""
+    guessed, _ = mimetypes.guess_type(name)
+
+    if head[:4] == b'RIFF' and head[8:12] in RIFF_TYPES:
+        return RIFF_TYPES[head[8:12]]
+
+    for offset, signature, content_type in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            if content_type in ('application/zip', 'application/x-ole-storage'):
+                if guessed and guessed.startswith(CONTAINER_PREFIXES):
+                    return guessed
+                return 'application/zip' if content_type == 'application/zip' else DEFAULT_TYPE
+            return content_type
+
+    if head and _looks_like_text(head):
+        if guessed and (guessed.startswith('text/') or guessed in TEXT_TYPES):
+            return guessed
+        return 'text/plain'
+    return DEFAULT_TYPE
@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import tracemalloc
+import zipfile
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, cache, changes, chunking, compression, delta, deletion, downloads, jobs, metrics, ratelimit
+from .backends import S3Storage
+from .download_stats import DownloadBuffer
+from .models import Blob, DeltaUpload, File, FileEvent, Folder, Job, ShareLink, StorageUsage
+from .naming import NameAllocationFailed, save_with_unique_name
+
+
+# Количество файлов, на котором проверяется, что число запросов не растет
+DATA_SIZES = (1, 10, 50)
+
+
+def create_files(owner, count, start=0):
+    File.objects.bulk_create([
+        File(
+            owner=owner,
+            original_name=f'file_{owner.id}_{i}.txt',
+            storage_path=f'user_{owner.id}/{i}.txt',
+            size=i,
+            file=f'user_{owner.id}/{i}.txt',
+        )
+        for i in range(start, start + count)
+    ])
+
+
+class QueryCountTests(APITestCase):
+    """Эндпоинты списков выполняют фиксированное число запросов к БД."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user('boss', password='pass', is_staff=True)
+        self.user = User.objects.create_user('alice', password='pass')
+
+    def assert_constant_queries(self, client_user, url, expected_queries):
+        self.client.force_authenticate(client_user)
+        created = 0
+        for size in DATA_SIZES:
+            create_files(self.user, size - created, start=created)
+            created = size
+            with self.subTest(url=url, files=size):
+                with self.assertNumQueries(expected_queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_file_list(self):
+        self.assert_constant_queries(self.user, '/api/files/', 1)
+
+    def test_file_list_paginated(self):
+        self.assert_constant_queries(self.user, '/api/files/?page_size=20', 1)
+
+    def test_admin_file_list(self):
+        self.assert_constant_queries(self.admin, f'/api/files/?user_id={self.user.id}', 1)
+
+    def test_user_files(self):
+        # пользователь + его файлы
+        self.assert_constant_queries(self.admin, f'/api/users/{self.user.id}/files/', 2)
+
+    def test_user_list(self):
+        self.assert_constant_queries(self.admin, '/api/users/', 1)
+
+    def test_current_user(self):
+        self.assert_constant_queries(self.user, '/api/auth/me/', 1)
+
+    def test_nested_owner(self):
+        create_files(self.user, 1)
+        self.client.force_authenticate(self.user)
+        owner = self.client.get('/api/files/').data['results'][0]['owner']
+        self.assertEqual(owner['id'], self.user.id)
+        self.assertEqual(owner['username'], 'alice')
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def pages(self, url, **params):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            ids += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_lists_are_paginated_by_default(self):
+        create_files(self.user, 120)
+        response = self.client.get('/api/files/')
+        self.assertEqual(len(response.data['results']), 100)
+        self.assertIsNotNone(response.data['next'])
+
+        self.client.force_authenticate(User.objects.create_user('boss', password='pass', is_staff=True))
+        self.assertEqual(len(self.client.get(f'/api/users/{self.user.id}/files/').data['results']), 100)
+        self.assertEqual(len(self.client.get('/api/users/').data['results']), User.objects.count())
+
+    def test_ties_are_ordered_by_id(self):
+        create_files(self.user, 7)
+        # Одинаковые дата загрузки и размер: порядок решает id
+        File.objects.update(upload_date=timezone.now(), size=1)
+        expected = sorted(File.objects.values_list('id', flat=True))
+        self.assertEqual(self.pages('/api/files/', page_size=2), expected)
+        self.assertEqual(self.pages('/api/files/', page_size=3, ordering='-size'), expected[::-1])
+
+    def test_cursor_is_stable_under_inserts_and_deletes(self):
+        create_files(self.user, 5)
+        first = self.client.get('/api/files/', {'ordering': 'size', 'page_size': 2}).data
+        seen = [item['id'] for item in first['results']]
+        # Новые строки до курсора и удаленные после не сдвигают следующие страницы
+        create_files(self.user, 1, start=-1)
+        File.objects.filter(size=2).delete()
+        response = self.client.get(first['next'])
+        seen += [item['id'] for item in response.data['results']]
+        self.assertEqual(
+            [File.objects.filter(pk=pk).values_list('size', flat=True).first() for pk in seen],
+            [0, 1, 3, 4]
+        )
+        self.assertEqual(self.client.get('/api/files/', {'cursor': 'garbage'}).status_code, 404)
+
+
+class MediaRootMixin:
+    """Файлы тестов пишутся во временный каталог вместо MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(
+            MEDIA_ROOT=self.media_root,
+            STORAGE_UPLOAD_TEMP_DIR=f'{self.media_root}/.tmp',
+            CHUNKED_UPLOAD_ROOT=f'{self.media_root}/.chunks',
+            DOWNLOAD_STATS_FLUSH_INTERVAL=0,
+        )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload(self, name, content):
+        return self.client.post('/api/files/', {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+
+class ChunkedUploadTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.content = b'0123456789' * 10 + b'tail'
+
+    def start(self):
+        response = self.client.post(
+            '/api/files/uploads/', {'original_name': 'big.bin', 'size': len(self.content), 'chunk_size': 40}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put(self, upload_id, index, data):
+        return self.client.put(
+            f'/api/files/uploads/{upload_id}/chunks/{index}/', data, content_type='application/octet-stream'
+        )
+
+    def test_resume_and_complete(self):
+        session = self.start()
+        self.assertEqual((session['total_chunks'], session['received_chunks']), (3, []))
+
+        self.assertEqual(self.put(session['id'], 2, self.content[80:]).status_code, 200)
+        self.assertEqual(self.put(session['id'], 0, b'short').status_code, 400)
+        self.assertEqual(self.put(session['id'], 3, b'x').status_code, 400)
+        response = self.client.post(f"/api/files/uploads/{session['id']}/complete/")
+        self.assertEqual((response.status_code, response.data['missing_chunks']), (400, [0, 1]))
+
+        # После обрыва клиент узнает, какие части уже на сервере
+        self.put(session['id'], 0, self.content[:40])
+        status = self.client.get(f"/api/files/uploads/{session['id']}/").data
+        self.assertEqual(status['received_chunks'], [0, 2])
+        self.put(session['id'], 1, self.content[40:80])
+
+        response = self.client.post(f"/api/files/uploads/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 201)
+        download = self.client.get(f"/api/files/{response.data['id']}/download/")
+        self.assertEqual(b''.join(download.streaming_content), self.content)
+        self.assertEqual(self.client.get(f"/api/files/uploads/{session['id']}/").status_code, 404)
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_ROOT), [])
+
+    def test_abort_and_unknown_ids(self):
+        session = self.start()
+        self.put(session['id'], 0, self.content[:40])
+        self.assertEqual(self.client.delete(f"/api/files/uploads/{session['id']}/").status_code, 204)
+        self.assertFalse(os.path.exists(os.path.join(settings.CHUNKED_UPLOAD_ROOT, session['id'])))
+
+        for upload_id in (session['id'], 'notauuid'):
+            with self.subTest(upload_id=upload_id):
+                self.assertEqual(self.client.get(f'/api/files/uploads/{upload_id}/').status_code, 404)
+                self.assertEqual(self.put(upload_id, 0, b'x').status_code, 404)
+                self.assertEqual(self.client.post(f'/api/files/uploads/{upload_id}/complete/').status_code, 404)
+                self.assertEqual(self.client.delete(f'/api/files/uploads/{upload_id}/').status_code, 404)
+
+    def test_deleting_user_removes_staged_chunks(self):
+        session = self.start()
+        self.put(session['id'], 0, self.content[:40])
+        self.client.force_authenticate(User.objects.create_superuser('root', password='pass'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/users/{self.user.id}/').status_code, 204)
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_ROOT), [])
+
+
+class FileDeliveryTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    @override_settings(FILE_DELIVERY='nginx')
+    def test_nginx_serves_bytes_after_permission_check(self):
+        uploaded = self.upload('отчет.bin', b'content').data
+        response = self.client.get(f"/api/files/{uploaded['id']}/download/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        blob = Blob.objects.get(files=uploaded['id'])
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{blob.storage_name}')
+        self.assertIn("filename*=utf-8''%D0%BE%D1%82%D1%87%D0%B5%D1%82.bin", response['Content-Disposition'])
+
+        stranger = User.objects.create_user('bob', password='pass')
+        self.client.force_authenticate(stranger)
+        response = self.client.get(f"/api/files/{uploaded['id']}/download/")
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_django_delivery_streams_file(self):
+        uploaded = self.upload('a.bin', b'content').data
+        response = self.client.get(f"/api/files/{uploaded['id']}/download/")
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), b'content')
+
+
+class RangeRequestTests(MediaRootMixin, APITestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/files/{self.upload('data.bin', self.content).data['id']}/download/"
+
+    def get(self, **headers):
+        return self.client.get(self.url, headers=headers)
+
+    def test_single_and_suffix_ranges(self):
+        response = self.get(range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.get(range='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+        response = self.get(range=f'bytes={len(self.content)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.content)}'))
+
+    def test_multiple_ranges(self):
+        response = self.get(range='bytes=0-1,100-101')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 100-101/1024\r\n\r\n' + self.content[100:102], body)
+
+    def test_conditional_requests(self):
+        full = self.get()
+        etag = full['ETag']
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=full['Last-Modified']).status_code, 304)
+
+        # Файл изменился с тех пор, как клиент начал докачку: If-Range не совпал, отдается целиком
+        response = self.get(range='bytes=10-19', if_range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(self.get(range='bytes=10-19', if_range=etag).status_code, 206)
+
+
+class BlobStoreTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload('a.bin', b'same content').data
+        self.client.force_authenticate(User.objects.create_user('bob', password='pass'))
+        second = self.upload('b.bin', b'same content').data
+
+        blob = Blob.objects.get()
+        self.assertEqual((blob.sha256, blob.ref_count), (hashlib.sha256(b'same content').hexdigest(), 2))
+        self.assertEqual(os.listdir(os.path.dirname(default_storage.path(blob.storage_name))), [blob.sha256])
+
+        self.client.delete(f"/api/files/{second['id']}/")
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f"/api/files/{first['id']}/download/")
+        self.assertEqual(b''.join(response.streaming_content), b'same content')
+
+    def test_migrate_to_blobstore(self):
+        for i in range(2):
+            name = default_storage.save(f'user_{self.user.id}/{i}.txt', io.BytesIO(b'legacy'))
+            File.objects.create(owner=self.user, original_name=f'{i}.txt', storage_path=name, size=6, file=name)
+
+        call_command('migrate_to_blobstore', stdout=io.StringIO())
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertFalse(File.objects.filter(blob__isnull=True).exists())
+        self.assertFalse(default_storage.exists(f'user_{self.user.id}/0.txt'))
+        with default_storage.open(blob.storage_name) as stored:
+            self.assertEqual(stored.read(), b'legacy')
+
+
+class AsyncDownloadTests(MediaRootMixin, APITestCase):
+    """Асинхронные view для ASGI вызываются напрямую: их маршруты есть только при SERVER_MODE=asgi."""
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.STORAGE_CACHE_ALIAS].clear()
+        ratelimit.reset()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.file_id = self.upload('a.txt', b'async content').data['id']
+        self.share = self.client.post('/api/share_links/', {'file': self.file_id}, format='json').data['token']
+        self.token = self.client.post('/api/auth/login/', {'username': 'alice', 'password': 'pass'}).data['access']
+        self.factory = AsyncRequestFactory()
+
+    async def body(self, response):
+        return b''.join([block async for block in response.streaming_content])
+
+    async def test_download(self):
+        url = f'/api/files/{self.file_id}/download/'
+        response = await async_views.download(self.factory.get(url), self.file_id)
+        self.assertEqual(response.status_code, 401)
+
+        request = self.factory.get(url, headers={'authorization': f'Bearer {self.token}', 'range': 'bytes=6-'})
+        response = await async_views.download(request, self.file_id)
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        self.assertEqual(await self.body(response), b'content')
+
+        response = await async_views.download(self.factory.get(url, headers={'authorization': f'Bearer {self.token}'}), 0)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_shared_download_and_info(self):
+        url = f'/api/files/share/{self.share}/'
+        response = await async_views.download_shared(self.factory.get(url), self.share)
+        self.assertEqual(await self.body(response), b'async content')
+
+        response = await async_views.share_file_info(self.factory.get(f'{url}info/'), self.share)
+        self.assertEqual(json.loads(response.content)['original_name'], 'a.txt')
+
+        missing = '00000000-0000-0000-0000-000000000000'
+        response = await async_views.download_shared(self.factory.get(url), missing)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_failed_shared_download_is_refunded(self):
+        await ShareLink.objects.filter(token=self.share).aupdate(max_downloads=1)
+        await sync_to_async(caches[settings.STORAGE_CACHE_ALIAS].clear)()
+        url = f'/api/files/share/{self.share}/'
+        with mock.patch('storage.async_views.file_response', side_effect=OSError('backend')):
+            with self.assertRaises(OSError):
+                await async_views.download_shared(self.factory.get(url), self.share)
+        link = await ShareLink.objects.aget(token=self.share)
+        self.assertEqual(link.download_count, 0)
+
+        response = await async_views.download_shared(self.factory.get(url), self.share)
+        self.assertEqual(await self.body(response), b'async content')
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3Client:
+    """Бакет в памяти с той частью API boto3, которой пользуется S3Storage."""
+
+    def __init__(self):
+        self.objects = {}
+        self.ranges = []
+
+    def upload_fileobj(self, content, bucket, key, ExtraArgs=None, Config=None):
+        self.objects[key] = content.read()
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key]
+        self.ranges.append(Range)
+        start = int(Range[len('bytes='):-1]) if Range else 0
+        if start >= len(data):
+            raise FakeClientError('InvalidRange')
+        return {'Body': io.BytesIO(data[start:]), 'ContentLength': len(data) - start}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise FakeClientError('404')
+        return {'ContentLength': len(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+class S3StorageTests(APITestCase):
+    def setUp(self):
+        self.storage = S3Storage(bucket_name='bucket', presign_expiration=60)
+        self.storage.client = FakeS3Client()
+        self.storage._boto3 = (None, lambda **options: options, None, FakeClientError)
+
+    def test_save_open_and_seek(self):
+        name = self.storage.save('blobs/ab/cd/abcd', io.BytesIO(b'0123456789'))
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(self.storage.exists('missing'))
+        self.assertEqual(self.storage.size(name), 10)
+
+        with self.storage.open(name) as file:
+            file.seek(6)
+            self.assertEqual(file.read(), b'6789')
+            file.seek(10)
+            self.assertEqual(file.read(), b'')
+        # Чтение с середины - запрос с Range, без скачивания объекта целиком
+        self.assertEqual(self.storage.client.ranges, ['bytes=6-'])
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    @override_settings(FILE_DELIVERY='redirect')
+    def test_redirect_to_presigned_url(self):
+        user = User.objects.create_user('alice', password='pass')
+        blob = Blob.objects.create(sha256='a' * 64, size=3, stored_size=3, storage_name='blobs/aa/aa/' + 'a' * 64)
+        file_obj = File.objects.create(owner=user, original_name='отчет.txt', storage_path='x', size=3,
+                                       blob=blob, file=blob.storage_name)
+        file_obj.file.storage = self.storage
+
+        response = downloads.file_response(RequestFactory().get('/'), file_obj)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], f'https://s3.test/bucket/{blob.storage_name}?expires=60')
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+
+    def test_boto3_is_required(self):
+        with mock.patch.dict(sys.modules, {'boto3': None}):
+            with self.assertRaises(ImproperlyConfigured):
+                S3Storage(bucket_name='bucket').client
+
+
+class StorageUsageTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def usage(self):
+        return StorageUsage.objects.get(user=self.user)
+
+    def test_counters_follow_create_and_delete(self):
+        first = self.upload('a.txt', b'12345').data
+        self.upload('b.txt', b'123')
+        self.assertEqual((self.usage().bytes_used, self.usage().file_count), (8, 2))
+
+        self.client.delete(f"/api/files/{first['id']}/")
+        self.assertEqual((self.usage().bytes_used, self.usage().file_count), (3, 1))
+
+        me = self.client.get('/api/auth/me/').data
+        self.assertEqual((me['total_file_size'], me['files_count']), (3, 1))
+
+    def test_users_created_by_migrations_are_counted(self):
+        # admin создается миграцией 0002 до таблицы счетчиков, его строку заполняет 0006
+        self.assertTrue(StorageUsage.objects.filter(user__username='admin').exists())
+        self.assertEqual(StorageUsage.objects.count(), User.objects.count())
+
+    def test_quota_rejects_upload(self):
+        StorageUsage.objects.filter(user=self.user).update(quota_bytes=4)
+        response = self.upload('big.txt', b'12345')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.upload('ok.txt', b'1234').status_code, 201)
+
+    def test_quota_rejects_large_body_early(self):
+        StorageUsage.objects.filter(user=self.user).update(quota_bytes=1024)
+        response = self.upload('big.bin', b'x' * 200 * 1024)
+        self.assertEqual(response.status_code, 413)
+
+
+class FileNameAllocationTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def test_duplicate_names_get_suffixes(self):
+        names = [self.upload('report.pdf', b'x').data['original_name'] for _ in range(4)]
+        self.assertEqual(names, ['report.pdf', 'report_1.pdf', 'report_2.pdf', 'report_3.pdf'])
+
+    def test_constant_queries_for_next_suffix(self):
+        for i in range(1, 30):
+            File.objects.create(owner=self.user, original_name=f'report_{i}.pdf',
+                                storage_path=f'user_{self.user.id}/r{i}.pdf', size=1, file=f'r{i}.pdf')
+        File.objects.create(owner=self.user, original_name='report.pdf',
+                            storage_path=f'user_{self.user.id}/r.pdf', size=1, file='r.pdf')
+        self.assertEqual(self.upload('report.pdf', b'x').data['original_name'], 'report_30.pdf')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.upload('report.pdf', b'y').data['original_name'], 'report_31.pdf')
+        name_queries = [q for q in queries.captured_queries if 'report' in q['sql']]
+        self.assertLessEqual(len(name_queries), 4)
+
+    def test_rename_to_taken_name_conflicts(self):
+        self.upload('a.txt', b'a')
+        second = self.upload('b.txt', b'b').data['id']
+        response = self.client.patch(f'/api/files/{second}/', {'original_name': 'a.txt'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('error', response.data)
+        self.assertEqual(File.objects.get(pk=second).original_name, 'b.txt')
+
+        response = self.client.patch(f'/api/files/{second}/', {'original_name': 'c.txt'}, format='json')
+        self.assertEqual(response.data['original_name'], 'c.txt')
+
+
+class CacheTests(APITestCase):
+    def setUp(self):
+        caches[settings.STORAGE_CACHE_ALIAS].clear()
+        ratelimit.reset()
+        self.user = User.objects.create_user('alice', password='pass')
+        create_files(self.user, 1)
+        self.file = File.objects.get()
+        self.link = ShareLink.objects.create(file=self.file)
+
+    def test_hot_share_link_skips_database(self):
+        url = f'/api/files/share/{self.link.token}/info/'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['original_name'], self.file.original_name)
+        self.assertGreaterEqual(cache.stats()[cache.SHARE_LINKS]['hits'], 1)
+
+    def test_comment_update_invalidates_share_link(self):
+        url = f'/api/files/share/{self.link.token}/info/'
+        self.client.get(url)
+        self.client.force_authenticate(self.user)
+        self.client.patch(f'/api/files/{self.file.id}/update_comment/', {'comment': 'новый'}, format='json')
+        self.assertEqual(self.client.get(url).data['comment'], 'новый')
+
+    def test_jwt_user_cached_until_changed(self):
+        admin = User.objects.create_user('boss', password='pass', is_staff=True)
+        token = self.client.post('/api/auth/login/', {'username': 'alice', 'password': 'pass'}).data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.client.get('/api/auth/me/')
+        with self.assertNumQueries(1):
+            self.assertFalse(self.client.get('/api/auth/me/').data['is_admin'])
+
+        self.client.force_authenticate(admin)
+        self.client.patch(f'/api/users/{self.user.id}/set_admin/')
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get('/api/users/').status_code, 200)
+
+
+class DownloadStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        create_files(self.user, 3)
+
+    def test_buffer_flushes_in_one_query(self):
+        first, second, untouched = File.objects.order_by('id')
+        buffer = DownloadBuffer()
+        for file in (first, first, second, first):
+            buffer.add(file.id)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(len(buffer), 0)
+
+        counts = dict(File.objects.values_list('id', 'download_count'))
+        self.assertEqual(counts, {first.id: 3, second.id: 1, untouched.id: 0})
+        self.assertIsNotNone(File.objects.get(pk=first.id).last_download)
+        self.assertIsNone(File.objects.get(pk=untouched.id).last_download)
+
+
+class DownloadCountTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.file_id = self.upload('a.bin', b'x' * 100).data['id']
+
+    def count(self):
+        return File.objects.get(pk=self.file_id).download_count
+
+    def test_resumed_download_counts_once(self):
+        url = f'/api/files/{self.file_id}/download/'
+        self.client.get(url).close()
+        self.assertEqual(self.count(), 1)
+        # Загрузка файла диапазонами: засчитывается только первый, с начала файла
+        for range_header in ('bytes=0-49', 'bytes=50-99', 'bytes=90-'):
+            response = self.client.get(url, headers={'range': range_header})
+            response.close()
+            self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.count(), 2)
+        self.client.head(url).close()
+        self.assertEqual(self.count(), 2)
+
+    def test_edits_do_not_overwrite_counters(self):
+        for url, data in ((f'/api/files/{self.file_id}/update_comment/', {'comment': 'новый'}),
+                          (f'/api/files/{self.file_id}/', {'comment': 'еще', 'original_name': 'b.bin'})):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.patch(url, data, format='json').status_code, 200)
+            updates = [query['sql'] for query in queries.captured_queries
+                       if query['sql'].startswith('UPDATE "storage_file"')]
+            self.assertTrue(updates)
+            self.assertFalse(any('download_count' in sql or 'last_download' in sql for sql in updates))
+
+
+class ArchiveTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.ids = [self.upload(name, content).data['id']
+                    for name, content in (('a.txt', b'first'), ('отчет.pdf', b'second' * 1000))]
+
+    def download(self, **params):
+        response = self.client.get('/api/files/archive/', {'ids': ','.join(map(str, self.ids)), **params})
+        self.assertEqual(response.status_code, 200)
+        return io.BytesIO(b''.join(response.streaming_content))
+
+    def test_zip(self):
+        for store in ('0', '1'):
+            with zipfile.ZipFile(self.download(store=store)) as archive:
+                self.assertEqual(archive.namelist(), ['a.txt', 'отчет.pdf'])
+                self.assertEqual(archive.read('отчет.pdf'), b'second' * 1000)
+
+    def test_tar(self):
+        for store in ('0', '1'):
+            with tarfile.open(fileobj=self.download(type='tar', store=store)) as archive:
+                self.assertEqual(archive.getnames(), ['a.txt', 'отчет.pdf'])
+                self.assertEqual(archive.extractfile('a.txt').read(), b'first')
+
+    def test_foreign_files_rejected(self):
+        other = User.objects.create_user('bob', password='pass')
+        create_files(other, 1)
+        foreign = File.objects.get(owner=other).id
+        response = self.client.get('/api/files/archive/', {'ids': f'{self.ids[0]},{foreign}'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['missing'], [foreign])
+
+
+class BulkDeleteTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.ids = [self.upload(f'{i}.txt', b'same').data['id'] for i in range(3)]
+        self.ids.append(self.upload('other.txt', b'other').data['id'])
+
+    def test_bulk_delete_updates_counters_and_refs(self):
+        response = self.client.post('/api/files/bulk_delete/', {'ids': self.ids[1:] + [999]}, format='json')
+        self.assertEqual(response.data, {'deleted': self.ids[1:], 'not_found': [999]})
+        self.assertEqual(list(File.objects.values_list('id', flat=True)), self.ids[:1])
+
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes_used, usage.file_count), (4, 1))
+        self.assertEqual(dict(Blob.objects.values_list('size', 'ref_count')), {4: 1, 5: 0})
+
+    def test_bulk_delete_query_count_and_signals(self):
+        self.client.post('/api/share_links/', {'file': self.ids[0]}, format='json')
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('storage.models.cache.invalidate_share_link') as invalidate, \
+                mock.patch('storage.models.Blob.objects.release') as release:
+            deletion.bulk_delete(File.objects.filter(pk__in=self.ids))
+        deletes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('DELETE')]
+        # По одному DELETE на задачи, ссылки и файлы, без сигналов post_delete
+        self.assertEqual(len(deletes), 3)
+        invalidate.assert_not_called()
+        release.assert_not_called()
+        self.assertFalse(ShareLink.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_collect_garbage(self):
+        self.client.post('/api/files/bulk_delete/', {'ids': self.ids}, format='json')
+        blob_names = list(Blob.objects.values_list('storage_name', flat=True))
+        default_storage.save(f'user_{self.user.id}/orphan.txt', SimpleUploadedFile('orphan.txt', b'x'))
+
+        call_command('collect_garbage', '--sweep-orphans', '--min-age=0', stdout=io.StringIO())
+        self.assertFalse(Blob.objects.exists())
+        for name in blob_names + [f'user_{self.user.id}/orphan.txt']:
+            self.assertFalse(default_storage.exists(name))
+
+
+class FolderTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def folder(self, name, parent=None):
+        return self.client.post('/api/folders/', {'name': name, 'parent': parent}, format='json').data['id']
+
+    def upload_to(self, folder, name, content):
+        return self.client.post(
+            '/api/files/', {'file': SimpleUploadedFile(name, content), 'folder': folder}, format='multipart'
+        ).data['id']
+
+    def sizes(self):
+        return {folder.name: (folder.size, folder.file_count) for folder in Folder.objects.all()}
+
+    def test_sizes_follow_upload_move_and_delete(self):
+        docs = self.folder('docs')
+        work = self.folder('work', docs)
+        archive = self.folder('archive')
+        self.upload_to(docs, 'a.txt', b'12')
+        in_work = self.upload_to(work, 'b.txt', b'1234')
+        self.upload('root.txt', b'root')
+        self.assertEqual(self.sizes(), {'docs': (6, 2), 'work': (4, 1), 'archive': (0, 0)})
+
+        listing = self.client.get(f'/api/files/?folder={docs}')
+        self.assertEqual([item['original_name'] for item in listing.data['results']], ['a.txt'])
+        listing = self.client.get(f'/api/files/?folder={docs}&recursive=1')
+        self.assertEqual(len(listing.data['results']), 2)
+        listing = self.client.get('/api/files/?folder=root')
+        self.assertEqual([item['original_name'] for item in listing.data['results']], ['root.txt'])
+
+        # Перенос поддерева - один UPDATE путей, размеры переходят к новым предкам
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/folders/{work}/', {'parent': archive}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['path'], f'/{archive}/{work}/')
+        self.assertEqual(sum('"path" =' in query['sql'] and query['sql'].startswith('UPDATE')
+                             for query in queries.captured_queries), 1)
+        self.assertEqual(self.sizes(), {'docs': (2, 1), 'work': (4, 1), 'archive': (4, 1)})
+
+        self.client.post(f'/api/files/{in_work}/move/', {'folder': docs}, format='json')
+        self.assertEqual(self.sizes(), {'docs': (6, 2), 'work': (0, 0), 'archive': (0, 0)})
+
+        self.assertEqual(self.client.delete(f'/api/files/{in_work}/?folder={archive}').status_code, 404)
+        self.assertEqual(self.client.delete(f'/api/files/{in_work}/?folder={docs}').status_code, 204)
+        self.assertEqual(self.sizes(), {'docs': (2, 1), 'work': (0, 0), 'archive': (0, 0)})
+
+        self.assertEqual(self.client.delete(f'/api/folders/{docs}/').status_code, 204)
+        self.assertEqual(set(self.sizes()), {'work', 'archive'})
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes_used, usage.file_count), (4, 1))
+
+    def test_invalid_moves_and_names(self):
+        docs = self.folder('docs')
+        work = self.folder('work', docs)
+        response = self.client.patch(f'/api/folders/{docs}/', {'parent': work}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/folders/', {'name': 'docs'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post('/api/folders/', {'name': 'a/b'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.patch(f'/api/folders/{work}/', {'name': 'docs', 'parent': None}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Folder.objects.get(pk=work).name, 'work')
+
+        listing = self.client.get('/api/folders/')
+        self.assertEqual([item['name'] for item in listing.data], ['docs'])
+        listing = self.client.get(f'/api/folders/?parent={docs}')
+        self.assertEqual([item['name'] for item in listing.data], ['work'])
+
+
+class BatchUploadTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def batch(self, files, **fields):
+        uploads = [SimpleUploadedFile(name, content) for name, content in files]
+        return self.client.post('/api/files/batch/', {'files': uploads, **fields}, format='multipart')
+
+    def test_batch_creates_files_in_one_pass(self):
+        self.upload('a.txt', b'old')
+        folder = Folder.objects.create(owner=self.user, name='docs', path='')
+        Folder.objects.filter(pk=folder.pk).update(path=f'/{folder.pk}/')
+
+        response = self.batch(
+            [('a.txt', b'one'), ('a.txt', b'two'), ('b.txt', b'one'), ('c.txt', b'')],
+            folder=folder.pk, comment='пакет'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (4, 0))
+        names = [item['original_name'] for item in response.data['files']]
+        self.assertEqual(names, ['a_1.txt', 'a_2.txt', 'b.txt', 'c.txt'])
+        self.assertTrue(all(item['job_id'] for item in response.data['files']))
+
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes_used, usage.file_count), (12, 5))
+        folder.refresh_from_db()
+        self.assertEqual((folder.size, folder.file_count), (9, 4))
+        self.assertEqual(Blob.objects.get(sha256=hashlib.sha256(b'one').hexdigest()).ref_count, 2)
+        self.assertEqual(Job.objects.count(), 5)
+        self.assertEqual(set(File.objects.filter(folder=folder).values_list('comment', flat=True)), {'пакет'})
+
+    def test_sparse_fields_keep_job_ids(self):
+        uploads = [SimpleUploadedFile('a.txt', b'one'), SimpleUploadedFile('b.txt', b'two')]
+        response = self.client.post('/api/files/batch/?fields=original_name', {'files': uploads}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        jobs_by_name = {job.file.original_name: job.pk for job in Job.objects.select_related('file')}
+        self.assertEqual(response.data['files'], [
+            {'original_name': 'a.txt', 'job_id': jobs_by_name['a.txt']},
+            {'original_name': 'b.txt', 'job_id': jobs_by_name['b.txt']},
+        ])
+
+    def test_failed_files_get_stable_error_codes(self):
+        def save(file_obj):
+            if file_obj.original_name == 'b.txt':
+                raise NameAllocationFailed('UNIQUE constraint failed: storage_file.owner_id, storage_file.original_name')
+            if file_obj.original_name == 'c.txt':
+                raise IntegrityError('FOREIGN KEY constraint failed: storage_file.blob_id')
+            return save_with_unique_name(file_obj)
+
+        # Имя заняли параллельно: пакет сохраняется по одному файлу
+        conflict = IntegrityError('UNIQUE constraint failed: storage_file.owner_id, storage_file.original_name')
+        with mock.patch('storage.batch.File.objects.bulk_create', side_effect=conflict), \
+                mock.patch('storage.batch.save_with_unique_name', side_effect=save):
+            response = self.batch([('a.txt', b'1'), ('b.txt', b'2'), ('c.txt', b'3')])
+
+        self.assertEqual((response.status_code, response.data['created'], response.data['failed']), (201, 1, 2))
+        errors = response.data['files'][1:]
+        self.assertEqual([item['code'] for item in errors], ['name_conflict', 'save_failed'])
+        self.assertFalse(any('storage_file' in item['error'] for item in errors))
+        self.assertEqual(Blob.objects.get(sha256=hashlib.sha256(b'3').hexdigest()).ref_count, 0)
+
+    def test_quota_releases_stored_blobs(self):
+        StorageUsage.objects.filter(user=self.user).update(quota_bytes=5)
+        response = self.batch([('a.txt', b'1234'), ('b.txt', b'5678')])
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(set(Blob.objects.values_list('ref_count', flat=True)), {0})
+
+
+class ShareLinkTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.STORAGE_CACHE_ALIAS].clear()
+        ratelimit.reset()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.file_id = self.upload('a.txt', b'shared content').data['id']
+
+    def create_link(self, **options):
+        response = self.client.post('/api/share_links/', {'file': self.file_id, **options}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_password_and_download_limit(self):
+        link = self.create_link(max_downloads=1, password='secret')
+        self.assertTrue(link['has_password'])
+        self.client.force_authenticate(None)
+        url = f"/api/files/share/{link['token']}/"
+
+        response = self.client.get(f'{url}info/')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.data['password_required'])
+        response = self.client.get(f'{url}info/', HTTP_X_SHARE_PASSWORD='secret')
+        self.assertEqual(response.data['downloads_left'], 1)
+
+        response = self.client.get(url, HTTP_X_SHARE_PASSWORD='secret')
+        self.assertEqual(b''.join(response.streaming_content), b'shared content')
+        self.assertEqual(self.client.get(url, HTTP_X_SHARE_PASSWORD='secret').status_code, 410)
+        self.assertEqual(ShareLink.objects.get().download_count, 1)
+
+    def test_revoke_regenerate_and_expiry(self):
+        link = self.create_link()
+        url = f"/api/files/share/{link['token']}/info/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.client.post(f"/api/share_links/{link['id']}/revoke/")
+        self.assertEqual(self.client.get(url).status_code, 410)
+
+        regenerated = self.client.post(f"/api/share_links/{link['id']}/regenerate/").data
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(f"/api/files/share/{regenerated['token']}/info/").status_code, 200)
+
+        ShareLink.objects.update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        caches[settings.STORAGE_CACHE_ALIAS].clear()
+        self.assertEqual(self.client.get(f"/api/files/share/{regenerated['token']}/info/").status_code, 410)
+
+        self.client.delete(f'/api/files/{self.file_id}/')
+        self.assertFalse(ShareLink.objects.exists())
+
+    @override_settings(SHARE_LINK_RATE=1, SHARE_LINK_BURST=2)
+    def test_rate_limit_rejects_before_database(self):
+        url = f"/api/files/share/{self.create_link()['token']}/info/"
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @override_settings(SHARE_IP_RATE=0.01, SHARE_IP_BURST=1, SHARE_LINK_RATE=0.01, SHARE_LINK_BURST=3)
+    def test_ip_refusals_do_not_drain_link_bucket(self):
+        url = f"/api/files/share/{self.create_link()['token']}/info/"
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 200)
+        for _ in range(5):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 429)
+        # Заголовок прокси не учитывается, пока не задан CLIENT_IP_HEADER
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1', HTTP_X_REAL_IP='10.0.0.9').status_code, 429)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+        with self.settings(CLIENT_IP_HEADER='HTTP_X_REAL_IP'):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1', HTTP_X_REAL_IP='10.0.0.3').status_code, 200)
+            # Жетоны ссылки кончились на трех разрешенных запросах
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1', HTTP_X_REAL_IP='10.0.0.4').status_code, 429)
+
+
+@override_settings(CHANGES_POLL_INTERVAL=0.05)
+class ChangeFeedTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        self.cursor = self.client.get('/api/changes/').data['cursor']
+
+    def changes(self, cursor, **params):
+        return self.client.get('/api/changes/', {'cursor': cursor, **params})
+
+    def test_create_update_delete_in_order(self):
+        first = self.upload('a.txt', b'a').data['id']
+        second = self.upload('b.txt', b'b').data['id']
+        self.client.patch(f'/api/files/{first}/update_comment/', {'comment': 'новый'}, format='json')
+        self.client.delete(f'/api/files/{second}/')
+        self.client.post('/api/files/bulk_delete/', {'ids': [first]}, format='json')
+
+        page = self.changes(self.cursor, limit=3).data
+        self.assertEqual([e['kind'] for e in page['events']], ['created', 'created', 'updated'])
+        self.assertEqual(page['events'][2]['data']['comment'], 'новый')
+        self.assertTrue(page['has_more'])
+
+        page = self.changes(page['cursor']).data
+        self.assertEqual([(e['kind'], e['file_id']) for e in page['events']], [('deleted', second), ('deleted', first)])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(self.changes(page['cursor']).data['events'], [])
+
+    def test_compaction_and_expired_cursor(self):
+        kept = self.upload('a.txt', b'a').data['id']
+        self.client.patch(f'/api/files/{kept}/update_comment/', {'comment': 'x'}, format='json')
+        removed = self.upload('b.txt', b'b').data['id']
+        self.client.delete(f'/api/files/{removed}/')
+
+        self.assertEqual(changes.compact(), (2, 0))
+        events = self.changes(self.cursor).data['events']
+        self.assertEqual([(e['kind'], e['file_id']) for e in events], [('updated', kept), ('deleted', removed)])
+
+        # Удаление старше срока хранения уходит из журнала, старый курсор устаревает
+        FileEvent.objects.filter(kind=FileEvent.DELETED).update(created_at=timezone.now() - settings.CHANGES_RETENTION * 2)
+        self.assertEqual(changes.compact(), (0, 1))
+        response = self.changes(self.cursor)
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.data['reset'])
+        latest = self.client.get('/api/changes/').data['cursor']
+        self.assertEqual(self.changes(latest).status_code, 200)
+
+    def test_wsgi_view_does_not_long_poll(self):
+        started = timezone.now()
+        page = self.changes(self.cursor, wait='5').data
+        self.assertEqual((page['events'], page['cursor']), ([], self.cursor))
+        self.assertLess((timezone.now() - started).total_seconds(), 1)
+        self.assertEqual(self.changes('x').status_code, 400)
+
+    async def test_asgi_long_poll_waits_and_returns_empty(self):
+        request = AsyncRequestFactory().get(
+            '/api/changes/', {'cursor': self.cursor, 'wait': '0.2'},
+            headers={'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        )
+        started = timezone.now()
+        page = json.loads((await async_views.change_feed(request)).content)
+        self.assertEqual((page['events'], page['cursor']), ([], self.cursor))
+        self.assertGreaterEqual((timezone.now() - started).total_seconds(), 0.2)
+
+
+class FileSearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+        for name, size, comment in (('Report 2024.pdf', 300, 'годовой отчет для налоговой'),
+                                    ('photo.jpg', 5000, 'отпуск на море'),
+                                    ('report-draft.docx', 10, '')):
+            File.objects.create(owner=self.user, original_name=name, size=size, comment=comment,
+                                storage_path=f'user_{self.user.id}/{name}', file=name)
+
+    def names(self, **params):
+        response = self.client.get('/api/files/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [file['original_name'] for file in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.names(name='REPORT', ordering='name'), ['Report 2024.pdf', 'report-draft.docx'])
+        self.assertEqual(self.names(name_prefix='PHO'), ['photo.jpg'])
+        self.assertEqual(self.names(comment='море'), ['photo.jpg'])
+        self.assertEqual(self.names(size_min=100, size_max=1000), ['Report 2024.pdf'])
+        self.assertEqual(self.names(uploaded_after='2000-01-01', ordering='-size'),
+                         ['photo.jpg', 'Report 2024.pdf', 'report-draft.docx'])
+        self.assertEqual(self.names(downloaded_after='2000-01-01'), [])
+
+    def test_sorted_keyset_pages(self):
+        first = self.client.get('/api/files/', {'ordering': 'size', 'page_size': 2}).data
+        second = self.client.get(first['next']).data
+        names = [file['original_name'] for file in first['results'] + second['results']]
+        self.assertEqual(names, ['report-draft.docx', 'Report 2024.pdf', 'photo.jpg'])
+
+    def test_invalid_params(self):
+        for params in ({'size_min': 'x'}, {'uploaded_after': 'вчера'}, {'ordering': 'owner'}):
+            self.assertEqual(self.client.get('/api/files/', params).status_code, 400)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('boss', password='pass', is_staff=True)
+        self.user = User.objects.create_user('alice', password='pass')
+        create_files(self.user, 2)
+
+    def test_metrics_endpoint(self):
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/files/')
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        body = self.client.get('/api/metrics').content.decode()
+        self.assertIn('mycloud_http_requests_total{route="file-list",method="GET",status="200"}', body)
+        self.assertIn('mycloud_http_request_duration_seconds_bucket{route="file-list",method="GET",le="+Inf"}', body)
+        self.assertIn('mycloud_db_queries_total{route="file-list"}', body)
+        self.assertIn('mycloud_streaming_responses_in_flight 0', body)
+
+    def slow_request_user(self, logs):
+        return json.loads(logs.output[-1].split(':', 2)[2])['user_id']
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    async def test_slow_request_log_has_jwt_user(self):
+        # JWT проверяется внутри view, после того как middleware получил запрос
+        token = (await self.async_client.post(
+            '/api/auth/login/', {'username': 'alice', 'password': 'pass'}, content_type='application/json'
+        )).json()['access']
+        with self.assertLogs('storage.metrics', 'WARNING') as logs:
+            await self.async_client.get('/api/files/', headers={'authorization': f'Bearer {token}'})
+        self.assertEqual(self.slow_request_user(logs), self.user.id)
+
+        middleware = metrics.MetricsMiddleware(async_views.change_feed)
+        request = AsyncRequestFactory().get('/api/changes/', headers={'authorization': f'Bearer {token}'})
+        with self.assertLogs('storage.metrics', 'WARNING') as logs:
+            await middleware(request)
+        self.assertEqual(self.slow_request_user(logs), self.user.id)
+
+
+@override_settings(PREVIEW_WORKERS=0)
+class PreviewTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def upload_image(self, name):
+        from PIL import Image
+
+        content = io.BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(content, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.upload(name, content.getvalue()).data
+
+    def test_preview_is_generated_and_cached(self):
+        file = self.upload_image('photo.png')
+        blob = Blob.objects.get(files=file['id'])
+        self.assertEqual(blob.preview_status, 'ready')
+
+        response = self.client.get(f"/api/files/{file['id']}/preview/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\xff\xd8'))
+
+        cached = self.client.get(f"/api/files/{file['id']}/preview/", headers={'if-none-match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_placeholder_and_unsupported(self):
+        file = self.upload_image('photo.png')
+        Blob.objects.filter(files=file['id']).update(preview_status='pending', preview_updated_at=timezone.now())
+        response = self.client.get(f"/api/files/{file['id']}/preview/")
+        self.assertEqual((response.status_code, response['Cache-Control']), (202, 'no-store'))
+
+        text = self.upload('notes.txt', b'text').data
+        self.assertEqual(self.client.get(f"/api/files/{text['id']}/preview/").status_code, 404)
+
+
+class JobQueueTests(MediaRootMixin, APITransactionTestCase):
+    # Воркер выполняет задачи в своих потоках со своими соединениями с БД
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def test_upload_is_verified_by_worker(self):
+        uploaded = self.upload('data.bin', b'%PDF-1.7 content').data
+        job = self.client.get(f"/api/jobs/{uploaded['job_id']}/").data
+        self.assertEqual((job['status'], job['file']), ('queued', uploaded['id']))
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+        job = self.client.get(f"/api/jobs/{uploaded['job_id']}/").data
+        self.assertEqual(job['status'], 'done')
+        file = File.objects.get(pk=uploaded['id'])
+        self.assertEqual(file.sha256, hashlib.sha256(b'%PDF-1.7 content').hexdigest())
+        self.assertEqual(file.content_type, 'application/pdf')
+        self.assertIsNotNone(file.verified_at)
+
+        self.client.force_authenticate(User.objects.create_user('bob', password='pass'))
+        self.assertEqual(self.client.get(f"/api/jobs/{uploaded['job_id']}/").status_code, 404)
+
+    def test_corrupted_content_fails_without_retry(self):
+        uploaded = self.upload('notes.txt', b'original').data
+        file = File.objects.get(pk=uploaded['id'])
+        with open(default_storage.path(file.file.name), 'wb') as stored:
+            stored.write(b'tampered')
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+        job = Job.objects.get(pk=uploaded['job_id'])
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertIsNone(File.objects.get(pk=file.pk).verified_at)
+
+
+@override_settings(STORAGE_COMPRESSION='gzip')
+class CompressionTests(MediaRootMixin, APITestCase):
+    content = b''.join(b'2024-01-01 12:00:%02d INFO request handled\n' % (i % 60) for i in range(2000))
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def test_compressible_upload_is_stored_compressed(self):
+        uploaded = self.upload('app.log', self.content).data
+        blob = Blob.objects.get(files=uploaded['id'])
+        self.assertEqual((blob.encoding, blob.size), ('gzip', len(self.content)))
+        self.assertLess(blob.stored_size, len(self.content) // 5)
+        self.assertEqual(uploaded['stored_size'], blob.stored_size)
+        # Квота считается по исходному размеру
+        self.assertEqual(StorageUsage.objects.get(user=self.user).bytes_used, len(self.content))
+
+        url = f"/api/files/{uploaded['id']}/download/"
+        plain = self.client.get(url)
+        self.assertEqual(b''.join(plain.streaming_content), self.content)
+        self.assertNotIn('Content-Encoding', plain)
+
+        encoded = self.client.get(url, headers={'accept-encoding': 'gzip, br'})
+        self.assertEqual(encoded['Content-Encoding'], 'gzip')
+        self.assertEqual(int(encoded['Content-Length']), blob.stored_size)
+        self.assertEqual(gzip.decompress(b''.join(encoded.streaming_content)), self.content)
+        self.assertNotEqual(encoded['ETag'], plain['ETag'])
+
+        part = self.client.get(url, headers={'range': 'bytes=50000-50099', 'accept-encoding': 'gzip'})
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(b''.join(part.streaming_content), self.content[50000:50100])
+
+    def test_high_ratio_content_is_decoded_in_bounded_blocks(self):
+        size = 64 * 1024 * 1024
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        packed = compressor.compress(bytes(size)) + compressor.flush()
+        name = default_storage.save('blobs/zeros', io.BytesIO(packed))
+        del compressor
+
+        decoded = compression.DecodedFile(name, 'gzip', size)
+        total = 0
+        tracemalloc.start()
+        try:
+            # Каждые ~64 Кб сжатых нулей - 64 Мб распакованных: читается
+            # и держится в памяти только запрошенный блок
+            while block := decoded.read(256 * 1024):
+                self.assertLessEqual(len(block), 256 * 1024)
+                total += len(block)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            decoded.close()
+        self.assertEqual(total, size)
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+        decoded = compression.DecodedFile(name, 'gzip', size)
+        decoded.seek(size - 10)
+        self.assertEqual(decoded.read(), bytes(10))
+        decoded.close()
+
+    def test_incompressible_upload_is_stored_as_is(self):
+        uploaded = self.upload('random.bin', os.urandom(64 * 1024)).data
+        blob = Blob.objects.get(files=uploaded['id'])
+        self.assertEqual((blob.encoding, blob.stored_size), ('', 64 * 1024))
+
+
+@override_settings(DELTA_CHUNK_MIN_SIZE=1024, DELTA_CHUNK_AVG_SIZE=4096, DELTA_CHUNK_MAX_SIZE=16384)
+class DeltaUploadTests(MediaRootMixin, APITestCase):
+    content = random.Random(0).randbytes(200 * 1024)
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def start(self, content, name='data.bin'):
+        chunks = chunking.manifest(io.BytesIO(content))
+        response = self.client.post(
+            '/api/files/delta/', {'original_name': name, 'size': len(content), 'chunks': chunks}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data, {chunk['sha256']: chunk for chunk in chunks}
+
+    def send(self, session, content):
+        parts = {hashlib.sha256(part).hexdigest(): part for part in chunking.split(io.BytesIO(content))}
+        for sha256 in session['missing']:
+            response = self.client.put(
+                f"/api/files/delta/{session['id']}/chunks/{sha256}/", parts[sha256],
+                content_type='application/octet-stream'
+            )
+            self.assertEqual(response.status_code, 200)
+        return self.client.post(f"/api/files/delta/{session['id']}/complete/", {}, format='json')
+
+    def download(self, file_id, **headers):
+        return b''.join(self.client.get(f'/api/files/{file_id}/download/', headers=headers).streaming_content)
+
+    def test_reupload_sends_only_changed_chunks(self):
+        session, first_chunks = self.start(self.content)
+        self.assertEqual(len(session['missing']), len(first_chunks))
+        first = self.send(session, self.content).data
+
+        edited = self.content[:100000] + b'inserted' + self.content[100000:]
+        session, chunks = self.start(edited, 'data_v2.bin')
+        self.assertLessEqual(len(session['missing']), 2)
+        second = self.send(session, edited)
+        self.assertEqual(second.status_code, 201)
+
+        self.assertEqual(self.download(first['id']), self.content)
+        self.assertEqual(self.download(second.data['id']), edited)
+        self.assertEqual(self.download(second.data['id'], range='bytes=99990-100017'), edited[99990:100018])
+        # Общие части хранятся один раз
+        self.assertEqual(Blob.objects.filter(chunk_count=0).count(), len(set(chunks) | set(first_chunks)))
+
+        job = Job.objects.select_related('file__blob').get(pk=second.data['job_id'])
+        self.assertEqual(jobs.run(job), Job.DONE)
+        self.assertEqual(File.objects.get(pk=second.data['id']).sha256, hashlib.sha256(edited).hexdigest())
+
+    def test_foreign_chunks_must_be_sent_and_verified(self):
+        session, _ = self.start(self.content)
+        self.send(session, self.content)
+
+        self.client.force_authenticate(User.objects.create_user('bob', password='pass'))
+        session, chunks = self.start(self.content)
+        self.assertEqual(len(session['missing']), len(chunks))
+        response = self.client.post(f"/api/files/delta/{session['id']}/complete/", {}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        sha256 = session['missing'][0]
+        bad = self.client.put(
+            f"/api/files/delta/{session['id']}/chunks/{sha256}/", b'x' * chunks[sha256]['size'],
+            content_type='application/octet-stream'
+        )
+        self.assertEqual(bad.status_code, 400)
+
+    def test_content_equal_to_manifest_does_not_replace_file(self):
+        chunks = chunking.manifest(io.BytesIO(self.content))
+        manifest = [(chunk['sha256'], chunk['size']) for chunk in chunks]
+        text = delta.MANIFEST_PREFIX + ''.join(f'{sha256}:{size}\n' for sha256, size in manifest).encode()
+        self.assertEqual(hashlib.sha256(text).hexdigest(), delta.manifest_sha256(manifest))
+
+        self.client.force_authenticate(User.objects.create_user('bob', password='pass'))
+        planted = self.upload('manifest.txt', text).data['id']
+
+        self.client.force_authenticate(self.user)
+        session, _ = self.start(self.content)
+        file_id = self.send(session, self.content).data['id']
+        self.assertEqual(self.download(file_id), self.content)
+        # И наоборот: обычная загрузка того же текста не получает файл из частей
+        copy = self.upload('copy.txt', text).data['id']
+        self.assertEqual(self.download(copy), text)
+        self.assertEqual(Blob.objects.filter(sha256=hashlib.sha256(text).hexdigest()).count(), 2)
+
+        self.client.force_authenticate(User.objects.get(username='bob'))
+        self.assertEqual(self.download(planted), text)
+
+    def test_repeated_and_concurrent_chunk_puts(self):
+        session, chunks = self.start(self.content)
+        sha256 = session['missing'][0]
+        part = next(part for part in chunking.split(io.BytesIO(self.content))
+                    if hashlib.sha256(part).hexdigest() == sha256)
+        url = f"/api/files/delta/{session['id']}/chunks/{sha256}/"
+
+        def put():
+            return self.client.put(url, part, content_type='application/octet-stream')
+
+        self.assertEqual(put().status_code, 200)
+        self.assertEqual(put().status_code, 200)
+        # Вставку той же части успел сделать параллельный запрос
+        through = DeltaUpload.received.through.objects
+        with mock.patch.object(type(through), 'get_or_create', side_effect=IntegrityError('unique')):
+            self.assertEqual(put().status_code, 200)
+        self.assertEqual(Blob.objects.get(sha256=sha256).ref_count, 1)
+
+        self.client.delete(f"/api/files/delta/{session['id']}/")
+        self.assertEqual(put().status_code, 404)
+        self.assertEqual(Blob.objects.get(sha256=sha256).ref_count, 0)
+
+    def test_garbage_collection_releases_chunks(self):
+        session, _ = self.start(self.content)
+        file_id = self.send(session, self.content).data['id']
+        self.client.delete(f'/api/files/{file_id}/')
+
+        call_command('collect_garbage', stdout=io.StringIO())
+        self.assertFalse(Blob.objects.exists())
+
+
+class SeedBenchmarkTests(MediaRootMixin, APITestCase):
+    def test_seeded_counters_match_files(self):
+        manifest = f'{self.media_root}/manifest.json'
+        for _ in range(2):
+            # Повторный запуск досоздает только недостающие файлы
+            call_command('seed_benchmark', list_sizes='3,7', file_size=100, manifest=manifest, stdout=io.StringIO())
+
+        user = User.objects.get(username='bench7')
+        usage = StorageUsage.objects.get(user=user)
+        self.assertEqual((usage.file_count, usage.bytes_used), (7, 700))
+        self.assertEqual(Blob.objects.get().ref_count, 10)
+
+        with open(manifest) as source:
+            seeded = json.load(source)['users']['7']
+        self.client.force_authenticate(user)
+        response = self.client.get(f"/api/files/{seeded['file_id']}/download/")
+        self.assertEqual(len(b''.join(response.streaming_content)), 100)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, TemporaryFileUploadHandler
+
+from .models import Blob
+
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file):
+    """SHA-256 содержимого уже сохраненного файла, читается блоками."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """Временный файл загрузки в STORAGE_UPLOAD_TEMP_DIR, на одном томе с хранилищем."""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        os.makedirs(settings.STORAGE_UPLOAD_TEMP_DIR, exist_ok=True)
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=settings.STORAGE_UPLOAD_TEMP_DIR)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Пишет загружаемый файл сразу во временный файл на диске и по ходу
+    считает SHA-256, чтобы не перечитывать содержимое после загрузки.
+    У готового файла появляется атрибут sha256.
+    """
+
+    def new_file(self, *args, **kwargs):
+        FileUploadHandler.new_file(self, *args, **kwargs)
+        self.file = StagedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class StoredUpload:
+    """Файл пакетной загрузки, содержимое которого уже лежит в хранилище блобов."""
+
+    def __init__(self, name, size, blob):
+        self.name = name
+        self.size = size
+        self.blob = blob
+
+    def close(self):
+        # Django закрывает файлы запроса по его завершении, закрывать нечего
+        pass
+
+
+class BlobStoringUploadHandler(HashingFileUploadHandler):
+    """
+    Для пакетной загрузки: каждый файл, как только его часть multipart
+    дочитана, переносится в хранилище блобов, а временный файл закрывается.
+    Сколько бы файлов ни было в запросе, временный файл на диске один.
+    Ссылки на сохраненные блобы копятся в blob_ids, их освобождает view,
+    если запрос не дошел до создания записей.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blob_ids = []
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        try:
+            blob = Blob.objects.store(file, file.sha256, file.size, name=file.name)
+        finally:
+            file.close()
+        self.blob_ids.append(blob.pk)
+        return StoredUpload(file.name, file.size, blob)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+
+
+# Размер блока при копировании частей между потоком запроса и диском
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkSizeMismatch(Exception):
+    pass
+
+
+class StagedFile(DjangoFile):
+    """Собранный на диске файл, который хранилище может переместить, а не копировать."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def session_dir(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_ROOT, str(session.id))
+
+
+def _chunk_path(session, index):
+    return os.path.join(session_dir(session), f'{index}.part')
+
+
+def write_chunk(session, index, stream):
+    """Пишет часть из потока запроса сразу на диск, не держа ее в памяти целиком."""
+    expected = session.expected_chunk_size(index)
+    directory = session_dir(session)
+    os.makedirs(directory, exist_ok=True)
+
+    final_path = _chunk_path(session, index)
+    # Имя уникально: часть могут одновременно писать несколько запросов,
+    # в том числе потоки одного процесса
+    tmp_path = f'{final_path}.{uuid.uuid4().hex}.tmp'
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as dest:
+            while stream is not None and written <= expected:
+                block = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+                if not block:
+                    break
+                dest.write(block)
+                written += len(block)
+
+        if written != expected:
+            raise ChunkSizeMismatch(
+                f'Ожидалось {expected} байт для части {index}, получено {written}'
+            )
+        # Часть появляется под своим именем только целиком
+        os.replace(tmp_path, final_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return written
+
+
+def received_chunks(session):
+    try:
+        names = os.listdir(session_dir(session))
+    except FileNotFoundError:
+        return []
+
+    indexes = []
+    for name in names:
+        index, ext = os.path.splitext(name)
+        if ext == '.part' and index.isdigit():
+            indexes.append(int(index))
+    return sorted(indexes)
+
+
+def missing_chunks(session):
+    received = set(received_chunks(session))
+    return [i for i in range(session.total_chunks) if i not in received]
+
+
+def assemble(session):
+    """
+    Склеивает части в один файл рядом с ними, по ходу считая SHA-256.
+    Возвращает путь к собранному файлу и хэш содержимого. Файл удаляет
+    вызывающий, если хранилище не переместило его (remove_assembled).
+    """
+    # У каждой сборки свой файл: одновременные complete не пишут в один
+    target = os.path.join(session_dir(session), f'assembled.{uuid.uuid4().hex}')
+    digest = hashlib.sha256()
+    try:
+        with open(target, 'wb') as dest:
+            for index in range(session.total_chunks):
+                with open(_chunk_path(session, index), 'rb') as part:
+                    for block in iter(lambda: part.read(COPY_BUFFER_SIZE), b''):
+                        digest.update(block)
+                        dest.write(block)
+    except BaseException:
+        remove_assembled(target)
+        raise
+    return target, digest.hexdigest()
+
+
+def remove_assembled(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard(session):
+    shutil.rmtree(session_dir(session), ignore_errors=True)
@@ -1,14 +1,34 @@
-from .views import UserViewSet, FileViewSet, RegisterView, CurrentUserView
+from .views import UserViewSet, FileViewSet, FolderViewSet, JobViewSet, ShareLinkViewSet, RegisterView, CurrentUserView, CacheStatsView, ChangesView, MetricsView
+from . import async_views
 from rest_framework.routers import DefaultRouter
+from django.conf import settings
 from django.urls import path, include
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'files', FileViewSet, basename='file')
+router.register(r'folders', FolderViewSet, basename='folder')
+router.register(r'jobs', JobViewSet, basename='job')
+router.register(r'share_links', ShareLinkViewSet, basename='share-link')
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.STORAGE_ASYNC_VIEWS:
+    # Под ASGI скачивание и long-poll ленты изменений обслуживают асинхронные
+    # view, они должны идти до роутера
+    urlpatterns += [
+        path('api/changes/', async_views.change_feed, name='changes'),
+        path('api/files/<int:pk>/download/', async_views.download, name='file-download'),
+        path('api/files/share/<uuid:share_link>/', async_views.download_shared, name='file-download-shared'),
+        path('api/files/share/<uuid:share_link>/info/', async_views.share_file_info, name='file-share-file-info'),
+    ]
+
+urlpatterns += [
     path('api/', include(router.urls)),
     path('api/users/<int:pk>/files/', UserViewSet.as_view({'get': 'user_files'}), name='user-files'),
     path('api/auth/register/', RegisterView.as_view(), name='register'),
     path('api/auth/me/', CurrentUserView.as_view(), name='current_user'),
+    path('api/changes/', ChangesView.as_view(), name='changes'),
+    path('api/cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('api/metrics', MetricsView.as_view(), name='metrics'),
 ]
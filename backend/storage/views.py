@@ -1,34 +1,113 @@
-import os
-import uuid
 import logging
-from rest_framework import viewsets, permissions, status
+import uuid
+from collections import Counter
+from rest_framework import mixins, viewsets, permissions, status
 from django.contrib.auth.models import User
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from django.db.models import Sum, Count
-from django.db import IntegrityError
-from django.http import FileResponse
-from django.utils import timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
-from .models import File
-from .serializers import UserSerializer, RegisterSerializer, FileSerializer
+from .models import Blob, DeltaUpload, File, Folder, Job, ShareLink, StorageUsage, UploadSession
+from .serializers import (
+    UserSerializer, RegisterSerializer, FileSerializer, FolderSerializer, JobSerializer, ShareLinkSerializer,
+    UploadSessionSerializer, DeltaUploadSerializer
+)
+from . import batch, cache, changes, delta, deletion, download_stats, folders, jobs, metrics, previews, sharing, uploads
+from .archives import FORMATS as ARCHIVE_FORMATS, archive_response
+from .downloads import DELIVERED_STATUSES, counts_as_download, file_response
+from .filters import FileSearchFilter
+from .naming import new_storage_path, save_with_unique_name
+from .pagination import FileKeysetPagination, UserKeysetPagination
+from .upload_handlers import BlobStoringUploadHandler, HashingFileUploadHandler
 
 
 logger = logging.getLogger(__name__)
 
+# Запас на заголовки multipart при ранней проверке квоты по Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def _quota_exceeded(user):
+    logger.warning(f'Пользователь {user} превысил квоту хранилища')
+    return Response(
+        {"error": "Превышена квота хранилища"},
+        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    )
+
+
+def _parse_ids(ids):
+    """Список id без повторов из "1,2,3" или [1, 2, 3], None - если формат неверный."""
+    ids = ids or []
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    try:
+        return list(dict.fromkeys(int(file_id) for file_id in ids))
+    except (TypeError, ValueError):
+        return None
+
+
+def _invalid_ids():
+    return Response(
+        {"error": "ids должен быть списком идентификаторов файлов"},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def _get_folder(owner, value, param='folder'):
+    """Папка владельца по id из запроса, None - корень ("", "root" или null)."""
+    if value in (None, '', 'root'):
+        return None
+    try:
+        folder_id = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({"error": f"Некорректное значение параметра {param}"})
+    return get_object_or_404(Folder, pk=folder_id, owner=owner)
+
+
+def _folder_conflict():
+    return Response(
+        {"error": "Папка с таким именем уже существует"},
+        status=status.HTTP_409_CONFLICT
+    )
+
+
+def _share_denied(denied):
+    return Response(denied.data, status=denied.status, headers=denied.headers)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = UserKeysetPagination
 
     def get_queryset(self):
-        return User.objects.annotate(
-            total_file_size = Sum('files__size'),
-            files_count = Count('files')
-        )
+        return User.objects.select_related('storage_usage')
+
+    def perform_destroy(self, instance):
+        # Файлы удаляются одним запросом до каскада, иначе Django загрузил бы
+        # каждый файл ради сигнала post_delete
+        with transaction.atomic():
+            deleted = deletion.bulk_delete(File.objects.filter(owner=instance), record_changes=False)
+            for session in instance.delta_uploads.all():
+                delta.discard(session)
+            # Строки сессий загрузки по частям уберет каскад, а их каталоги с
+            # частями cleanup_uploads уже не найдет: удаляем после коммита
+            for session in instance.upload_sessions.all():
+                transaction.on_commit(lambda session=session: uploads.discard(session))
+            deletion.raw_delete(Folder.objects.filter(owner=instance))
+            instance.delete()
+        logger.info(f'Пользователь {instance.username} удален вместе с {len(deleted)} файлами')
 
     @action(detail=True, methods=['patch'])
     def set_admin(self, request, pk=None):
@@ -38,12 +117,36 @@ class UserViewSet(viewsets.ModelViewSet):
         logger.info(f'У пользователя {user.username} установлены админ права:{user.is_staff}')
         return Response(self.get_serializer(user).data)
 
+    @action(detail=True, methods=['patch'])
+    def set_quota(self, request, pk=None):
+        user = self.get_object()
+        quota = request.data.get('quota_bytes')
+        if quota is not None:
+            try:
+                quota = int(quota)
+            except (TypeError, ValueError):
+                quota = -1
+            if quota < 0:
+                return Response(
+                    {"error": "Квота должна быть неотрицательным числом байт или null"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        StorageUsage.objects.get_or_create(user=user)
+        StorageUsage.objects.filter(user=user).update(quota_bytes=quota)
+        logger.info(f'Пользователю {user.username} установлена квота {quota}')
+        return Response(self.get_serializer(self.get_object()).data)
+
     @action(detail=True, methods=['get'], url_path='files')
     def user_files(self, request, pk=None):
-        user = self.get_object()
-        files = File.objects.filter(owner=user)
-        serializer = FileSerializer(files, many=True, context={'request': request})
-        return Response(serializer.data)
+        user = get_object_or_404(User, pk=pk)
+        files = File.objects.filter(owner=user).select_related('owner', 'blob')
+        files = FileSearchFilter().filter_queryset(request, files, self)
+
+        paginator = FileKeysetPagination()
+        page = paginator.paginate_queryset(files, request, view=self)
+        serializer = FileSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
 
 class RegisterView(APIView):
@@ -92,18 +195,59 @@ class CurrentUserView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = User.objects.filter(id=request.user.id).annotate(
-            files_count=Count('files'),
-            total_file_size=Sum('files__size')
-        ).first()
+        user = User.objects.select_related('storage_usage').filter(id=request.user.id).first()
 
         serializer = UserSerializer(user)
         return Response(serializer.data)
 
 
+class IsAdminOrMetricsToken(permissions.BasePermission):
+    def has_permission(self, request, view):
+        token = request.META.get('HTTP_X_METRICS_TOKEN', '')
+        if settings.METRICS_TOKEN and constant_time_compare(token, settings.METRICS_TOKEN):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminOrMetricsToken]
+
+    def get(self, request):
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(cache.stats())
+
+
+class ChangesView(APIView):
+    """Лента изменений файлов пользователя с long-poll, см. storage.changes."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            # wait не учитывается: long-poll занял бы воркер WSGI, ждет только
+            # async_views.change_feed под ASGI
+            cursor, limit, _ = changes.parse_params(request.query_params)
+        except changes.ChangesError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if cursor is None:
+            return Response({'events': [], 'cursor': changes.latest(request.user.id), 'has_more': False})
+        try:
+            return Response(changes.read(request.user.id, cursor, limit))
+        except changes.CursorExpired as e:
+            return Response({"error": str(e), "reset": True}, status=status.HTTP_410_GONE)
+
+
 class FileViewSet(viewsets.ModelViewSet):
     serializer_class = FileSerializer
     parser_classes = (MultiPartParser, FormParser, JSONParser)
+    pagination_class = FileKeysetPagination
+    filter_backends = [FileSearchFilter]
 
     def get_permissions(self):
         if self.action in ['download_shared', 'share_file_info']:
@@ -114,15 +258,41 @@ class FileViewSet(viewsets.ModelViewSet):
         user = self.request.user
         user_id = self.request.query_params.get('user_id')
 
+        queryset = File.objects.select_related('owner', 'blob')
+
         if user.is_staff and user_id:
-            return File.objects.filter(owner_id=user_id)
+            return queryset.filter(owner_id=user_id)
 
-        return File.objects.filter(owner=user)
+        return queryset.filter(owner=user)
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def update(self, request, *args, **kwargs):
+        # Имя файла уникально у владельца, а валидатор DRF для этой пары не
+        # срабатывает: owner только для чтения
+        try:
+            with transaction.atomic():
+                return super().update(request, *args, **kwargs)
+        except IntegrityError:
+            return Response(
+                {"error": "Файл с таким именем уже существует"},
+                status=status.HTTP_409_CONFLICT
+            )
+
+    def perform_update(self, serializer):
+        file = serializer.save()
+        sharing.invalidate_file_links(file)
+
     def create(self, request, *args, **kwargs):
+        # Квота проверяется по Content-Length до чтения тела запроса
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if not StorageUsage.objects.fits_quota(request.user.id, content_length - MULTIPART_OVERHEAD):
+            return _quota_exceeded(request.user)
+
+        # Файл пишется на диск по мере поступления с подсчетом SHA-256
+        request._request.upload_handlers = [HashingFileUploadHandler(request._request)]
+
         if 'file' not in request.FILES:
             return Response(
                 {"error": "Файл не был предоставлен"},
@@ -131,34 +301,35 @@ class FileViewSet(viewsets.ModelViewSet):
 
         file_obj = request.FILES['file']
         comment = request.data.get('comment', '')
+        folder = _get_folder(request.user, request.data.get('folder'))
 
         try:
-            ext = os.path.splitext(file_obj.name)[1]
-            storage_name = f"{uuid.uuid4().hex}{ext}"
-            storage_path = f"user_{request.user.id}/{storage_name}"
-
-            original_name = file_obj.name
-            base_name, ext = os.path.splitext(original_name)
-            counter = 1
-
-            while File.objects.filter(owner=request.user, original_name=original_name).exists():
-                original_name = f"{base_name}_{counter}{ext}"
-                counter += 1
-
-            logger.info(f'Пользователь {request.user}, закачал файл {original_name}')
-
-            file_instance = File(
-                owner=request.user,
-                original_name=original_name,
-                storage_path=storage_path,
-                size=file_obj.size,
-                comment=comment,
-                file=file_obj
-            )
-            file_instance.save()
+            storage_path = new_storage_path(request.user.id, file_obj.name)
+
+            with transaction.atomic():
+                if not StorageUsage.objects.fits_quota(request.user.id, file_obj.size, lock=True):
+                    return _quota_exceeded(request.user)
+                blob = Blob.objects.store(file_obj, file_obj.sha256, file_obj.size, name=file_obj.name)
+                file_instance = File(
+                    owner=request.user,
+                    original_name=file_obj.name,
+                    storage_path=storage_path,
+                    size=file_obj.size,
+                    comment=comment,
+                    folder=folder,
+                    blob=blob,
+                    file=blob.storage_name
+                )
+                save_with_unique_name(file_instance)
+                previews.schedule(file_instance)
+                job = jobs.enqueue(jobs.VERIFY_UPLOAD, file_instance)
+
+            logger.info(f'Пользователь {request.user}, закачал файл {file_instance.original_name}')
 
-            serializer = self.get_serializer(file_instance)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            data = self.get_serializer(file_instance).data
+            # Контрольную сумму и тип заполнит фоновая задача, ее статус - /api/jobs/<id>/
+            data['job_id'] = job.pk
+            return Response(data, status=status.HTTP_201_CREATED)
 
         except IntegrityError as e:
             return Response(
@@ -171,10 +342,238 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch_upload(self, request):
+        # multipart с несколькими частями files, необязательные comment и folder
+        # относятся ко всем файлам пакета
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if not StorageUsage.objects.fits_quota(request.user.id, content_length - MULTIPART_OVERHEAD):
+            return _quota_exceeded(request.user)
+
+        # Каждый файл уходит в хранилище, как только дочитана его часть запроса
+        handler = BlobStoringUploadHandler(request._request)
+        request._request.upload_handlers = [handler]
+        try:
+            uploaded = request.FILES.getlist('files')
+            folder = _get_folder(request.user, request.data.get('folder'))
+            if not uploaded:
+                return Response(
+                    {"error": "Файлы не были предоставлены"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            created, errors, verify_jobs = batch.create_files(
+                request.user, uploaded, folder, request.data.get('comment', '')
+            )
+        except batch.QuotaExceeded:
+            Blob.objects.release_many(Counter(handler.blob_ids))
+            return _quota_exceeded(request.user)
+        except Exception:
+            # Блобы уже в хранилище: без записей файлов их заберет сборщик мусора
+            Blob.objects.release_many(Counter(handler.blob_ids))
+            raise
+
+        logger.info(f'Пользователь {request.user} загрузил пакет из {len(created)} файлов, ошибок: {len(errors)}')
+        results = []
+        # id может не попасть в ответ при fields=, поэтому задача ищется по записи файла
+        for file_instance, data in zip(created, self.get_serializer(created, many=True).data):
+            data['job_id'] = verify_jobs[file_instance.pk].pk
+            results.append(data)
+        results += [
+            {"original_name": name, "error": batch.ERRORS[code], "code": code} for name, code in errors
+        ]
+        return Response(
+            {"files": results, "created": len(created), "failed": len(errors)},
+            status=status.HTTP_201_CREATED if created else status.HTTP_409_CONFLICT
+        )
+
+    def _get_upload_session(self, upload_id):
+        try:
+            uuid.UUID(str(upload_id))
+        except ValueError:
+            raise Http404
+        return get_object_or_404(UploadSession, id=upload_id, owner=self.request.user)
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def start_upload(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not StorageUsage.objects.fits_quota(request.user.id, serializer.validated_data['size']):
+            return _quota_exceeded(request.user)
+        session = serializer.save(owner=request.user)
+        logger.info(f'Пользователь {request.user} начал загрузку по частям {session.original_name}, сессия {session.id}')
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='uploads/(?P<upload_id>[^/.]+)')
+    def upload_status(self, request, upload_id=None):
+        session = self._get_upload_session(upload_id)
+        return Response(UploadSessionSerializer(session).data)
+
+    @upload_status.mapping.delete
+    def abort_upload(self, request, upload_id=None):
+        session = self._get_upload_session(upload_id)
+        uploads.discard(session)
+        session.delete()
+        logger.info(f'Загрузка по частям {upload_id} отменена пользователем {request.user}')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['put'], url_path=r'uploads/(?P<upload_id>[^/.]+)/chunks/(?P<index>[0-9]+)')
+    def upload_chunk(self, request, upload_id=None, index=None):
+        session = self._get_upload_session(upload_id)
+        index = int(index)
+        if index >= session.total_chunks:
+            return Response(
+                {"error": f"Номер части должен быть меньше {session.total_chunks}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Тело читается напрямую из потока, без парсеров и буферизации в памяти
+        try:
+            uploads.write_chunk(session, index, request.stream)
+        except uploads.ChunkSizeMismatch as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"index": index, "received_chunks": uploads.received_chunks(session)})
+
+    @action(detail=False, methods=['post'], url_path=r'uploads/(?P<upload_id>[^/.]+)/complete')
+    def complete_upload(self, request, upload_id=None):
+        session = self._get_upload_session(upload_id)
+        missing = uploads.missing_chunks(session)
+        if missing:
+            return Response(
+                {"error": "Загружены не все части файла", "missing_chunks": missing},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        folder = _get_folder(request.user, request.data.get('folder'))
+
+        try:
+            assembled_path, sha256 = uploads.assemble(session)
+
+            try:
+                # Собранный файл перемещается в хранилище без чтения в память
+                with open(assembled_path, 'rb') as assembled, transaction.atomic():
+                    if not StorageUsage.objects.fits_quota(request.user.id, session.size, lock=True):
+                        return _quota_exceeded(request.user)
+                    staged = uploads.StagedFile(assembled, name=session.original_name)
+                    staged.size = session.size
+                    blob = Blob.objects.store(staged, sha256, session.size, name=session.original_name)
+                    file_instance = File(
+                        owner=request.user,
+                        original_name=session.original_name,
+                        storage_path=new_storage_path(request.user.id, session.original_name),
+                        size=session.size,
+                        comment=session.comment,
+                        folder=folder,
+                        blob=blob,
+                        file=blob.storage_name
+                    )
+                    save_with_unique_name(file_instance)
+                    previews.schedule(file_instance)
+                    job = jobs.enqueue(jobs.VERIFY_UPLOAD, file_instance)
+            finally:
+                # Без перемещения в хранилище (квота, ошибка) файл остался на месте
+                uploads.remove_assembled(assembled_path)
+
+            uploads.discard(session)
+            session.delete()
+            logger.info(f'Пользователь {request.user}, закачал файл {file_instance.original_name} по частям')
+
+            data = self.get_serializer(file_instance).data
+            # Контрольную сумму и тип заполнит фоновая задача, ее статус - /api/jobs/<id>/
+            data['job_id'] = job.pk
+            return Response(data, status=status.HTTP_201_CREATED)
+
+        except IntegrityError:
+            return Response(
+                {"error": "Конфликт имен файлов. Попробуйте еще раз."},
+                status=status.HTTP_409_CONFLICT
+            )
+        except Exception:
+            logger.exception(f'Ошибка при сборке файла из частей, сессия {upload_id}')
+            return Response(
+                {"error": "Внутренняя ошибка сервера"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def _get_delta_upload(self, upload_id):
+        try:
+            uuid.UUID(str(upload_id))
+        except ValueError:
+            raise Http404
+        return get_object_or_404(DeltaUpload, id=upload_id, owner=self.request.user)
+
+    @action(detail=False, methods=['post'], url_path='delta')
+    def start_delta_upload(self, request):
+        serializer = DeltaUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not StorageUsage.objects.fits_quota(request.user.id, serializer.validated_data['size']):
+            return _quota_exceeded(request.user)
+        session = serializer.save(owner=request.user)
+        logger.info(
+            f'Пользователь {request.user} начал загрузку дельтой {session.original_name}, '
+            f'сессия {session.id}, частей {len(session.manifest)}'
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='delta/(?P<upload_id>[^/.]+)')
+    def delta_upload_status(self, request, upload_id=None):
+        session = self._get_delta_upload(upload_id)
+        return Response(DeltaUploadSerializer(session).data)
+
+    @delta_upload_status.mapping.delete
+    def abort_delta_upload(self, request, upload_id=None):
+        session = self._get_delta_upload(upload_id)
+        delta.discard(session)
+        logger.info(f'Загрузка дельтой {upload_id} отменена пользователем {request.user}')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['put'], url_path=r'delta/(?P<upload_id>[^/.]+)/chunks/(?P<sha256>[0-9a-f]{64})')
+    def upload_delta_chunk(self, request, upload_id=None, sha256=None):
+        session = self._get_delta_upload(upload_id)
+        # Тело читается напрямую из потока, без парсеров и буферизации в памяти
+        try:
+            blob = delta.receive_chunk(session, sha256, request.stream)
+        except delta.DeltaError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DeltaUpload.DoesNotExist:
+            raise Http404
+        return Response({"sha256": blob.sha256, "size": blob.size})
+
+    @action(detail=False, methods=['post'], url_path=r'delta/(?P<upload_id>[^/.]+)/complete')
+    def complete_delta_upload(self, request, upload_id=None):
+        session = self._get_delta_upload(upload_id)
+        folder = _get_folder(request.user, request.data.get('folder'))
+
+        try:
+            with transaction.atomic():
+                if not StorageUsage.objects.fits_quota(request.user.id, session.size, lock=True):
+                    return _quota_exceeded(request.user)
+                file_instance, job = delta.complete(session, folder)
+        except delta.MissingChunks as e:
+            return Response(
+                {"error": "Присланы не все части файла", "missing": e.missing},
+                status=status.HTTP_409_CONFLICT
+            )
+        except delta.DeltaError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DeltaUpload.DoesNotExist:
+            # Загрузку параллельно завершили или отменили
+            raise Http404
+        except IntegrityError:
+            return Response(
+                {"error": "Конфликт имен файлов. Попробуйте еще раз."},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        logger.info(f'Пользователь {request.user}, закачал файл {file_instance.original_name} дельтой')
+        data = self.get_serializer(file_instance).data
+        # Контрольную сумму и тип заполнит фоновая задача, ее статус - /api/jobs/<id>/
+        data['job_id'] = job.pk
+        return Response(data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         try:
-          file_obj = File.objects.get(pk=pk)
+          file_obj = File.objects.select_related('blob').get(pk=pk)
 
           # Проверяем существование файла в хранилище
           if not file_obj.file:
@@ -194,13 +593,11 @@ class FileViewSet(viewsets.ModelViewSet):
                   status=status.HTTP_403_FORBIDDEN
               )
 
-          response = FileResponse(file_obj.file)
-          response['Content-Disposition'] = f'attachment; filename="{file_obj.original_name}"'
-          response['Content-Type'] = 'application/octet-stream'
-          logger.info(f'Скачивание файла {file_obj.original_name}, владельцем или админом')
-
-          file_obj.last_download = timezone.now()
-          file_obj.save()
+          response = file_response(request, file_obj)
+          if response.status_code in DELIVERED_STATUSES:
+              logger.info(f'Скачивание файла {file_obj.original_name}, владельцем или админом')
+          if counts_as_download(request, response):
+              download_stats.record(file_obj.pk)
 
           return response
         
@@ -220,6 +617,104 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        file_obj = get_object_or_404(self.get_queryset().select_related('blob'), pk=pk)
+        blob = file_obj.blob
+        if blob is not None and not blob.preview_status:
+            # Файлы, загруженные до появления превью, ставятся в очередь при первом запросе
+            previews.schedule(file_obj)
+
+        if blob is None or blob.preview_status in (previews.UNSUPPORTED, previews.FAILED):
+            return Response(
+                {"error": "Превью для этого файла недоступно"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if blob.preview_status == previews.PENDING:
+            previews.retry_stale(file_obj)
+            response = HttpResponse(
+                previews.PLACEHOLDER,
+                status=status.HTTP_202_ACCEPTED,
+                content_type=previews.PLACEHOLDER_CONTENT_TYPE
+            )
+            response['Cache-Control'] = 'no-store'
+            response['Retry-After'] = 2
+            return response
+
+        # Содержимое файла не меняется, поэтому превью кэшируется навсегда
+        etag = f'"{blob.sha256}-preview"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(
+                default_storage.open(previews.preview_name(blob.storage_name), 'rb'),
+                content_type=previews.CONTENT_TYPE
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+    @action(detail=False, methods=['get', 'post'], url_path='archive')
+    def archive(self, request):
+        # ids=1,2,3 в строке запроса или {"ids": [1, 2, 3]} в теле POST,
+        # type=zip|tar, store=1 - без сжатия (для уже сжатых медиа)
+        params = request.data if request.method == 'POST' else request.query_params
+        ids = _parse_ids(params.get('ids'))
+        if ids is None:
+            return _invalid_ids()
+        if not ids or len(ids) > settings.ARCHIVE_MAX_FILES:
+            return Response(
+                {"error": f"Укажите от 1 до {settings.ARCHIVE_MAX_FILES} файлов"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Параметр format занят DRF под выбор рендерера
+        archive_format = params.get('type', 'zip')
+        if archive_format not in ARCHIVE_FORMATS:
+            return Response(
+                {"error": f"Формат архива должен быть одним из: {', '.join(ARCHIVE_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        store = str(params.get('store', '')).lower() in ('1', 'true', 'yes')
+
+        # Права на весь набор проверяются одним запросом: get_queryset
+        # отдает только свои файлы или файлы user_id для админа
+        files = {file.id: file for file in self.get_queryset().filter(pk__in=ids).select_related('blob')}
+        missing = [file_id for file_id in ids if file_id not in files]
+        if missing:
+            logger.warning(f'Пользователь {request.user} запросил архив с недоступными файлами {missing}')
+            return Response(
+                {"error": "Файлы не найдены", "missing": missing},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        files = [files[file_id] for file_id in ids]
+        download_stats.record(*ids)
+        logger.info(f'Пользователь {request.user} скачивает архив {archive_format} из {len(files)} файлов')
+        return archive_response(files, archive_format, compress=not store,
+                                asynchronous=settings.STORAGE_ASYNC_VIEWS)
+
+    @action(detail=False, methods=['post'], url_path='bulk_delete')
+    def bulk_delete(self, request):
+        # {"ids": [1, 2, 3]}, админ удаляет файлы пользователя с ?user_id=
+        ids = _parse_ids(request.data.get('ids'))
+        if not ids:
+            return _invalid_ids()
+
+        deleted = deletion.bulk_delete(self.get_queryset().filter(pk__in=ids))
+        not_found = sorted(set(ids) - set(deleted))
+        logger.info(f'Пользователь {request.user} удалил файлы {deleted}')
+        return Response({"deleted": deleted, "not_found": not_found})
+
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        # {"folder": id} или {"folder": null} - в корень
+        file = self.get_object()
+        folder = _get_folder(file.owner, request.data.get('folder'))
+        folders.move_file(file, folder)
+        logger.info(f'Пользователь {request.user} переместил файл {file.original_name} в папку {folder}')
+        return Response(self.get_serializer(file).data)
+
     @action(detail=True, methods=['patch'], url_path='update_comment')
     def update_comment(self, request, pk=None):
         file = self.get_object()
@@ -238,7 +733,8 @@ class FileViewSet(viewsets.ModelViewSet):
                 )
 
             file.comment = new_comment
-            file.save()
+            file.save(update_fields=['comment'])
+            sharing.invalidate_file_links(file)
 
             serializer = self.get_serializer(file)
             return Response(serializer.data)
@@ -252,29 +748,43 @@ class FileViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='share/(?P<share_link>[^/.]+)')
     def download_shared(self, request, share_link=None):
         try:
-            file_obj = get_object_or_404(File, share_link=share_link)
-
-            response = FileResponse(file_obj.file)
-            response['Content-Disposition'] = f'attachment; filename="{file_obj.original_name}"'
-            response['Content-Type'] = 'application/octet-stream'
-            logger.info(f'Скачивание файла {file_obj.original_name}, по шаред-ссылке')
+            link = sharing.resolve(request, share_link, download=True)
+        except sharing.ShareDenied as denied:
+            return _share_denied(denied)
 
-            file_obj.last_download = timezone.now()
-            file_obj.save()
+        try:
+            file_obj = link.file
+            response = file_response(request, file_obj)
+            if response.status_code in DELIVERED_STATUSES:
+                logger.info(f'Скачивание файла {file_obj.original_name}, по шаред-ссылке')
+            else:
+                sharing.refund(link)
+            if counts_as_download(request, response):
+                download_stats.record(file_obj.pk)
 
             return response
         except Exception as e:
+            sharing.refund(link)
             return Response({"error": str(e)}, status=500)
 
     @action(detail=False, methods=['get'], url_path='share/(?P<share_link>[^/.]+)/info')
     def share_file_info(self, request, share_link=None):
-        file_obj = get_object_or_404(File, share_link=share_link)
+        try:
+            link = sharing.resolve(request, share_link)
+        except sharing.ShareDenied as denied:
+            return _share_denied(denied)
+
+        file_obj = link.file
         return Response({
             'original_name': file_obj.original_name,
             'size': file_obj.size,
             'upload_date': file_obj.upload_date,
             'last_download': file_obj.last_download,
-            'comment': file_obj.comment
+            'comment': file_obj.comment,
+            'expires_at': link.expires_at,
+            'downloads_left': (
+                link.max_downloads - link.download_count if link.max_downloads is not None else None
+            ),
         })
 
     @action(detail=True, methods=['delete'], permission_classes=[IsAdminUser])
@@ -297,3 +807,119 @@ class FileViewSet(viewsets.ModelViewSet):
               {"error": "Внутренняя ошибка сервера"},
               status=status.HTTP_500_INTERNAL_SERVER_ERROR
           )
+
+
+class FolderViewSet(viewsets.ModelViewSet):
+    """
+    Папки пользователя. Список - содержимое одной папки: ?parent=<id>,
+    без параметра - папки корня. PATCH {"name": ...} переименовывает,
+    {"parent": id|null} переносит поддерево, DELETE удаляет его вместе с файлами.
+    """
+    serializer_class = FolderSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Folder.objects.filter(owner=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        parent = _get_folder(request.user, request.query_params.get('parent'), 'parent')
+        queryset = self.get_queryset()
+        queryset = queryset.filter(parent=parent) if parent else queryset.filter(parent__isnull=True)
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    def create(self, request, *args, **kwargs):
+        parent = _get_folder(request.user, request.data.get('parent'), 'parent')
+        try:
+            folder = folders.create(request.user, request.data.get('name'), parent)
+        except folders.FolderError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return _folder_conflict()
+        logger.info(f'Пользователь {request.user} создал папку {folder.path}')
+        return Response(self.get_serializer(folder).data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        folder = self.get_object()
+        try:
+            with transaction.atomic():
+                if 'name' in request.data:
+                    folders.rename(folder, request.data['name'])
+                if 'parent' in request.data:
+                    parent = _get_folder(request.user, request.data['parent'], 'parent')
+                    folder = folders.move(folder, parent)
+        except folders.FolderError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return _folder_conflict()
+        logger.info(f'Пользователь {request.user} изменил папку {folder.pk}: {folder.name}, {folder.path}')
+        return Response(self.get_serializer(folder).data)
+
+    def perform_destroy(self, instance):
+        deleted = folders.delete(instance)
+        logger.info(f'Пользователь {self.request.user} удалил папку {instance.path} с {len(deleted)} файлами')
+
+
+class ShareLinkViewSet(viewsets.ModelViewSet):
+    """
+    Публичные ссылки на свои файлы, ?file=<id> - ссылки одного файла.
+    POST {"file", "expires_at", "max_downloads", "password"} создает ссылку,
+    revoke отзывает, regenerate выдает новый токен вместо старого.
+    """
+    serializer_class = ShareLinkSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = ShareLink.objects.filter(file__owner=self.request.user)
+        file_id = self.request.query_params.get('file')
+        if file_id:
+            try:
+                queryset = queryset.filter(file_id=int(file_id))
+            except ValueError:
+                raise ValidationError({"error": "Некорректное значение параметра file"})
+        return queryset
+
+    def perform_create(self, serializer):
+        link = serializer.save()
+        logger.info(f'Пользователь {self.request.user} создал ссылку {link.token} на файл {link.file_id}')
+
+    def perform_update(self, serializer):
+        link = serializer.save()
+        cache.invalidate_share_link(link.token)
+
+    def perform_destroy(self, instance):
+        # Кэш сбрасывает сигнал post_delete
+        instance.delete()
+        logger.info(f'Пользователь {self.request.user} удалил ссылку {instance.token}')
+
+    @action(detail=True, methods=['post'])
+    def revoke(self, request, pk=None):
+        link = self.get_object()
+        if link.revoked_at is None:
+            link.revoked_at = timezone.now()
+            link.save(update_fields=['revoked_at'])
+            cache.invalidate_share_link(link.token)
+            logger.info(f'Пользователь {request.user} отозвал ссылку {link.token}')
+        return Response(self.get_serializer(link).data)
+
+    @action(detail=True, methods=['post'])
+    def regenerate(self, request, pk=None):
+        # Старый токен перестает работать, ограничения ссылки сохраняются
+        link = self.get_object()
+        old_token = link.token
+        link.token = uuid.uuid4()
+        link.revoked_at = None
+        link.save(update_fields=['token', 'revoked_at'])
+        cache.invalidate_share_link(old_token)
+        logger.info(f'Пользователь {request.user} заменил ссылку {old_token} на {link.token}')
+        return Response(self.get_serializer(link).data)
+
+
+class JobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Статус фоновой задачи по загруженному файлу."""
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return Job.objects.all()
+        return Job.objects.filter(file__owner=self.request.user)
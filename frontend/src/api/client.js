@@ -60,4 +60,13 @@ export const downloadClient = axios.create({
   withCredentials: true,
 });
 
+// Списки на сервере отдаются страницами: загружаем одну страницу и курсор
+// следующей из ссылки next (null - страниц больше нет). Следующая страница
+// запрашивается по кнопке "Загрузить еще", а не сразу
+export const getPage = async (url, params = {}, cursor = null) => {
+  const response = await apiClient.get(url, { params: cursor ? { ...params, cursor } : params });
+  const { results, next } = response.data;
+  return { results, cursor: next ? new URL(next).searchParams.get('cursor') : null };
+};
+
 export default apiClient;
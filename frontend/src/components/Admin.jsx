@@ -1,6 +1,6 @@
 import { useEffect } from 'react';
 import { useSelector, useDispatch } from 'react-redux';
-import { fetchUsers, deleteUser, updateUser } from '../store/slices/adminSlice';
+import { fetchUsers, fetchMoreUsers, deleteUser, updateUser } from '../store/slices/adminSlice';
 import { Table, Button, Space, message, Popconfirm, Switch } from 'antd';
 import { DeleteOutlined } from '@ant-design/icons';
 import { useNavigate } from 'react-router-dom';
@@ -9,7 +9,7 @@ import { formatStorage } from '../api/utils';
 const AdminPage = () => {
   const dispatch = useDispatch();
   const navigate = useNavigate();
-  const { users, status, error } = useSelector(state => state.admin);
+  const { users, status, error, nextCursor, loadingMore } = useSelector(state => state.admin);
   
   useEffect(() => {
     dispatch(fetchUsers());
@@ -118,6 +118,11 @@ const AdminPage = () => {
         rowKey="id"
         loading={status === 'loading'}
       />
+      {nextCursor && (
+        <Button onClick={() => dispatch(fetchMoreUsers())} loading={loadingMore} style={{ marginTop: 16 }}>
+          Загрузить еще
+        </Button>
+      )}
     </div>
   );
 };
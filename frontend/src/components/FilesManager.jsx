@@ -21,7 +21,7 @@ import {
   FileOutlined,
   SearchOutlined,
 } from '@ant-design/icons';
-import { fetchFiles, uploadFile, deleteFile, downloadFile, updateFileComment } from '../store/slices/filesSlice';
+import { fetchFiles, fetchMoreFiles, uploadFile, deleteFile, downloadFile, updateFileComment } from '../store/slices/filesSlice';
 import ShareButton from './ShareButton';
 import { formatDate, formatStorage } from '../api/utils';
 import '../css/files.css';
@@ -33,7 +33,7 @@ const MAX_FILE_SIZE = 50 * 1024 * 1024; // 50MB в байтах
 
 const FilesManager = () => {
   const dispatch = useDispatch();
-  const { files = [], status } = useSelector(state => state.files);
+  const { files = [], status, nextCursor, loadingMore } = useSelector(state => state.files);
   const [searchText, setSearchText] = useState('');
   const [uploadModalVisible, setUploadModalVisible] = useState(false);
   const [comment, setComment] = useState('');
@@ -307,6 +307,11 @@ const handleDownload = async (fileId) => {
       locale={{ emptyText: 'Нет загруженных файлов' }}
       style={{ width: '100%' }}
       />
+      {nextCursor && (
+        <Button onClick={() => dispatch(fetchMoreFiles())} loading={loadingMore} style={{ marginTop: 16 }}>
+          Загрузить еще
+        </Button>
+      )}
 
       {/* Модальное окно загрузки файла */}
       <Modal
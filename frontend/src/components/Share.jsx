@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { Button, Card, Spin, message } from 'antd';
+import { Button, Card, Input, Space, Spin, message } from 'antd';
 import { DownloadOutlined } from '@ant-design/icons';
 import apiClient, { downloadClient } from '../api/client';
 import { formatDate, formatStorage } from '../api/utils';
@@ -12,25 +12,45 @@ const ShareDownloadPage = () => {
   const [fileInfo, setFileInfo] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [passwordRequired, setPasswordRequired] = useState(false);
+  const [password, setPassword] = useState('');
 
-  useEffect(() => {
-    const fetchFileInfo = async () => {
-      try {
-        const response = await apiClient.get(`/files/share/${shareLink}/info/`);
-        setFileInfo(response.data);
-      } catch (err) {
+  // Пароль ссылки передается заголовком, чтобы не попадать в логи с адресом
+  const passwordHeaders = () => (password ? { 'X-Share-Password': password } : {});
+
+  const fetchFileInfo = async () => {
+    setLoading(true);
+    try {
+      const response = await apiClient.get(`/files/share/${shareLink}/info/`, {
+        headers: passwordHeaders(),
+      });
+      setFileInfo(response.data);
+      setPasswordRequired(false);
+      setError(null);
+    } catch (err) {
+      if (err.response?.data?.password_required) {
+        if (passwordRequired) {
+          message.error('Неверный пароль');
+        }
+        setPasswordRequired(true);
+      } else {
         setError(err.response?.data?.error || 'Не удалось загрузить информацию о файле');
-      } finally {
-        setLoading(false);
       }
-    };
+    } finally {
+      setLoading(false);
+    }
+  };
 
+  useEffect(() => {
     fetchFileInfo();
+    // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [shareLink]);
 
   const handleDownload = async () => {
     try {
-      const response = await downloadClient.get(`/files/share/${shareLink}/`);
+      const response = await downloadClient.get(`/files/share/${shareLink}/`, {
+        headers: passwordHeaders(),
+      });
       
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
@@ -48,7 +68,14 @@ const ShareDownloadPage = () => {
       
       message.success('Файл начал скачиваться');
     } catch (err) {
-      message.error(err.response?.data?.error || 'Ошибка при скачивании файла');
+      // Тело ошибки при responseType: 'blob' приходит как Blob с JSON
+      let text = 'Ошибка при скачивании файла';
+      try {
+        text = JSON.parse(await err.response.data.text()).error || text;
+      } catch {
+        // ответ без JSON, оставляем общее сообщение
+      }
+      message.error(text);
     }
   };
 
@@ -60,6 +87,26 @@ const ShareDownloadPage = () => {
     );
   }
 
+  if (passwordRequired) {
+    return (
+      <div className="download-container">
+        <Card title="Файл защищен паролем">
+          <Space.Compact block>
+            <Input.Password
+              value={password}
+              onChange={(e) => setPassword(e.target.value)}
+              onPressEnter={fetchFileInfo}
+              placeholder="Пароль"
+            />
+            <Button type="primary" onClick={fetchFileInfo}>
+              Открыть
+            </Button>
+          </Space.Compact>
+        </Card>
+      </div>
+    );
+  }
+
   if (error) {
     return (
       <div className="download-container">
@@ -86,6 +133,12 @@ const ShareDownloadPage = () => {
               'не загружался'
             }</p>
           <p><strong>Комментарий к файлу: </strong>{fileInfo.comment || 'нет комментария'}</p>
+          {fileInfo.expires_at && (
+            <p><strong>Ссылка действует до: </strong>{formatDate(fileInfo.expires_at)}</p>
+          )}
+          {fileInfo.downloads_left !== null && fileInfo.downloads_left !== undefined && (
+            <p><strong>Осталось скачиваний: </strong>{fileInfo.downloads_left}</p>
+          )}
         </div>
         
         <Button 
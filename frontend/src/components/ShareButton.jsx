@@ -17,16 +17,25 @@ const ShareButton = ({ fileId, apiUrl = '/files' }) => {
   const generateShareLink = async () => {
     setIsLoading(true);
     try {
-      const response = await apiClient.get(`${apiUrl}/${fileId}`, {
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('access_token')}`
-        }
-      });
+      const headers = {
+        'Authorization': `Bearer ${localStorage.getItem('access_token')}`
+      };
+      const [fileResponse, linksResponse] = await Promise.all([
+        apiClient.get(`${apiUrl}/${fileId}`, { headers }),
+        apiClient.get('/share_links/', { params: { file: fileId }, headers }),
+      ]);
+      setLastDownload(fileResponse.data.last_download);
 
-      const shareToken = response.data.share_link;
-      setLastDownload(response.data.last_download);
+      // Используем действующую ссылку без ограничений, иначе создаем новую
+      let link = linksResponse.data.find(
+        (item) => item.is_active && !item.has_password && !item.expires_at && !item.max_downloads
+      );
+      if (!link) {
+        const created = await apiClient.post('/share_links/', { file: fileId }, { headers });
+        link = created.data;
+      }
 
-      const fullShareUrl = `${window.location.origin}/share/${shareToken}/`;
+      const fullShareUrl = `${window.location.origin}/share/${link.token}/`;
       
       setShareLink(fullShareUrl);
       
@@ -1,7 +1,7 @@
 import { useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { useSelector, useDispatch } from 'react-redux';
-import { fetchAdminFiles } from '../store/slices/filesSlice';
+import { fetchAdminFiles, fetchMoreFiles } from '../store/slices/filesSlice';
 import { deleteFile, downloadFile } from '../store/slices/filesSlice';
 import { formatDate, formatStorage } from '../api/utils';
 import { Table, Button, Space, Typography, Popconfirm, message } from 'antd';
@@ -14,7 +14,7 @@ const UserFilesPage = () => {
   const { userId } = useParams();
   const dispatch = useDispatch();
   const navigate = useNavigate();
-  const { files, status } = useSelector(state => state.files);
+  const { files, status, nextCursor, loadingMore } = useSelector(state => state.files);
 
   useEffect(() => {
     dispatch(fetchAdminFiles(userId));
@@ -124,6 +124,11 @@ const UserFilesPage = () => {
         pagination={{ pageSize: 10 }}
         locale={{ emptyText: 'Нет файлов' }}
       />
+      {nextCursor && (
+        <Button onClick={() => dispatch(fetchMoreFiles())} loading={loadingMore} style={{ marginTop: 16 }}>
+          Загрузить еще
+        </Button>
+      )}
     </div>
   );
 };
@@ -1,13 +1,24 @@
 import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
-import apiClient from '../../api/client';
+import apiClient, { getPage } from '../../api/client';
 
 // Асинхронные действия
 export const fetchUsers = createAsyncThunk(
   'admin/fetchUsers',
   async (_, { rejectWithValue }) => {
     try {
-      const response = await apiClient.get('/users/');
-      return response.data;
+      return await getPage('/users/');
+    } catch (error) {
+      return rejectWithValue(error.response.data);
+    }
+  }
+);
+
+// Следующая страница списка пользователей
+export const fetchMoreUsers = createAsyncThunk(
+  'admin/fetchMoreUsers',
+  async (_, { getState, rejectWithValue }) => {
+    try {
+      return await getPage('/users/', {}, getState().admin.nextCursor);
     } catch (error) {
       return rejectWithValue(error.response.data);
     }
@@ -41,12 +52,15 @@ const adminSlice = createSlice({
   name: 'admin',
   initialState: {
     users: [],
+    nextCursor: null,
+    loadingMore: false,
     status: 'idle',
     error: null
   },
   reducers: {
     resetAdminState: (state) => {
       state.users = [];
+      state.nextCursor = null;
       state.status = 'idle';
       state.error = null;
     }
@@ -59,12 +73,27 @@ const adminSlice = createSlice({
       })
       .addCase(fetchUsers.fulfilled, (state, action) => {
         state.status = 'succeeded';
-        state.users = action.payload;
+        state.users = action.payload.results;
+        state.nextCursor = action.payload.cursor;
       })
       .addCase(fetchUsers.rejected, (state, action) => {
         state.status = 'failed';
         state.error = action.error.message;
       })
+
+      // Следующая страница пользователей
+      .addCase(fetchMoreUsers.pending, (state) => {
+        state.loadingMore = true;
+      })
+      .addCase(fetchMoreUsers.fulfilled, (state, action) => {
+        state.loadingMore = false;
+        state.users.push(...action.payload.results);
+        state.nextCursor = action.payload.cursor;
+      })
+      .addCase(fetchMoreUsers.rejected, (state, action) => {
+        state.loadingMore = false;
+        state.error = action.error.message;
+      })
       
       // Удаление пользователя
       .addCase(deleteUser.fulfilled, (state, action) => {
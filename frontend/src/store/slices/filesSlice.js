@@ -1,5 +1,5 @@
 import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
-import apiClient from '../../api/client';
+import apiClient, { getPage } from '../../api/client';
 
 export const fetchFiles = createAsyncThunk(
   'files/fetchFiles',
@@ -11,8 +11,17 @@ export const fetchFiles = createAsyncThunk(
       params.user_id = userId;
     }
 
-    const response = await apiClient.get('/files/', { params });
-    return response.data;
+    const page = await getPage('/files/', params);
+    return { ...page, request: { url: '/files/', params } };
+  }
+);
+
+// Следующая страница того же списка, что загрузил fetchFiles или fetchAdminFiles
+export const fetchMoreFiles = createAsyncThunk(
+  'files/fetchMoreFiles',
+  async (_, { getState }) => {
+    const { listRequest, nextCursor } = getState().files;
+    return await getPage(listRequest.url, listRequest.params, nextCursor);
   }
 );
 
@@ -117,8 +126,9 @@ export const fetchAdminFiles = createAsyncThunk(
   'files/fetchAdminFiles',
   async (userId, { rejectWithValue }) => {
     try {
-      const response = await apiClient.get(`/users/${userId}/files/`);
-      return response.data;
+      const url = `/users/${userId}/files/`;
+      const page = await getPage(url);
+      return { ...page, request: { url, params: {} } };
     } catch (error) {
       return rejectWithValue(error.response.data);
     }
@@ -129,6 +139,9 @@ const filesSlice = createSlice({
   name: 'files',
   initialState: {
     files: [],
+    nextCursor: null,
+    listRequest: null,
+    loadingMore: false,
     status: 'idle',
     error: null,
     uploadProgress: 0
@@ -136,6 +149,8 @@ const filesSlice = createSlice({
   reducers: {
     resetFilesState: (state) => {
       state.files = [];
+      state.nextCursor = null;
+      state.listRequest = null;
       state.status = 'idle';
       state.error = null;
     },
@@ -151,12 +166,28 @@ const filesSlice = createSlice({
       })
       .addCase(fetchFiles.fulfilled, (state, action) => {
         state.status = 'succeeded';
-        state.files = action.payload || [];
+        state.files = action.payload.results;
+        state.nextCursor = action.payload.cursor;
+        state.listRequest = action.payload.request;
       })
       .addCase(fetchFiles.rejected, (state, action) => {
         state.status = 'failed';
         state.error = action.error.message;
       })
+
+      // Следующая страница списка
+      .addCase(fetchMoreFiles.pending, (state) => {
+        state.loadingMore = true;
+      })
+      .addCase(fetchMoreFiles.fulfilled, (state, action) => {
+        state.loadingMore = false;
+        state.files.push(...action.payload.results);
+        state.nextCursor = action.payload.cursor;
+      })
+      .addCase(fetchMoreFiles.rejected, (state, action) => {
+        state.loadingMore = false;
+        state.error = action.error.message;
+      })
       
       // Загрузка нового файла
       .addCase(uploadFile.pending, (state) => {
@@ -205,7 +236,9 @@ const filesSlice = createSlice({
 
       // Получаем список файлов пользователя для админа
       .addCase(fetchAdminFiles.fulfilled, (state, action) => {
-      state.files = action.payload;
+      state.files = action.payload.results;
+      state.nextCursor = action.payload.cursor;
+      state.listRequest = action.payload.request;
       state.status = 'succeeded';
       })
       .addCase(fetchAdminFiles.rejected, (state, action) => {